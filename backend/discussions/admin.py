@@ -16,7 +16,7 @@ class PostAdmin(admin.ModelAdmin):
     list_display = ['title', 'author', 'room', 'post_type', 'is_pinned', 'upvotes', 'downvotes', 'created_at']
     list_filter = ['post_type', 'is_pinned', 'created_at']
     search_fields = ['title', 'content', 'author__username']
-    readonly_fields = ['created_at', 'updated_at', 'upvotes', 'downvotes', 'comments_count']
+    readonly_fields = ['created_at', 'updated_at', 'upvotes', 'downvotes', 'comments_count', 'score', 'hot_score', 'top_score', 'controversy_score']
 
 
 @admin.register(Comment)
@@ -24,7 +24,7 @@ class CommentAdmin(admin.ModelAdmin):
     list_display = ['author', 'post', 'parent', 'upvotes', 'downvotes', 'is_deleted', 'created_at']
     list_filter = ['is_deleted', 'created_at']
     search_fields = ['content', 'author__username', 'post__title']
-    readonly_fields = ['created_at', 'updated_at', 'upvotes', 'downvotes']
+    readonly_fields = ['created_at', 'updated_at', 'upvotes', 'downvotes', 'path', 'depth']
 
 
 @admin.register(PostVote)
@@ -43,6 +43,7 @@ class CommentVoteAdmin(admin.ModelAdmin):
 
 @admin.register(PostAttachment)
 class PostAttachmentAdmin(admin.ModelAdmin):
-    list_display = ['name', 'post', 'type', 'size', 'created_at']
+    list_display = ['name', 'post', 'type', 'content_type', 'size', 'created_at']
     list_filter = ['type', 'created_at']
     search_fields = ['name', 'post__title']
+    readonly_fields = ['size', 'content_type', 'checksum', 'thumbnail']
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class DiscussionsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'discussions'
+
+    def ready(self):
+        from .search import create_search_indexes
+
+        # GIN indexes for post search exist on PostgreSQL only, so they are not in Post.Meta
+        post_migrate.connect(create_search_indexes, sender=self)
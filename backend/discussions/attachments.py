@@ -0,0 +1,216 @@
+"""
+Post attachment uploads
+
+AttachmentMultiPartParser (see views) has already streamed each file to
+memory or a temp file, hashing, sizing and sniffing it on the way. Only
+the extensions in ATTACHMENT_TYPES are accepted, and the magic bytes must
+match the extension. The
+files of a post are then written to the default storage (GCS or the local
+MEDIA_ROOT) concurrently on a process-wide pool of
+DISCUSSION_ATTACHMENT_UPLOAD_WORKERS threads, so a post with several files
+costs about one storage round trip instead of one per file, and a burst of
+posts cannot open unbounded connections to storage.
+
+Thumbnails of image attachments are generated with Pillow once the post is
+committed, on a separate small pool, so the request never waits for
+decoding; generate_attachment_thumbnails fills in any that were lost to a
+restart.
+"""
+
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+
+from exams.upload_handlers import DOCX_CONTENT_TYPE, SNIFF_LENGTH, sniff_content_type
+
+try:
+    from PIL import Image, ImageOps
+    THUMBNAILS_AVAILABLE = True
+except ImportError:
+    THUMBNAILS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Files accepted with one post
+MAX_ATTACHMENTS = 10
+# Extension -> content type the magic bytes must show (None: no signature,
+# i.e. plain text). Anything else, HTML and SVG included, is rejected so
+# nothing a browser would run is ever served from our origin.
+ATTACHMENT_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.pdf': 'application/pdf',
+    '.doc': 'application/msword',
+    '.docx': 'application/zip',
+    '.txt': None,
+}
+# Stored content type where it differs from the sniffed one
+STORED_CONTENT_TYPES = {'.docx': DOCX_CONTENT_TYPE, '.txt': 'text/plain'}
+# Longest side of a thumbnail in pixels
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_QUALITY = 80
+# Images Pillow can decode for a thumbnail (as sniffed from the magic bytes)
+THUMBNAIL_TYPES = {'image/png', 'image/jpeg', 'image/gif', 'image/webp'}
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name, workers):
+    """Process-wide thread pool, created on first use"""
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = _executors[name] = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix=f'attachment-{name}'
+            )
+        return executor
+
+
+def attachment_content_type(uploaded_file):
+    """
+    Content type of an allowed attachment, from its extension checked
+    against its magic bytes; the browser-sent header is never trusted
+    """
+    ext = os.path.splitext(uploaded_file.name or '')[1].lower()
+    if ext not in ATTACHMENT_TYPES:
+        raise ValidationError(
+            _('File type not allowed. Please upload images, PDF, DOC, DOCX or TXT files only.'),
+            code='invalid_extension',
+        )
+    uploaded_file.seek(0)
+    head = uploaded_file.read(SNIFF_LENGTH)
+    uploaded_file.seek(0)
+    if sniff_content_type(head) != ATTACHMENT_TYPES[ext]:
+        raise ValidationError(_('File content does not match its extension.'), code='invalid_content')
+    return STORED_CONTENT_TYPES.get(ext, ATTACHMENT_TYPES[ext])
+
+
+def validate_attachment(uploaded_file):
+    attachment_content_type(uploaded_file)
+
+
+def store_attachments(post, files):
+    """
+    Store uploaded files for a post, concurrently, and create their
+    PostAttachment rows; thumbnails are queued for after commit
+    """
+    from .models import PostAttachment
+
+    if not files:
+        return []
+
+    field = PostAttachment._meta.get_field('file')
+    storage = field.storage
+    executor = get_executor('upload', getattr(settings, 'DISCUSSION_ATTACHMENT_UPLOAD_WORKERS', 4))
+
+    attachments = []
+    for uploaded_file in files:
+        content_type = attachment_content_type(uploaded_file)
+        # Storage backends that take the content type from the file get the checked one
+        uploaded_file.content_type = content_type
+        attachment = PostAttachment(
+            post=post,
+            type='image' if content_type.startswith('image/') else 'file',
+            name=os.path.basename(uploaded_file.name or '')[:200],
+            size=uploaded_file.size,
+            content_type=content_type,
+            checksum=getattr(uploaded_file, 'sha256', ''),
+        )
+        attachments.append((attachment, uploaded_file))
+
+    futures = [
+        executor.submit(storage.save, field.generate_filename(attachment, uploaded_file.name), uploaded_file)
+        for attachment, uploaded_file in attachments
+    ]
+    wait(futures)
+    stored = [future.result() for future in futures if future.exception() is None]
+    failed = [future.exception() for future in futures if future.exception() is not None]
+    if failed:
+        # Nothing references the files that did make it
+        for name in stored:
+            storage.delete(name)
+        raise failed[0]
+
+    for (attachment, _uploaded_file), future in zip(attachments, futures):
+        attachment.file.name = future.result()
+    try:
+        created = PostAttachment.objects.bulk_create([attachment for attachment, _ in attachments])
+    except Exception:
+        for name in stored:
+            storage.delete(name)
+        raise
+
+    image_ids = [attachment.id for attachment in created if attachment.content_type in THUMBNAIL_TYPES]
+    if image_ids:
+        transaction.on_commit(lambda: queue_thumbnails(image_ids))
+    return created
+
+
+def queue_thumbnails(attachment_ids):
+    """Generate thumbnails on the background pool"""
+    if not THUMBNAILS_AVAILABLE:
+        return
+    executor = get_executor('thumbnail', getattr(settings, 'DISCUSSION_ATTACHMENT_THUMBNAIL_WORKERS', 2))
+    for attachment_id in attachment_ids:
+        executor.submit(_generate_in_background, attachment_id)
+
+
+def _generate_in_background(attachment_id):
+    try:
+        generate_thumbnail(attachment_id)
+    except Exception:
+        logger.exception('Failed to generate a thumbnail for post attachment %s', attachment_id)
+    finally:
+        close_old_connections()
+
+
+def render_thumbnail(source):
+    """JPEG bytes of a thumbnail for an image file object"""
+    with Image.open(source) as image:
+        # Decode at a reduced scale where the format allows (JPEG), instead of full size
+        image.draft('RGB', THUMBNAIL_SIZE)
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(THUMBNAIL_SIZE)
+        if image.mode != 'RGB':
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+def generate_thumbnail(attachment_id):
+    """Store a thumbnail for an image attachment; returns whether one was made"""
+    from .models import PostAttachment
+
+    attachment = PostAttachment.objects.filter(id=attachment_id).first()
+    if attachment is None or not attachment.file or attachment.thumbnail:
+        return False
+
+    with attachment.file.open('rb') as source:
+        content = render_thumbnail(source)
+
+    base = os.path.splitext(os.path.basename(attachment.file.name))[0]
+    field = PostAttachment._meta.get_field('thumbnail')
+    name = field.storage.save(field.generate_filename(attachment, f'{base}.jpg'), ContentFile(content))
+    unset = Q(thumbnail='') | Q(thumbnail__isnull=True)
+    if not PostAttachment.objects.filter(unset, id=attachment_id).update(thumbnail=name):
+        # Deleted meanwhile, or another worker got there first
+        field.storage.delete(name)
+        return False
+    return True
@@ -0,0 +1,86 @@
+"""
+Threaded comments
+
+Every Comment stores a materialized path: the zero-padded ids of its
+ancestors and itself concatenated, e.g.
+
+    0000000012                       top-level comment 12
+    00000000120000000031             reply 31 to comment 12
+    000000001200000000310000000040   reply 40 to reply 31
+
+Ordering a post's comments by path is a depth-first walk of the tree with
+siblings oldest first, so the whole tree, or the first N replies of a
+thread, comes back from one index range scan on (post, path), and every
+parent is read before its replies. build_tree then links the rows in a
+single pass.
+
+The first segment identifies the thread (the top-level comment), which is
+what thread_page partitions on to fetch a page of threads with a bounded
+number of replies each.
+"""
+
+from django.db.models import Count, F, Window
+from django.db.models.functions import DenseRank, RowNumber, Substr
+
+# Digits per path segment; ids up to 10**10 - 1
+PATH_STEP = 10
+# Comment.path is 255 characters long
+MAX_COMMENT_DEPTH = 255 // PATH_STEP - 1
+
+
+def path_segment(pk):
+    return f'{pk:0{PATH_STEP}d}'
+
+
+def thread_key(path):
+    """Path of the top-level comment a path belongs to"""
+    return path[:PATH_STEP]
+
+
+def after_thread(path):
+    """Lower bound (exclusive) for paths of threads after the given one"""
+    # ':' sorts right after '9', so this is above every path in the thread
+    return thread_key(path) + ':'
+
+
+def build_tree(comments):
+    """
+    Link comments ordered by path into trees in O(n)
+
+    Each comment gets a children list; returns the top-level ones. A comment
+    whose parent is not among the rows (e.g. a deleted branch) is returned
+    as a root.
+    """
+    nodes = {}
+    roots = []
+    for comment in comments:
+        comment.children = []
+        nodes[comment.pk] = comment
+        parent = nodes.get(comment.parent_id)
+        if parent is None:
+            roots.append(comment)
+        else:
+            parent.children.append(comment)
+    return roots
+
+
+def thread_page(queryset, after=None, threads=20, replies=3):
+    """
+    One query for up to `threads` + 1 threads after the `after` path, each
+    with its top-level comment and first `replies` replies in tree order
+
+    Rows are annotated with thread_rank and thread_size (comments in the
+    whole thread, root included). The caller drops the extra thread, which
+    only signals that there is a next page.
+    """
+    if after:
+        queryset = queryset.filter(path__gt=after_thread(after))
+    thread = Substr('path', 1, PATH_STEP)
+    return queryset.annotate(
+        thread_rank=Window(DenseRank(), order_by=thread.asc()),
+        reply_rank=Window(RowNumber(), partition_by=[thread], order_by=F('path').asc()),
+        thread_size=Window(Count('id'), partition_by=[thread]),
+    ).filter(
+        thread_rank__lte=threads + 1,
+        reply_rank__lte=replies + 1,
+    ).order_by('path')
@@ -0,0 +1,159 @@
+"""
+WebSocket endpoint for realtime room events (see events)
+
+    ws(s)://<host>/ws/discussion-rooms/<room_id>/events/?ticket=<ticket>
+
+Browsers cannot set headers on a WebSocket, and a DRF token in the query
+string would end up in access logs. Browsers therefore first POST to
+/api/discussion-rooms/<room_id>/events-ticket/ for a signed ticket, which
+is only good for that room and for TICKET_MAX_AGE seconds. Other clients
+may send an "Authorization: Token <key>" header instead. Any authenticated
+user may follow a room, as with the post list.
+
+The server only sends; after accepting, a connection costs a queue and one
+task waiting on it. While a room is quiet a {"type": "ping"} frame goes out
+every DISCUSSION_EVENTS_HEARTBEAT seconds so proxies keep the connection.
+
+Close codes: 4401 missing or invalid token, 4404 unknown room or path,
+4408 the client fell too far behind and should reload the room. Refused
+connections are accepted and closed right away, since browsers only see
+the close code, not the status of a rejected handshake.
+"""
+
+import asyncio
+import re
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.db import close_old_connections
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .events import Subscription, encode_event, get_broker
+from .models import DiscussionRoom
+
+ROOM_EVENTS_PATH = re.compile(r'^/ws/discussion-rooms/(?P<room_id>\d+)/events/$')
+
+CLOSE_UNAUTHENTICATED = 4401
+CLOSE_NOT_FOUND = 4404
+CLOSE_TOO_SLOW = 4408
+
+TICKET_SALT = 'discussions.room-events'
+# Seconds a ticket may be used for after it was issued
+TICKET_MAX_AGE = 60
+
+
+def sign_ticket(user, room_id):
+    """Ticket that lets user open the events WebSocket of one room"""
+    return signing.dumps({'user': user.pk, 'room': room_id}, salt=TICKET_SALT)
+
+
+def get_credentials(scope):
+    """('ticket', value), ('token', value) or None"""
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    if query.get('ticket'):
+        return 'ticket', query['ticket'][0]
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            parts = value.decode('latin-1').split()
+            if len(parts) == 2 and parts[0].lower() == 'token':
+                return 'token', parts[1]
+    return None
+
+
+def ticket_user_id(ticket, room_id):
+    """The user a valid ticket for room_id was issued to, else None"""
+    try:
+        data = signing.loads(ticket, salt=TICKET_SALT, max_age=TICKET_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    if data.get('room') != room_id:
+        return None
+    return data.get('user')
+
+
+@sync_to_async(thread_sensitive=False)
+def authorize(credentials, room_id):
+    """
+    Close code refusing the connection, or None to accept it
+
+    Runs on the thread pool rather than the single thread-sensitive thread,
+    so a burst of reconnecting clients is authorized in parallel.
+    """
+    close_old_connections()
+    try:
+        if credentials is None:
+            return CLOSE_UNAUTHENTICATED
+        kind, value = credentials
+        if kind == 'ticket':
+            user_id = ticket_user_id(value, room_id)
+            if user_id is None or not get_user_model().objects.filter(pk=user_id, is_active=True).exists():
+                return CLOSE_UNAUTHENTICATED
+        else:
+            try:
+                TokenAuthentication().authenticate_credentials(value)
+            except AuthenticationFailed:
+                return CLOSE_UNAUTHENTICATED
+        if not DiscussionRoom.objects.filter(id=room_id).exists():
+            return CLOSE_NOT_FOUND
+        return None
+    finally:
+        close_old_connections()
+
+
+async def reject(send, code):
+    await send({'type': 'websocket.accept'})
+    await send({'type': 'websocket.close', 'code': code})
+
+
+async def send_events(subscription, send, heartbeat):
+    ping = encode_event('ping', subscription.room_id, None)
+    while True:
+        try:
+            message = await asyncio.wait_for(subscription.get(), heartbeat)
+        except asyncio.TimeoutError:
+            message = ping
+        if message is Subscription.OVERFLOW:
+            await send({'type': 'websocket.close', 'code': CLOSE_TOO_SLOW})
+            return
+        await send({'type': 'websocket.send', 'text': message})
+
+
+async def room_events(scope, receive, send, room_id):
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+
+    code = await authorize(get_credentials(scope), room_id)
+    if code is not None:
+        await reject(send, code)
+        return
+
+    broker = get_broker()
+    subscription = broker.subscribe(room_id)
+    sender = None
+    try:
+        await send({'type': 'websocket.accept'})
+        sender = asyncio.create_task(
+            send_events(subscription, send, getattr(settings, 'DISCUSSION_EVENTS_HEARTBEAT', 30))
+        )
+        # Incoming frames are ignored; wait for the client (or server) to close
+        while (await receive())['type'] != 'websocket.disconnect':
+            pass
+    finally:
+        if sender is not None:
+            sender.cancel()
+        broker.unsubscribe(subscription)
+
+
+async def websocket_application(scope, receive, send):
+    """ASGI application for websocket scopes, mounted by mysite.asgi"""
+    match = ROOM_EVENTS_PATH.match(scope['path'])
+    if match is None:
+        if (await receive())['type'] == 'websocket.connect':
+            await reject(send, CLOSE_NOT_FOUND)
+        return
+    await room_events(scope, receive, send, int(match['room_id']))
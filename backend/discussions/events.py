@@ -0,0 +1,219 @@
+"""
+Realtime room events
+
+Views publish an event when a post or comment is created or a vote changes
+its counters; every WebSocket connected to the room (see consumers) gets it
+as a JSON text frame:
+
+    {"type": "post.created", "room_id": 3, "data": {...PostSerializer}}
+    {"type": "comment.created", "room_id": 3, "data": {...CommentSerializer}}
+    {"type": "post.voted", "room_id": 3,
+     "data": {"post_id": 9, "upvotes": 4, "downvotes": 1, "score": 3, "delta": {"upvotes": 1, "score": 1}}}
+    {"type": "comment.voted", "room_id": 3, "data": {"comment_id": 12, "post_id": 9, "upvotes": 2, "downvotes": 0}}
+
+Events are published once the surrounding transaction commits and encoded
+once, whatever the number of subscribers. Fan-out goes through the broker
+chosen by DISCUSSION_EVENTS_BACKEND:
+
+- memory: subscribers of this process only (development, where one
+  process serves both the API and WebSockets)
+- redis: PUBLISH on discussions:room:<id>; each worker holds one pattern
+  subscription and fans messages out to its own connections
+
+Each subscriber has a bounded queue; one that falls DISCUSSION_EVENTS_QUEUE_SIZE
+events behind is dropped (see Subscription.OVERFLOW) rather than buffering
+without limit, and the client reloads the room.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+REDIS_CHANNEL_PREFIX = 'discussions:room:'
+# Seconds between attempts to re-establish a lost Redis subscription
+REDIS_RECONNECT_DELAY = 1
+
+
+class Subscription:
+    """One connection's queue of encoded events for a room, read on its event loop"""
+
+    # Queued in place of the pending events when the consumer falls too far behind
+    OVERFLOW = object()
+
+    def __init__(self, room_id, loop, queue_size):
+        self.room_id = room_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def put(self, message):
+        """Runs on the subscription's loop"""
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(self.OVERFLOW)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class InProcessBroker:
+    """Fans events out to the subscriptions of this process; publish is thread-safe"""
+
+    # Whether events published in one process reach subscribers in another
+    cross_process = False
+
+    def __init__(self, queue_size=None):
+        self.queue_size = queue_size or getattr(settings, 'DISCUSSION_EVENTS_QUEUE_SIZE', 100)
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, room_id):
+        """Call from the event loop that will read the subscription"""
+        subscription = Subscription(room_id, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscriptions[room_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.room_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.room_id]
+
+    def subscriber_count(self, room_id=None):
+        with self._lock:
+            if room_id is not None:
+                return len(self._subscriptions.get(room_id, ()))
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def deliver(self, room_id, message):
+        """Hand an encoded event to every local subscriber of the room, from any thread"""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(room_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, message)
+            except RuntimeError:
+                # The connection's loop has shut down; it unsubscribes on its way out
+                pass
+
+    def publish(self, room_id, message):
+        self.deliver(room_id, message)
+
+
+class RedisBroker(InProcessBroker):
+    """
+    Publishes through Redis so every worker sees every event; each worker
+    runs a single listener that delivers to its local subscriptions
+    """
+
+    cross_process = True
+
+    def __init__(self, url=None, queue_size=None):
+        super().__init__(queue_size)
+        self.url = url or settings.DISCUSSION_EVENTS_REDIS_URL
+        self._client = None
+        self._listeners = {}
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def publish(self, room_id, message):
+        self.client.publish(f'{REDIS_CHANNEL_PREFIX}{room_id}', message)
+
+    def subscribe(self, room_id):
+        subscription = super().subscribe(room_id)
+        loop = subscription.loop
+        with self._lock:
+            listener = self._listeners.get(loop)
+            if listener is None or listener.done():
+                self._listeners[loop] = loop.create_task(self.listen())
+        return subscription
+
+    async def listen(self):
+        import redis.asyncio
+
+        while True:
+            client = redis.asyncio.Redis.from_url(self.url)
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.psubscribe(f'{REDIS_CHANNEL_PREFIX}*')
+                async for item in pubsub.listen():
+                    channel = item['channel'].decode()
+                    try:
+                        room_id = int(channel[len(REDIS_CHANNEL_PREFIX):])
+                    except ValueError:
+                        continue
+                    self.deliver(room_id, item['data'].decode())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Lost the Redis subscription for discussion events; reconnecting')
+                await asyncio.sleep(REDIS_RECONNECT_DELAY)
+            finally:
+                await pubsub.aclose()
+                await client.aclose()
+
+
+BROKERS = {
+    'memory': 'discussions.events.InProcessBroker',
+    'redis': 'discussions.events.RedisBroker',
+}
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    """The process-wide broker for DISCUSSION_EVENTS_BACKEND"""
+    backend = getattr(settings, 'DISCUSSION_EVENTS_BACKEND', 'memory')
+    return import_string(BROKERS.get(backend, backend))()
+
+
+def check_cross_process_broker():
+    """
+    Raise ImproperlyConfigured unless DISCUSSION_EVENTS_BACKEND reaches
+    other processes: required where WebSockets are served by a process
+    other than the one handling the API (see mysite.workers)
+    """
+    backend = getattr(settings, 'DISCUSSION_EVENTS_BACKEND', 'memory')
+    broker_class = import_string(BROKERS.get(backend, backend))
+    if not getattr(broker_class, 'cross_process', False):
+        raise ImproperlyConfigured(
+            f'DISCUSSION_EVENTS_BACKEND={backend!r} only delivers within one process; events published '
+            'by the API workers would never reach a separate WebSocket process. Use the redis backend.'
+        )
+
+
+def encode_event(event_type, room_id, data):
+    return json.dumps({'type': event_type, 'room_id': room_id, 'data': data}, default=str)
+
+
+def publish_room_event(room_id, event_type, data):
+    """Publish to the room's subscribers once the current transaction commits"""
+    message = encode_event(event_type, room_id, data)
+
+    def send():
+        try:
+            get_broker().publish(room_id, message)
+        except Exception:
+            # Realtime delivery is best effort; the write itself succeeded
+            logger.exception('Failed to publish %s for room %s', event_type, room_id)
+
+    transaction.on_commit(send)
@@ -0,0 +1,98 @@
+"""
+Compare ways of scoring a large room.
+
+Builds a synthetic room (no database writes) with a long-tailed vote
+distribution and times, for every ranking:
+
+- python: the per-post scalar formula in a loop (what per-row code costs)
+- numpy: score_many as used by refresh_post_rankings, including the
+  conversion from and to Python lists
+- arrays: score_arrays alone on arrays that are already built
+
+With --database it also times the old approach of ordering a room by a
+correlated vote-count subquery against the stored, indexed column, on the
+largest existing room.
+
+    python manage.py benchmark_post_ranking --posts 100000
+"""
+
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from discussions.models import DiscussionRoom, PostVote
+from discussions.ranking import NUMPY_AVAILABLE, RANKINGS
+
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark post ranking computation on a large synthetic room'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100_000,
+                            help='Posts in the synthetic room')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Runs per measurement (median is reported)')
+        parser.add_argument('--database', action='store_true',
+                            help='Also time SQL ordering on the largest existing room')
+
+    def handle(self, *args, **options):
+        if not NUMPY_AVAILABLE:
+            raise CommandError('NumPy is not installed')
+        import numpy as np
+
+        rng = random.Random(42)
+        count, repeat = options['posts'], options['repeat']
+        upvotes = [int(rng.paretovariate(1.2)) - 1 for _ in range(count)]
+        downvotes = [int(rng.paretovariate(1.5)) - 1 for _ in range(count)]
+        ages = [rng.uniform(0, 24 * 30) for _ in range(count)]
+
+        self.stdout.write(f'{count} posts, median of {repeat} runs')
+        arrays = [np.asarray(values, dtype=np.float64) for values in (upvotes, downvotes, ages)]
+
+        self.stdout.write(f"{'ranking':<15}{'python':>12}{'numpy':>12}{'arrays':>12}{'speedup':>10}")
+        for ranking in RANKINGS.values():
+            python_time = timed(
+                lambda: [ranking.score(*post) for post in zip(upvotes, downvotes, ages)], repeat
+            )
+            numpy_time = timed(lambda: ranking.score_many(upvotes, downvotes, ages), repeat)
+            arrays_time = timed(lambda: ranking.score_arrays(*arrays), repeat)
+            self.stdout.write(
+                f'{ranking.name:<15}{python_time * 1000:>10.1f}ms{numpy_time * 1000:>10.1f}ms'
+                f'{arrays_time * 1000:>10.1f}ms{python_time / numpy_time:>9.1f}x'
+            )
+
+        if options['database']:
+            self.benchmark_database(repeat)
+
+    def benchmark_database(self, repeat):
+        room = DiscussionRoom.objects.annotate(n=Count('posts')).order_by('-n').first()
+        if room is None or room.n == 0:
+            self.stdout.write('No posts in the database; skipping SQL timings')
+            return
+
+        upvotes = PostVote.objects.filter(post=OuterRef('pk'), vote_type='up').order_by().values('post') \
+            .annotate(count=Count('pk')).values('count')
+        subquery_page = lambda: list(
+            room.posts.annotate(vote_score=Coalesce(Subquery(upvotes), 0))
+            .order_by('-vote_score', '-created_at').values_list('id', flat=True)[:20]
+        )
+        column_page = lambda: list(
+            room.posts.order_by('-top_score', '-created_at').values_list('id', flat=True)[:20]
+        )
+
+        self.stdout.write(f'\nFirst page of room {room.id} ({room.n} posts)')
+        self.stdout.write(f'  correlated subquery: {timed(subquery_page, repeat) * 1000:.1f}ms')
+        self.stdout.write(f'  stored column:       {timed(column_page, repeat) * 1000:.1f}ms')
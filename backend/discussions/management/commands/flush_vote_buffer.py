@@ -0,0 +1,24 @@
+"""
+Write the votes held in the write-behind vote buffer to the database now.
+
+Workers flush on their own every DISCUSSION_VOTE_FLUSH_INTERVAL seconds;
+with the redis buffer, run this after stopping the workers in a deploy so
+no buffered vote waits for the next start:
+
+    python manage.py flush_vote_buffer
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from discussions.vote_buffer import get_vote_buffer
+
+
+class Command(BaseCommand):
+    help = 'Flush buffered votes to the database'
+
+    def handle(self, *args, **options):
+        buffer = get_vote_buffer()
+        if buffer is None:
+            raise CommandError('DISCUSSION_VOTE_BUFFER is not set; votes are written directly')
+        written = buffer.flush()
+        self.stdout.write(self.style.SUCCESS(f'Flushed {written} buffered votes'))
@@ -0,0 +1,68 @@
+"""
+Generate missing thumbnails for image post attachments.
+
+Thumbnails are normally made in the background right after a post is
+committed; this catches attachments whose thumbnail was lost to a worker
+restart and those uploaded before thumbnails existed.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.db.models import Q
+
+from discussions.attachments import THUMBNAIL_TYPES, THUMBNAILS_AVAILABLE, generate_thumbnail
+from discussions.models import PostAttachment
+
+
+def _generate(attachment_id):
+    """Runs in a worker thread with its own database connection"""
+    try:
+        return attachment_id, generate_thumbnail(attachment_id), None
+    except Exception as e:
+        return attachment_id, False, e
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Generate thumbnails for image attachments that have none'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Attachments fetched per batch')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Thumbnails generated concurrently')
+
+    def handle(self, *args, **options):
+        if not THUMBNAILS_AVAILABLE:
+            raise CommandError('Pillow is required to generate thumbnails')
+
+        queryset = PostAttachment.objects.filter(
+            Q(thumbnail='') | Q(thumbnail__isnull=True), content_type__in=THUMBNAIL_TYPES,
+        ).exclude(Q(file='') | Q(file__isnull=True))
+
+        started = time.monotonic()
+        generated = failed = 0
+        last_id = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                ids = list(
+                    queryset.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:options['batch_size']]
+                )
+                if not ids:
+                    break
+                last_id = ids[-1]
+                for attachment_id, made, error in executor.map(_generate, ids):
+                    if error:
+                        failed += 1
+                        self.stderr.write(f'Attachment {attachment_id}: {error}')
+                    elif made:
+                        generated += 1
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {generated} thumbnails ({failed} failed) in {elapsed:.1f}s'
+        ))
@@ -0,0 +1,153 @@
+"""
+Load test for the realtime room events WebSocket.
+
+Opens --connections idle connections to one room of a running ASGI server
+and holds them for --hold seconds. It reports handshake latency, how many
+connections stayed open, and, with --server-pid, the server process's
+resident memory per connection.
+
+With --events, test events are published through the configured broker
+while the connections are held, and fan-out latency is measured on every
+connection. This only reaches the server when both use the redis backend.
+
+    uvicorn mysite.asgi:application --port 8000 &
+    python manage.py loadtest_room_events --room 1 --token <key> \\
+        --connections 5000 --server-pid $!
+"""
+
+import asyncio
+import json
+import resource
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from discussions.events import encode_event, get_broker
+
+
+def rss_kib(pid):
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return None
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Hold many idle WebSocket connections to a discussion room and measure the server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='ws://127.0.0.1:8000',
+                            help='Base WebSocket URL of the ASGI server')
+        parser.add_argument('--room', type=int, required=True)
+        parser.add_argument('--token', required=True, help='DRF token to connect with')
+        parser.add_argument('--connections', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=200,
+                            help='Handshakes in flight at once')
+        parser.add_argument('--hold', type=float, default=10,
+                            help='Seconds to hold the connections open')
+        parser.add_argument('--events', type=int, default=0,
+                            help='Events to publish through the broker while holding (redis backend)')
+        parser.add_argument('--server-pid', type=int,
+                            help='Report the resident memory of this server process')
+
+    def handle(self, *args, **options):
+        try:
+            import websockets  # noqa: F401
+        except ImportError:
+            raise CommandError('The websockets package is required (installed with uvicorn[standard])')
+
+        # Every connection is a file descriptor on this side too
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = options['connections'] + 100
+        if soft < wanted:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+
+        asyncio.run(self.run(options))
+
+    async def run(self, options):
+        import websockets
+
+        url = f"{options['url'].rstrip('/')}/ws/discussion-rooms/{options['room']}/events/"
+        headers = {'Authorization': f"Token {options['token']}"}
+        pid = options['server_pid']
+        rss_before = rss_kib(pid) if pid else None
+
+        handshakes, failures, sockets = [], [], []
+        slots = asyncio.Semaphore(options['concurrency'])
+
+        async def open_one():
+            async with slots:
+                started = time.perf_counter()
+                try:
+                    socket = await websockets.connect(
+                        url, additional_headers=headers, open_timeout=30, ping_interval=None
+                    )
+                except Exception as exc:
+                    failures.append(repr(exc))
+                    return
+                handshakes.append(time.perf_counter() - started)
+                sockets.append(socket)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(open_one() for _ in range(options['connections'])))
+        connect_time = time.perf_counter() - started
+
+        self.stdout.write(
+            f'Connected {len(sockets)}/{options["connections"]} in {connect_time:.1f}s '
+            f'(handshake p50 {percentile(handshakes, 0.5) * 1000:.1f}ms, '
+            f'p99 {percentile(handshakes, 0.99) * 1000:.1f}ms)'
+        )
+        if failures:
+            self.stdout.write(self.style.WARNING(f'{len(failures)} failed, e.g. {failures[0]}'))
+
+        latencies = []
+        closed = set()
+
+        async def read(index, socket):
+            try:
+                async for frame in socket:
+                    event = json.loads(frame)
+                    if event['type'] == 'loadtest':
+                        latencies.append(time.time() - event['data']['sent_at'])
+            except Exception:
+                pass
+            closed.add(index)
+
+        readers = [asyncio.create_task(read(i, socket)) for i, socket in enumerate(sockets)]
+        if options['events']:
+            broker = get_broker()
+            interval = options['hold'] / (options['events'] + 1)
+            for _ in range(options['events']):
+                await asyncio.sleep(interval)
+                message = encode_event('loadtest', options['room'], {'sent_at': time.time()})
+                await asyncio.to_thread(broker.publish, options['room'], message)
+            await asyncio.sleep(interval)
+        else:
+            await asyncio.sleep(options['hold'])
+
+        self.stdout.write(f'Still open after {options["hold"]:.0f}s: {len(sockets) - len(closed)}')
+        if options['events']:
+            expected = options['events'] * len(sockets)
+            self.stdout.write(
+                f'Delivered {len(latencies)}/{expected} events '
+                f'(p50 {percentile(latencies, 0.5) * 1000:.1f}ms, p99 {percentile(latencies, 0.99) * 1000:.1f}ms)'
+            )
+        if pid:
+            rss_after = rss_kib(pid)
+            per_connection = (rss_after - rss_before) / max(len(sockets), 1)
+            self.stdout.write(
+                f'Server RSS {rss_before / 1024:.1f} -> {rss_after / 1024:.1f} MiB '
+                f'({per_connection:.1f} KiB per connection)'
+            )
+
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*(socket.close() for socket in sockets), return_exceptions=True)
@@ -0,0 +1,61 @@
+"""
+Fill Comment.path and Comment.depth for comments created before threaded
+comments existed (or repair them after editing parents by hand).
+
+Comments are processed one tree level at a time: top-level comments first,
+then the replies of the comments just processed, so every parent's path is
+known before its replies are written.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from discussions.comment_tree import path_segment
+from discussions.models import Comment
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized paths of threaded comments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--post', type=int, action='append', dest='posts',
+                            help='Only rebuild this post (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per bulk UPDATE')
+
+    def handle(self, *args, **options):
+        comments = Comment.objects.all()
+        if options['posts']:
+            comments = comments.filter(post_id__in=options['posts'])
+
+        started = time.monotonic()
+        updated = 0
+        # {comment id: path} of the previous level
+        parents = {None: ''}
+        depth = 0
+        with transaction.atomic():
+            while parents:
+                if depth == 0:
+                    level = comments.filter(parent__isnull=True)
+                else:
+                    level = comments.filter(parent_id__in=list(parents))
+                rows = list(level.only('id', 'parent_id', 'path', 'depth'))
+                changed = []
+                next_parents = {}
+                for comment in rows:
+                    path = parents[comment.parent_id] + path_segment(comment.pk)
+                    next_parents[comment.pk] = path
+                    if comment.path != path or comment.depth != depth:
+                        comment.path, comment.depth = path, depth
+                        changed.append(comment)
+                Comment.objects.bulk_update(changed, ['path', 'depth'], batch_size=options['batch_size'])
+                updated += len(changed)
+                parents = next_parents
+                depth += 1
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {updated} comment paths over {depth - 1} levels in {elapsed:.2f}s'
+        ))
@@ -0,0 +1,107 @@
+"""
+Recompute Post.upvotes, Post.downvotes, Post.comments_count and Post.score
+(and with them the ranking columns) from the vote and comment tables and
+fix rows that have drifted (deletes through the admin, cascades, failed
+requests). Also fills the counters the first time after the columns are
+added.
+
+Drifted posts are locked before they are recounted, so a vote or comment
+committing meanwhile either is counted or applies its F() increment after
+the fix; it is never overwritten.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from discussions.models import Comment, Post, PostVote
+from discussions.ranking import RANKINGS, compute_rankings
+
+COUNTER_FIELDS = ['upvotes', 'downvotes', 'comments_count', 'score']
+
+
+def count_subquery(queryset):
+    """Correlated COUNT(*) of queryset rows for the outer post"""
+    return Coalesce(Subquery(
+        queryset.filter(post=OuterRef('pk')).order_by().values('post')
+        .annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Repair drift in the denormalized post vote and comment counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Posts checked per query')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drifted posts without updating them')
+
+    def handle(self, *args, **options):
+        actual = {
+            'actual_upvotes': count_subquery(PostVote.objects.filter(vote_type='up')),
+            'actual_downvotes': count_subquery(PostVote.objects.filter(vote_type='down')),
+            'actual_comments_count': count_subquery(Comment.objects.all()),
+        }
+        actual_score = {'actual_score': F('actual_upvotes') - F('actual_downvotes')}
+        drifted = Q()
+        for field in COUNTER_FIELDS:
+            drifted |= ~Q(**{field: F(f'actual_{field}')})
+
+        ranking_fields = [ranking.field for ranking in RANKINGS.values()]
+
+        started = time.monotonic()
+        checked = fixed = 0
+        last_id = 0
+        while True:
+            # Keyset batches over the primary key
+            ids = list(
+                Post.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            checked += len(ids)
+
+            drifted_ids = list(
+                Post.objects.filter(id__in=ids).annotate(**actual).annotate(**actual_score).filter(drifted)
+                .values_list('id', flat=True)
+            )
+            if not drifted_ids:
+                continue
+
+            with transaction.atomic():
+                if not options['dry_run']:
+                    # Lock first and count in a later statement, which sees
+                    # every write committed before the lock was granted
+                    list(Post.objects.select_for_update().filter(id__in=drifted_ids).order_by('id').values_list('id'))
+                posts = list(
+                    Post.objects.filter(id__in=drifted_ids).annotate(**actual).annotate(**actual_score).filter(drifted)
+                )
+                for post in posts:
+                    self.stdout.write(
+                        f'Post {post.id}: ' + ', '.join(
+                            f'{field} {getattr(post, field)} -> {getattr(post, f"actual_{field}")}'
+                            for field in COUNTER_FIELDS
+                        )
+                    )
+                    for field in COUNTER_FIELDS:
+                        setattr(post, field, getattr(post, f'actual_{field}'))
+
+                if posts and not options['dry_run']:
+                    now = timezone.now()
+                    for post in posts:
+                        for field, value in compute_rankings(post.upvotes, post.downvotes, post.created_at, now).items():
+                            setattr(post, field, value)
+                    Post.objects.bulk_update(posts, COUNTER_FIELDS + ranking_fields)
+            fixed += len(posts)
+
+        elapsed = time.monotonic() - started
+        action = 'Found' if options['dry_run'] else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {fixed} drifted posts out of {checked} in {elapsed:.1f}s'
+        ))
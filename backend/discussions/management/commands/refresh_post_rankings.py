@@ -0,0 +1,77 @@
+"""
+Recompute the stored ranking columns of posts room by room.
+
+Time-dependent rankings (hot) decay with age, so the value stored at vote
+time goes stale. Run this from cron every few minutes, e.g.
+
+    */5 * * * * python manage.py refresh_post_rankings
+
+Each room's recent posts are loaded as (upvotes, downvotes, created_at)
+columns, scored in one vectorized pass per ranking against a single clock
+reading, and written back with bulk_update, so posts within a room stay
+consistently ordered. Use --all after adding a ranking to fill its column
+for every post.
+"""
+
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from discussions.models import Post
+from discussions.ranking import HOT_WINDOW_DAYS, RANKINGS, age_hours
+
+
+class Command(BaseCommand):
+    help = 'Refresh the stored ranking scores of recent posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window-days', type=int, default=HOT_WINDOW_DAYS,
+                            help='Only refresh posts created within this many days')
+        parser.add_argument('--room', type=int, action='append', dest='rooms',
+                            help='Only refresh this room (repeatable)')
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute every ranking for every post, not only time-dependent ones')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows per bulk UPDATE')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        if options['all']:
+            rankings = list(RANKINGS.values())
+            posts_qs = Post.objects.all()
+        else:
+            rankings = [ranking for ranking in RANKINGS.values() if ranking.time_dependent]
+            posts_qs = Post.objects.filter(created_at__gte=now - timedelta(days=options['window_days']))
+        if options['rooms']:
+            posts_qs = posts_qs.filter(room_id__in=options['rooms'])
+        fields = [ranking.field for ranking in rankings]
+
+        started = time.monotonic()
+        rooms = posts = 0
+        room_ids = list(posts_qs.order_by('room_id').values_list('room_id', flat=True).distinct())
+        for room_id in room_ids:
+            rows = list(posts_qs.filter(room_id=room_id).values_list('id', 'upvotes', 'downvotes', 'created_at'))
+            if not rows:
+                continue
+            ids, upvotes, downvotes, created_ats = zip(*rows)
+            ages = [age_hours(created_at, now) for created_at in created_ats]
+            scores = {
+                ranking.field: ranking.score_many(upvotes, downvotes, ages)
+                for ranking in rankings
+            }
+            updated = [
+                Post(id=post_id, **{field: scores[field][i] for field in fields})
+                for i, post_id in enumerate(ids)
+            ]
+            with transaction.atomic():
+                Post.objects.bulk_update(updated, fields, batch_size=options['batch_size'])
+            rooms += 1
+            posts += len(updated)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Refreshed {', '.join(fields)} for {posts} posts in {rooms} rooms in {elapsed:.2f}s"
+        ))
@@ -1,6 +1,69 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
 from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from .comment_tree import path_segment
+from .feed import bump_room_version
+from .search import forget_tag_facets, tag_set, update_tag_facets
+
+# Joined-room sets are invalidated on every membership change; the timeout only bounds staleness
+# after writes that bypass signals (raw SQL, bulk deletes of users)
+MEMBERSHIP_CACHE_TIMEOUT = 60 * 60
+MEMBERSHIP_CACHE_PREFIX = 'discussions:joined-rooms'
+# Per-request copy on the user object, so repeated checks skip the cache round trip
+MEMBERSHIP_USER_ATTR = '_joined_discussion_rooms'
+
+
+def _membership_cache_key(user_id):
+    return f'{MEMBERSHIP_CACHE_PREFIX}:{user_id}'
+
+
+def joined_rooms(user):
+    """
+    (room ids, exam ids) of the discussion rooms a user has joined, as
+    frozensets for O(1) membership checks
+
+    Read from the Django cache (Redis in production, in-process memory
+    otherwise) and loaded with one query on a miss.
+    """
+    if not user.is_authenticated:
+        return frozenset(), frozenset()
+    rooms = getattr(user, MEMBERSHIP_USER_ATTR, None)
+    if rooms is not None:
+        return rooms
+
+    key = _membership_cache_key(user.pk)
+    rooms = cache.get(key)
+    if rooms is None:
+        pairs = list(DiscussionRoom.members.through.objects.filter(user_id=user.pk).values_list(
+            'discussionroom_id', 'discussionroom__exam_id'
+        ))
+        rooms = (frozenset(pair[0] for pair in pairs), frozenset(pair[1] for pair in pairs))
+        cache.set(key, rooms, MEMBERSHIP_CACHE_TIMEOUT)
+    setattr(user, MEMBERSHIP_USER_ATTR, rooms)
+    return rooms
+
+
+def forget_joined_rooms(user):
+    """Drop the per-request copy held on a user object"""
+    try:
+        delattr(user, MEMBERSHIP_USER_ATTR)
+    except AttributeError:
+        pass
+
+
+def invalidate_joined_rooms(user_ids):
+    """Drop cached joined-room sets, again once the transaction commits"""
+    keys = [_membership_cache_key(user_id) for user_id in user_ids]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    # A concurrent request may have re-read the old rows before we committed
+    transaction.on_commit(lambda: cache.delete_many(keys))
 
 
 class DiscussionRoom(models.Model):
@@ -37,15 +100,36 @@ class DiscussionRoom(models.Model):
 
     def is_member(self, user):
         """Check if user is a member"""
-        return self.members.filter(id=user.id).exists()
+        room_ids = joined_rooms(user)[0]
+        return self.pk in room_ids
 
     def add_member(self, user):
         """Add member"""
         self.members.add(user)
+        forget_joined_rooms(user)
 
     def remove_member(self, user):
         """Remove member"""
         self.members.remove(user)
+        forget_joined_rooms(user)
+
+
+# Counter column for each vote type
+VOTE_COUNTERS = {'up': 'upvotes', 'down': 'downvotes'}
+
+
+def vote_deltas(old_vote_type, new_vote_type):
+    """
+    Non-zero counter changes for a vote going from old_vote_type to
+    new_vote_type (None = no vote), e.g. {'upvotes': 1, 'downvotes': -1, 'score': 2}
+    """
+    deltas = {'upvotes': 0, 'downvotes': 0}
+    if old_vote_type:
+        deltas[VOTE_COUNTERS[old_vote_type]] -= 1
+    if new_vote_type:
+        deltas[VOTE_COUNTERS[new_vote_type]] += 1
+    deltas['score'] = deltas['upvotes'] - deltas['downvotes']
+    return {field: delta for field, delta in deltas.items() if delta}
 
 
 class Post(models.Model):
@@ -65,6 +149,15 @@ class Post(models.Model):
     post_type = models.CharField(max_length=20, choices=POST_TYPES, default='discussion')
     tags = models.JSONField(default=list, blank=True)
     is_pinned = models.BooleanField(default=False)
+    # Denormalized counters, kept in step by update_counters (reconcile_post_counters repairs drift)
+    upvotes = models.PositiveIntegerField(default=0, editable=False)
+    downvotes = models.PositiveIntegerField(default=0, editable=False)
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
+    # Net votes, and one column per ranking in discussions.ranking.RANKINGS
+    score = models.IntegerField(default=0, editable=False)
+    hot_score = models.FloatField(default=0, editable=False)
+    top_score = models.FloatField(default=0, editable=False)
+    controversy_score = models.FloatField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -72,24 +165,59 @@ class Post(models.Model):
         ordering = ['-is_pinned', '-created_at']
         verbose_name = _('Post')
         verbose_name_plural = _('Posts')
+        indexes = [
+            # Keyset pagination within a room
+            models.Index(fields=['room', '-created_at', '-id'], name='discussions_post_room_new_idx'),
+            models.Index(fields=['room', '-is_pinned', '-created_at', '-id'], name='discussions_post_room_pin_idx'),
+            # ?sort=hot, ?sort=top and ?sort=controversial
+            models.Index(fields=['room', '-hot_score', '-created_at', '-id'], name='discussions_post_room_hot_idx'),
+            models.Index(fields=['room', '-top_score', '-created_at', '-id'], name='discussions_post_room_top_idx'),
+            models.Index(fields=['room', '-controversy_score', '-created_at', '-id'], name='discussions_post_room_cnt_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
-    @property
-    def upvotes(self):
-        """Get upvotes count"""
-        return self.votes.filter(vote_type='up').count()
-
-    @property
-    def downvotes(self):
-        """Get downvotes count"""
-        return self.votes.filter(vote_type='down').count()
-
-    @property
-    def comments_count(self):
-        """Get comments count"""
-        return self.comments.count()
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        post = super().from_db(db, field_names, values)
+        # Tags as loaded, so a save can adjust the room's cached tag facets by the difference
+        if 'tags' in post.__dict__:
+            post._loaded_tags = tag_set(post.tags)
+        return post
+
+    def update_counters(self, **deltas):
+        """
+        Atomically add deltas to counter columns, e.g. update_counters(upvotes=1, downvotes=-1),
+        then reload them on this instance
+        """
+        deltas = {field: delta for field, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        Post.objects.filter(pk=self.pk).update(
+            **{field: F(field) + delta for field, delta in deltas.items()}
+        )
+        self.refresh_from_db(fields=list(deltas))
+
+    def record_vote_change(self, old_vote_type, new_vote_type):
+        """
+        Update the vote counters and ranking for a vote going from old_vote_type
+        to new_vote_type (None = no vote); returns the counter deltas applied
+        """
+        deltas = vote_deltas(old_vote_type, new_vote_type)
+        self.update_counters(**deltas)
+        if old_vote_type != new_vote_type:
+            self.refresh_rankings()
+        return deltas
+
+    def refresh_rankings(self, now=None):
+        """Recompute every ranking column from the stored vote counters"""
+        from .ranking import compute_rankings
+
+        scores = compute_rankings(self.upvotes, self.downvotes, self.created_at, now or timezone.now())
+        for field, value in scores.items():
+            setattr(self, field, value)
+        Post.objects.filter(pk=self.pk).update(**scores)
 
     def get_user_vote(self, user):
         """Get user vote"""
@@ -105,6 +233,9 @@ class Comment(models.Model):
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='comments')
     content = models.TextField(verbose_name=_('Comment Content'))
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
+    # Materialized path of ancestor ids, see comment_tree
+    path = models.CharField(max_length=255, blank=True, default='', editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
     is_deleted = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -113,10 +244,26 @@ class Comment(models.Model):
         ordering = ['created_at']
         verbose_name = _('Comment')
         verbose_name_plural = _('Comments')
+        indexes = [
+            # Keyset pagination within a post
+            models.Index(fields=['post', 'created_at', 'id'], name='discussions_comment_post_idx'),
+            # Threaded listing: depth-first order of a post's comments
+            models.Index(fields=['post', 'path'], name='discussions_comment_path_idx'),
+        ]
 
     def __str__(self):
         return f"Comment by {self.author.username} on {self.post.title}"
 
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        if creating and self.parent_id:
+            self.depth = self.parent.depth + 1
+        super().save(*args, **kwargs)
+        if creating and not self.path:
+            # The path ends with our own id, known only after the insert
+            self.path = (self.parent.path if self.parent_id else '') + path_segment(self.pk)
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+
     @property
     def upvotes(self):
         """Get upvotes count"""
@@ -152,6 +299,11 @@ class PostVote(models.Model):
         verbose_name = _('Post Vote')
         verbose_name_plural = _('Post Votes')
 
+    @classmethod
+    def votes_by(cls, user, post_ids):
+        """{post_id: vote_type} of the user's votes on these posts, in one query"""
+        return dict(cls.objects.filter(user=user, post_id__in=post_ids).values_list('post_id', 'vote_type'))
+
 
 class CommentVote(models.Model):
     """Comment vote model"""
@@ -170,6 +322,11 @@ class CommentVote(models.Model):
         verbose_name = _('Comment Vote')
         verbose_name_plural = _('Comment Votes')
 
+    @classmethod
+    def votes_by(cls, user, comment_ids):
+        """{comment_id: vote_type} of the user's votes on these comments, in one query"""
+        return dict(cls.objects.filter(user=user, comment_id__in=comment_ids).values_list('comment_id', 'vote_type'))
+
 
 class PostAttachment(models.Model):
     """Post attachment model"""
@@ -182,8 +339,14 @@ class PostAttachment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='attachments')
     type = models.CharField(max_length=10, choices=ATTACHMENT_TYPES)
     name = models.CharField(max_length=200)
-    url = models.URLField()
+    # Uploaded files are stored in file (see attachments); links only have a url
+    file = models.FileField(upload_to='post_attachments/%Y/%m/', max_length=255, null=True, blank=True)
+    url = models.URLField(blank=True)
     size = models.IntegerField(null=True, blank=True)  # 文件大小（字节）
+    content_type = models.CharField(max_length=100, blank=True, default='')
+    checksum = models.CharField(max_length=64, blank=True, default='')
+    # Generated after commit for image attachments; empty until then or if the image cannot be read
+    thumbnail = models.FileField(upload_to='post_attachments/thumbnails/%Y/%m/', max_length=255, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -192,3 +355,76 @@ class PostAttachment(models.Model):
 
     def __str__(self):
         return f"{self.name} ({self.type})"
+
+    def get_url(self):
+        """Where the attachment can be downloaded: the stored file, or the link"""
+        return self.file.url if self.file else self.url
+
+
+@receiver(m2m_changed, sender=DiscussionRoom.members.through)
+def invalidate_changed_memberships(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep cached joined-room sets in step with DiscussionRoom.members"""
+    if reverse:
+        # user.joined_discussion_rooms.add/remove/clear(...)
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            forget_joined_rooms(instance)
+            invalidate_joined_rooms([instance.pk])
+    elif action == 'pre_clear':
+        # pk_set is None on clear; remember who is being removed
+        instance._cleared_member_ids = list(instance.members.values_list('id', flat=True))
+    elif action == 'post_clear':
+        invalidate_joined_rooms(instance.__dict__.pop('_cleared_member_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        invalidate_joined_rooms(pk_set)
+
+
+@receiver(pre_delete, sender=DiscussionRoom)
+def invalidate_deleted_room_memberships(sender, instance, **kwargs):
+    """Membership rows of a deleted room go away by cascade, without m2m_changed"""
+    invalidate_joined_rooms(list(instance.members.values_list('id', flat=True)))
+
+
+@receiver(post_save, sender=Post)
+def update_saved_post_tag_facets(sender, instance, created, update_fields, **kwargs):
+    """Adjust the room's cached tag counts by the tags this save added or removed"""
+    if update_fields is not None and 'tags' not in update_fields:
+        return
+    if created:
+        update_tag_facets(instance.room_id, [], instance.tags)
+    elif hasattr(instance, '_loaded_tags'):
+        update_tag_facets(instance.room_id, instance._loaded_tags, instance.tags)
+    else:
+        # Loaded with tags deferred: the previous tags are unknown
+        forget_tag_facets(instance.room_id)
+    instance._loaded_tags = tag_set(instance.tags)
+
+
+@receiver(post_delete, sender=Post)
+def update_deleted_post_tag_facets(sender, instance, **kwargs):
+    if 'tags' in instance.__dict__:
+        update_tag_facets(instance.room_id, instance.tags, [])
+    else:
+        forget_tag_facets(instance.room_id)
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_comments_count(sender, instance, **kwargs):
+    """Comments are counted on creation (see CommentListCreateView); uncount them on any delete"""
+    Post.objects.filter(pk=instance.post_id, comments_count__gt=0).update(comments_count=F('comments_count') - 1)
+
+
+@receiver(post_delete, sender=PostAttachment)
+def delete_attachment_files(sender, instance, **kwargs):
+    """Remove the stored file and thumbnail once the deletion is committed"""
+    for field_file in (instance.file, instance.thumbnail):
+        if field_file:
+            storage, name = field_file.storage, field_file.name
+            transaction.on_commit(lambda storage=storage, name=name: storage.delete(name))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_room_feeds(sender, instance, created=True, **kwargs):
+    """A post appearing or disappearing changes the cached feeds of the room's members"""
+    if created:
+        bump_room_version(instance.room_id)
@@ -0,0 +1,249 @@
+"""
+In-room post search, tag filtering and tag facets
+
+?q= matches posts whose title or content has every term as a word prefix.
+On PostgreSQL the match runs against
+
+    setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', content), 'C')
+
+which a GIN expression index covers, and ts_rank orders the results; ?tag=
+is a jsonb containment (tags @> '["tag"]') served by a GIN jsonb_path_ops
+index. Both indexes are created after migrate (see create_search_indexes),
+since GIN does not exist on SQLite, which falls back to icontains.
+
+Highlights are built in Python from the same prefix terms, with the text
+escaped first so user content cannot inject markup.
+
+Tag facet counts per room are cached as one counter per tag, under a
+per-room version that names the cached set of tags. A post save or delete
+that changes tags adjusts the counters of the current version with atomic
+cache.incr/decr once it commits; a tag without a counter (new, or
+evicted) drops the version instead, and the next read recounts. A count
+racing with a write is stored under a version the write has already
+dropped and never read. The timeout bounds drift from writes that bypass
+signals (queryset.update, raw SQL).
+"""
+
+import hashlib
+import json
+import re
+import uuid
+from collections import Counter
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.core.cache import cache
+from django.db import connection, connections, models, transaction
+from django.db.models.functions import Cast
+from django.utils.html import escape
+
+from exams.models import SEARCH_CONFIG
+
+TAG_FACETS_CACHE_PREFIX = 'discussions:tag-facets'
+TAG_FACETS_VERSION_PREFIX = 'discussions:tag-facets-version'
+TAG_FACETS_CACHE_TIMEOUT = 60 * 60
+# Tags returned in a room's facet list
+TAG_FACETS_LIMIT = 30
+# Characters of content around the first match in a highlight
+HIGHLIGHT_CONTEXT = 80
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query or '')
+
+
+def post_search_vector():
+    """The weighted document searched by ?q=; must match the GIN index expression"""
+    return (
+        SearchVector('title', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('content', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def search_indexes():
+    return [
+        GinIndex(post_search_vector(), name='discussions_post_search_gin'),
+        GinIndex(fields=['tags'], opclasses=['jsonb_path_ops'], name='discussions_post_tags_gin'),
+    ]
+
+
+def create_search_indexes(using='default', **kwargs):
+    """post_migrate: create the PostgreSQL-only GIN indexes that are missing"""
+    from .models import Post
+
+    db = connections[using]
+    if db.vendor != 'postgresql':
+        return
+    with db.cursor() as cursor:
+        existing = db.introspection.get_constraints(cursor, Post._meta.db_table)
+    with db.schema_editor() as schema_editor:
+        for index in search_indexes():
+            if index.name not in existing:
+                schema_editor.add_index(Post, index)
+
+
+def search_posts(queryset, query):
+    """
+    Posts matching every term of query, annotated with search_rank and
+    ordered by it (newest first among equals)
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset.none()
+
+    if connection.vendor == 'postgresql':
+        ts_query = SearchQuery(
+            ' & '.join(f'{term}:*' for term in terms),
+            config=SEARCH_CONFIG,
+            search_type='raw',
+        )
+        vector = post_search_vector()
+        # ts_rank is a float4; as float8 the value round-trips exactly through cursors
+        return queryset.annotate(document=vector).filter(document=ts_query).annotate(
+            search_rank=Cast(SearchRank(vector, ts_query), models.FloatField())
+        ).order_by('-search_rank', '-created_at')
+
+    matches = models.Q()
+    rank = models.Value(0)
+    for term in terms:
+        matches &= models.Q(title__icontains=term) | models.Q(content__icontains=term)
+        for field, weight in (('title', 3), ('content', 1)):
+            rank = rank + models.Case(
+                models.When(**{f'{field}__icontains': term}, then=models.Value(weight)),
+                default=models.Value(0),
+            )
+    return queryset.filter(matches).annotate(search_rank=rank).order_by('-search_rank', '-created_at')
+
+
+def filter_tags(queryset, tags):
+    """Posts carrying every one of tags"""
+    for tag in tags:
+        if connection.vendor == 'postgresql':
+            queryset = queryset.filter(tags__contains=[tag])
+        else:
+            # Other backends have no JSON containment; match the encoded element
+            queryset = queryset.filter(tags__icontains=json.dumps(tag))
+    return queryset
+
+
+def highlight(text, terms, context=None):
+    """
+    text escaped for HTML with words starting with any of terms wrapped in
+    <mark>; with context, only the part around the first match
+    """
+    if not terms:
+        return escape(text)
+    pattern = re.compile(r'\b(?:' + '|'.join(re.escape(term) for term in terms) + r')\w*', re.IGNORECASE)
+    if context is not None:
+        match = pattern.search(text)
+        start = max((match.start() if match else 0) - context, 0)
+        end = min((match.end() if match else 0) + context, len(text))
+        text = ('…' if start else '') + text[start:end] + ('…' if end < len(text) else '')
+
+    parts, last = [], 0
+    for match in pattern.finditer(text):
+        parts.append(escape(text[last:match.start()]))
+        parts.append(f'<mark>{escape(match.group())}</mark>')
+        last = match.end()
+    parts.append(escape(text[last:]))
+    return ''.join(parts)
+
+
+def tag_set(tags):
+    """The distinct string tags of a Post.tags value"""
+    if not isinstance(tags, (list, tuple, set, frozenset)):
+        return set()
+    return {tag for tag in tags if isinstance(tag, str)}
+
+
+def _tag_facets_version_key(room_id):
+    return f'{TAG_FACETS_VERSION_PREFIX}:{room_id}'
+
+
+def _tag_facets_tags_key(room_id, version):
+    return f'{TAG_FACETS_CACHE_PREFIX}:{room_id}:{version}'
+
+
+def _tag_facets_count_key(room_id, version, tag):
+    # Tags are user text; hash them into a key every cache backend accepts
+    digest = hashlib.sha1(tag.encode()).hexdigest()
+    return f'{TAG_FACETS_CACHE_PREFIX}:{room_id}:{version}:{digest}'
+
+
+def count_tags(room_id):
+    """{tag: number of posts} for a room, counted in the database"""
+    from .models import Post
+
+    posts = Post.objects.filter(room_id=room_id).order_by()
+    if connection.vendor == 'postgresql':
+        return dict(
+            posts.annotate(tag=models.Func('tags', function='jsonb_array_elements_text'))
+            .values('tag').annotate(count=models.Count('id', distinct=True)).values_list('tag', 'count')
+        )
+    counts = Counter()
+    for tags in posts.values_list('tags', flat=True):
+        counts.update(tag_set(tags))
+    return dict(counts)
+
+
+def cached_tag_counts(room_id):
+    """{tag: number of posts} for a room, recounted when no complete cached version exists"""
+    version = cache.get(_tag_facets_version_key(room_id))
+    if version is not None:
+        tags = cache.get(_tag_facets_tags_key(room_id, version))
+        if tags is not None:
+            keys = {_tag_facets_count_key(room_id, version, tag): tag for tag in tags}
+            counts = cache.get_many(keys)
+            if len(counts) == len(keys):
+                return {keys[key]: count for key, count in counts.items()}
+
+    # A fresh version: writes committed during the count find no counters
+    # under it and drop it again
+    version = uuid.uuid4().hex
+    cache.set(_tag_facets_version_key(room_id), version, None)
+    counts = count_tags(room_id)
+    cache.set_many(
+        {_tag_facets_count_key(room_id, version, tag): count for tag, count in counts.items()},
+        TAG_FACETS_CACHE_TIMEOUT,
+    )
+    cache.set(_tag_facets_tags_key(room_id, version), list(counts), TAG_FACETS_CACHE_TIMEOUT)
+    return counts
+
+
+def tag_facets(room_id, limit=TAG_FACETS_LIMIT):
+    """[{'tag', 'count'}] of the room's most used tags, from the cache"""
+    counts = cached_tag_counts(room_id)
+    ordered = sorted(
+        ((tag, count) for tag, count in counts.items() if count > 0),
+        key=lambda item: (-item[1], item[0]),
+    )[:limit]
+    return [{'tag': tag, 'count': count} for tag, count in ordered]
+
+
+def forget_tag_facets(room_id):
+    """Have the room's tags recounted on the next read, once the transaction commits"""
+    transaction.on_commit(lambda: cache.delete(_tag_facets_version_key(room_id)))
+
+
+def update_tag_facets(room_id, removed, added):
+    """Adjust the room's cached tag counts by a post's tag change, once the transaction commits"""
+    removed, added = tag_set(removed), tag_set(added)
+    deltas = {tag: 1 for tag in added - removed}
+    deltas.update({tag: -1 for tag in removed - added})
+    if not deltas:
+        return
+
+    def apply():
+        version = cache.get(_tag_facets_version_key(room_id))
+        if version is None:
+            # Nothing cached; the next read counts this change
+            return
+        for tag, delta in deltas.items():
+            try:
+                cache.incr(_tag_facets_count_key(room_id, version, tag), delta)
+            except ValueError:
+                # A tag the cached version does not list yet, or an evicted counter
+                cache.delete(_tag_facets_version_key(room_id))
+                return
+
+    transaction.on_commit(apply)
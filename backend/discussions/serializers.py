@@ -1,14 +1,94 @@
+import json
+import re
+
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.manager import BaseManager
+from django.utils.translation import gettext_lazy as _
 from .models import DiscussionRoom, Post, Comment, PostVote, CommentVote, PostAttachment
+from .attachments import MAX_ATTACHMENTS, store_attachments, validate_attachment
+from .comment_tree import MAX_COMMENT_DEPTH
+from .search import HIGHLIGHT_CONTEXT, highlight
+from .vote_buffer import get_vote_buffer
 
 User = get_user_model()
 
 
 class PostAttachmentSerializer(serializers.ModelSerializer):
+    url = serializers.CharField(source='get_url', read_only=True)
+    thumbnail_url = serializers.SerializerMethodField()
+
     class Meta:
         model = PostAttachment
-        fields = ['id', 'type', 'name', 'url', 'size']
+        fields = ['id', 'type', 'name', 'url', 'size', 'content_type', 'thumbnail_url']
+
+    def get_thumbnail_url(self, obj):
+        return obj.thumbnail.url if obj.thumbnail else None
+
+
+class UserVoteListSerializer(serializers.ListSerializer):
+    """Resolves the requesting user's votes for every item with one IN query"""
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, BaseManager) else data)
+        self.child.load_user_votes(items)
+        return super().to_representation(items)
+
+
+class UserVoteMixin:
+    """
+    user_vote read from a {pk: vote_type} map in the serializer context,
+    filled for a whole page by UserVoteListSerializer or per object otherwise
+
+    With the vote buffer on (see vote_buffer), the user's pending votes
+    replace the stored ones and pending deltas are added to the counts.
+    """
+    vote_model = None
+
+    @property
+    def user_votes_key(self):
+        return f'user_votes:{self.vote_model._meta.label_lower}'
+
+    @property
+    def vote_deltas_key(self):
+        return f'vote_deltas:{self.vote_model._meta.label_lower}'
+
+    def load_user_votes(self, objects):
+        buffer = get_vote_buffer()
+        if buffer is not None:
+            deltas = self.context.setdefault(self.vote_deltas_key, {})
+            missing = [obj.pk for obj in objects if obj.pk not in deltas]
+            if missing:
+                deltas.update(dict.fromkeys(missing, {}))
+                deltas.update(buffer.pending_deltas(self.vote_model, missing))
+
+        request = self.context.get('request')
+        if not (request and request.user.is_authenticated):
+            return
+        votes = self.context.setdefault(self.user_votes_key, {})
+        missing = [obj.pk for obj in objects if obj.pk not in votes]
+        if missing:
+            votes.update(dict.fromkeys(missing))
+            votes.update(self.vote_model.votes_by(request.user, missing))
+            if buffer is not None:
+                votes.update(buffer.pending_votes(self.vote_model, request.user.pk, missing))
+
+    def get_user_vote(self, obj):
+        request = self.context.get('request')
+        if not (request and request.user.is_authenticated):
+            return None
+        self.load_user_votes([obj])
+        return self.context[self.user_votes_key].get(obj.pk)
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if get_vote_buffer() is not None:
+            self.load_user_votes([instance])
+            for field, delta in self.context[self.vote_deltas_key][instance.pk].items():
+                if field in data:
+                    data[field] += delta
+        return data
 
 
 class DiscussionRoomSerializer(serializers.ModelSerializer):
@@ -33,7 +113,7 @@ class DiscussionRoomSerializer(serializers.ModelSerializer):
         return False
 
 
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(UserVoteMixin, serializers.ModelSerializer):
     room_id = serializers.CharField(source='room.id', read_only=True)
     author_id = serializers.CharField(source='author.id', read_only=True)
     author_name = serializers.CharField(source='author.username', read_only=True)
@@ -42,6 +122,7 @@ class PostSerializer(serializers.ModelSerializer):
     downvotes = serializers.ReadOnlyField()
     comments_count = serializers.ReadOnlyField()
     user_vote = serializers.SerializerMethodField()
+    highlight = serializers.SerializerMethodField()
     attachments = PostAttachmentSerializer(many=True, read_only=True)
 
     class Meta:
@@ -50,23 +131,30 @@ class PostSerializer(serializers.ModelSerializer):
             'id', 'room_id', 'author_id', 'author_name', 'author_avatar',
             'title', 'content', 'post_type', 'tags', 'upvotes', 'downvotes',
             'user_vote', 'comments_count', 'created_at', 'updated_at',
-            'is_pinned', 'attachments'
+            'is_pinned', 'attachments', 'highlight'
         ]
         read_only_fields = ['room_id', 'created_at', 'updated_at', 'is_pinned']
+        list_serializer_class = UserVoteListSerializer
 
-    def get_user_vote(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return obj.get_user_vote(request.user)
-        return None
+    vote_model = PostVote
+
+    def get_highlight(self, obj):
+        """Escaped title and content excerpt with the ?q= matches in <mark>, when searching"""
+        terms = self.context.get('search_terms')
+        if not terms:
+            return None
+        return {
+            'title': highlight(obj.title, terms),
+            'content': highlight(obj.content, terms, context=HIGHLIGHT_CONTEXT),
+        }
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(UserVoteMixin, serializers.ModelSerializer):
     post_id = serializers.CharField(source='post.id', read_only=True)
     author_id = serializers.CharField(source='author.id', read_only=True)
     author_name = serializers.CharField(source='author.username', read_only=True)
     author_avatar = serializers.CharField(source='author.avatar', read_only=True)
-    parent_id = serializers.CharField(source='parent.id', read_only=True)
+    parent_id = serializers.CharField(read_only=True)
     upvotes = serializers.ReadOnlyField()
     downvotes = serializers.ReadOnlyField()
     user_vote = serializers.SerializerMethodField()
@@ -79,41 +167,101 @@ class CommentSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at', 'is_deleted'
         ]
         read_only_fields = ['post_id', 'created_at', 'updated_at']
+        list_serializer_class = UserVoteListSerializer
 
-    def get_user_vote(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return obj.get_user_vote(request.user)
-        return None
+    vote_model = CommentVote
+
+
+class CommentTreeSerializer(CommentSerializer):
+    """
+    A comment with its replies nested, from comment_tree.build_tree
+
+    Deleted comments stay in the tree to hold their replies, without content.
+    total_replies is set on top-level comments of a thread page.
+    """
+    depth = serializers.IntegerField(read_only=True)
+    replies = serializers.SerializerMethodField()
+    total_replies = serializers.SerializerMethodField()
+
+    class Meta(CommentSerializer.Meta):
+        fields = CommentSerializer.Meta.fields + ['depth', 'replies', 'total_replies']
+
+    def get_replies(self, obj):
+        return CommentTreeSerializer(obj.children, many=True, context=self.context).data
+
+    def get_total_replies(self, obj):
+        thread_size = getattr(obj, 'thread_size', None)
+        if thread_size is None or obj.parent_id:
+            return None
+        return thread_size - 1
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.is_deleted:
+            data['content'] = ''
+        return data
 
 
 class CreatePostSerializer(serializers.ModelSerializer):
+    tags = serializers.ListField(
+        child=serializers.CharField(max_length=50),
+        required=False,
+    )
     attachments = serializers.ListField(
-        child=serializers.FileField(),
+        child=serializers.FileField(validators=[validate_attachment]),
         required=False,
-        allow_empty=True
+        allow_empty=True,
+        max_length=MAX_ATTACHMENTS
     )
 
+    # Files the frontend sends one field each: attachment_0, attachment_1, ...
+    numbered_attachment = re.compile(r'^attachment_(\d+)$')
+
     class Meta:
         model = Post
         fields = ['title', 'content', 'post_type', 'tags', 'attachments']
 
+    def to_internal_value(self, data):
+        if hasattr(data, 'getlist'):
+            data = self.multipart_data(data)
+        return super().to_internal_value(data)
+
+    def multipart_data(self, data):
+        """
+        Multipart input as a plain dict: attachment_N files join
+        attachments in index order, and tags may be one JSON-encoded list
+        """
+        numbered = {}
+        result = {}
+        for key in data:
+            match = self.numbered_attachment.match(key)
+            if match:
+                numbered[int(match.group(1))] = data.getlist(key)
+            elif key not in ('tags', 'attachments'):
+                result[key] = data.get(key)
+
+        if 'tags' in data:
+            tags = data.getlist('tags')
+            if len(tags) == 1 and isinstance(tags[0], str) and tags[0].lstrip().startswith('['):
+                try:
+                    tags = json.loads(tags[0])
+                except ValueError:
+                    raise serializers.ValidationError({'tags': [_('Tags must be a JSON list of strings')]})
+            result['tags'] = tags
+
+        attachments = data.getlist('attachments')
+        for index in sorted(numbered):
+            attachments += numbered[index]
+        if attachments:
+            result['attachments'] = attachments
+        return result
+
     def create(self, validated_data):
         attachments_data = validated_data.pop('attachments', [])
-        post = Post.objects.create(**validated_data)
-        
-        # 处理附件
-        for i, attachment_file in enumerate(attachments_data):
-            # 这里可以实现文件上传逻辑，比如上传到云存储
-            # 暂时简化处理
-            PostAttachment.objects.create(
-                post=post,
-                type='file',
-                name=attachment_file.name,
-                url=f'/media/attachments/{attachment_file.name}',  # 简化处理
-                size=attachment_file.size
-            )
-        
+        with transaction.atomic():
+            post = Post.objects.create(**validated_data)
+            # Files go to storage concurrently; image thumbnails follow after commit
+            store_attachments(post, attachments_data)
         return post
 
 
@@ -128,9 +276,11 @@ class CreateCommentSerializer(serializers.ModelSerializer):
         if value:
             try:
                 parent = Comment.objects.get(id=value)
-                return parent
-            except Comment.DoesNotExist:
+            except (Comment.DoesNotExist, ValueError):
                 raise serializers.ValidationError(_('Parent comment does not exist'))
+            if parent.depth >= MAX_COMMENT_DEPTH:
+                raise serializers.ValidationError(_('Replies are nested too deeply'))
+            return parent
         return None
 
     def create(self, validated_data):
@@ -0,0 +1,1077 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from unittest import skipUnless
+from datetime import timedelta
+from unittest.mock import patch
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from rest_framework import status
+from PIL import Image
+from exams.models import Exam
+from .models import Comment, Post, PostAttachment, PostVote, joined_rooms
+from .attachments import MAX_ATTACHMENTS, generate_thumbnail
+from .comment_tree import path_segment
+from .consumers import (
+    CLOSE_NOT_FOUND, CLOSE_TOO_SLOW, CLOSE_UNAUTHENTICATED, TICKET_MAX_AGE, send_events, sign_ticket,
+    websocket_application,
+)
+from .events import Subscription, check_cross_process_broker, get_broker
+from .ranking import HOT_GRAVITY, RANKINGS, compute_rankings
+from . import ranking, search, vote_buffer
+from .search import filter_tags, search_posts
+from .views import AttachmentMultiPartParser
+from .vote_buffer import get_vote_buffer
+
+
+class DiscussionTestMixin:
+    """A room with a member and a handful of posts"""
+
+    def setUp(self):
+        super().setUp()
+        # Cached joined-room sets outlive the rolled back rows of earlier tests
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            username='testuser',
+            password='testpass123',
+            first_name='Test'
+        )
+        self.voters = [
+            User.objects.create_user(
+                email=f'voter{i}@example.com',
+                username=f'voter{i}',
+                password='testpass123',
+                first_name='Voter'
+            )
+            for i in range(3)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        self.exam = Exam.objects.create(user=self.user, title='Exam', exam_time='2030-01-01')
+        self.room, _ = self.exam.get_or_create_discussion_room()
+        self.room.add_member(self.user)
+        self.posts = [
+            Post.objects.create(room=self.room, author=self.user, title=f'Post {i}', content='Content')
+            for i in range(5)
+        ]
+
+    def vote(self, user, post, vote_type):
+        self.client.force_authenticate(user=user)
+        response = self.client.post(f'/api/discussion-rooms/posts/{post.id}/vote/', {'vote_type': vote_type})
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.data['success'])
+            ids += [item['id'] for item in response.data['data']]
+            url = response.data['next']
+        return ids
+
+
+class PostCursorPaginationTestCase(DiscussionTestMixin, TestCase):
+    """Cursor pagination on room posts and comments"""
+
+    def test_new_sort(self):
+        url = f'/api/discussion-rooms/{self.room.id}/posts/?sort=new&pagination=cursor&page_size=2'
+        self.assertEqual(self.walk(url), [post.id for post in reversed(self.posts)])
+
+    def test_top_sort(self):
+        """Posts page by upvote count, newest first among equal counts"""
+        for voter in self.voters:
+            self.vote(voter, self.posts[1], 'up')
+        self.vote(self.voters[0], self.posts[3], 'up')
+        self.vote(self.voters[0], self.posts[0], 'down')
+
+        url = f'/api/discussion-rooms/{self.room.id}/posts/?sort=top&pagination=cursor&page_size=2'
+        expected = [self.posts[i].id for i in (1, 3, 4, 2, 0)]
+        self.assertEqual(self.walk(url), expected)
+
+    def test_hot_sort(self):
+        self.vote(self.voters[0], self.posts[0], 'up')
+        url = f'/api/discussion-rooms/{self.room.id}/posts/?pagination=cursor&page_size=2'
+        expected = [self.posts[i].id for i in (0, 4, 3, 2, 1)]
+        self.assertEqual(self.walk(url), expected)
+
+    def test_comments(self):
+        post = self.posts[0]
+        comments = [
+            Comment.objects.create(post=post, author=self.user, content=f'Comment {i}')
+            for i in range(5)
+        ]
+        url = f'/api/discussion-rooms/posts/{post.id}/comments/?pagination=cursor&page_size=2'
+        self.assertEqual(self.walk(url), [comment.id for comment in comments])
+
+
+class PostCounterTestCase(DiscussionTestMixin, TestCase):
+    """Denormalized vote and comment counters on Post"""
+
+    def test_vote_transitions(self):
+        post = self.posts[0]
+        data = self.vote(self.voters[0], post, 'up').data['data']
+        self.assertEqual((data['upvotes'], data['downvotes']), (1, 0))
+
+        self.vote(self.voters[1], post, 'up')
+        data = self.vote(self.voters[0], post, 'down').data['data']
+        self.assertEqual((data['upvotes'], data['downvotes']), (1, 1))
+
+        # Repeating the same vote does not double count
+        data = self.vote(self.voters[0], post, 'down').data['data']
+        self.assertEqual((data['upvotes'], data['downvotes']), (1, 1))
+
+        data = self.vote(self.voters[0], post, 'remove').data['data']
+        self.assertEqual((data['upvotes'], data['downvotes']), (1, 0))
+        data = self.vote(self.voters[0], post, 'remove').data['data']
+        self.assertEqual((data['upvotes'], data['downvotes']), (1, 0))
+
+    def test_comment_creation_increments(self):
+        post = self.posts[0]
+        response = self.client.post(f'/api/discussion-rooms/posts/{post.id}/comments/', {'content': 'Hi'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+    def test_comment_deletion_decrements(self):
+        post = self.posts[0]
+        url = f'/api/discussion-rooms/posts/{post.id}/comments/'
+        self.client.post(url, {'content': 'Parent'})
+        parent = Comment.objects.get(content='Parent')
+        self.client.post(url, {'content': 'Reply', 'parent_id': parent.id})
+        self.client.post(url, {'content': 'Other'})
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 3)
+
+        # The reply goes with its parent, by cascade
+        parent.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+    def test_list_does_not_count_per_post(self):
+        """Counters are read from the row: the page costs the same for 5 or 10 posts"""
+        url = f'/api/discussion-rooms/{self.room.id}/posts/?sort=new'
+        # Counts the room's tag facets into the cache
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as five:
+            self.client.get(url)
+        for i in range(5):
+            Post.objects.create(room=self.room, author=self.user, title=f'More {i}', content='Content')
+        with CaptureQueriesContext(connection) as ten:
+            response = self.client.get(url)
+        self.assertEqual(response.data['count'], 10)
+        self.assertEqual(len(ten), len(five))
+
+    def test_reconcile_command(self):
+        post = self.posts[0]
+        PostVote.objects.create(post=post, user=self.voters[0], vote_type='up')
+        PostVote.objects.create(post=post, user=self.voters[1], vote_type='down')
+        Comment.objects.create(post=post, author=self.user, content='Comment')
+        Post.objects.filter(id=self.posts[1].id).update(upvotes=7)
+
+        out = StringIO()
+        call_command('reconcile_post_counters', batch_size=2, stdout=out)
+        self.assertIn('Fixed 2 drifted posts out of 5', out.getvalue())
+
+        post.refresh_from_db()
+        self.assertEqual((post.upvotes, post.downvotes, post.comments_count), (1, 1, 1))
+        self.posts[1].refresh_from_db()
+        self.assertEqual(self.posts[1].upvotes, 0)
+
+
+    @skipUnless(connection.features.has_select_for_update, 'Needs row locks')
+    def test_reconcile_counts_after_locking(self):
+        """Drifted posts are locked before the recount they are fixed with"""
+        Post.objects.filter(id=self.posts[0].id).update(upvotes=3)
+        with CaptureQueriesContext(connection) as queries:
+            call_command('reconcile_post_counters', stdout=StringIO())
+        sql = [query['sql'] for query in queries.captured_queries]
+        locked = next(i for i, statement in enumerate(sql) if 'FOR UPDATE' in statement)
+        self.assertTrue(any('discussions_postvote' in statement for statement in sql[locked + 1:]))
+        self.posts[0].refresh_from_db()
+        self.assertEqual(self.posts[0].upvotes, 0)
+
+
+class UserVoteTestCase(DiscussionTestMixin, TestCase):
+    """The caller's votes are resolved for a whole page at once"""
+
+    def test_post_list(self):
+        self.vote(self.user, self.posts[1], 'up')
+        self.vote(self.user, self.posts[3], 'down')
+        self.vote(self.voters[0], self.posts[0], 'up')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/discussion-rooms/{self.room.id}/posts/', {'sort': 'new'})
+        votes = {item['id']: item['user_vote'] for item in response.data['results']}
+        self.assertEqual(votes, {
+            self.posts[0].id: None, self.posts[1].id: 'up', self.posts[2].id: None,
+            self.posts[3].id: 'down', self.posts[4].id: None,
+        })
+        vote_queries = [q for q in queries.captured_queries if 'discussions_postvote' in q['sql']]
+        self.assertEqual(len(vote_queries), 1)
+
+    def test_comment_list(self):
+        post = self.posts[0]
+        comments = [Comment.objects.create(post=post, author=self.user, content=f'Comment {i}') for i in range(4)]
+        self.client.post(f'/api/discussion-rooms/comments/{comments[2].id}/vote/', {'vote_type': 'up'})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/discussion-rooms/posts/{post.id}/comments/')
+        votes = {item['id']: item['user_vote'] for item in response.data['results']}
+        self.assertEqual(votes[comments[2].id], 'up')
+        self.assertEqual(votes[comments[0].id], None)
+        # Comment vote counts are still counted per comment; only look at the user_vote lookups
+        vote_queries = [
+            q for q in queries.captured_queries
+            if 'discussions_commentvote' in q['sql'] and 'user_id' in q['sql']
+        ]
+        self.assertEqual(len(vote_queries), 1)
+
+    def test_detail_and_vote(self):
+        post = self.posts[0]
+        self.assertEqual(self.vote(self.user, post, 'down').data['data']['user_vote'], 'down')
+        response = self.client.get(f'/api/discussion-rooms/posts/{post.id}/')
+        self.assertEqual(response.data['user_vote'], 'down')
+        self.assertIsNone(self.vote(self.user, post, 'remove').data['data']['user_vote'])
+
+
+class ThreadedCommentTestCase(DiscussionTestMixin, TestCase):
+    """Materialized-path comment trees"""
+
+    def setUp(self):
+        super().setUp()
+        self.post = self.posts[0]
+        self.url = f'/api/discussion-rooms/posts/{self.post.id}/comments/'
+
+    def reply(self, parent=None, content='Reply'):
+        return Comment.objects.create(post=self.post, author=self.user, parent=parent, content=content)
+
+    def ids(self, nodes):
+        return [(int(node['id']), self.ids(node['replies'])) for node in nodes]
+
+    def test_path_and_depth(self):
+        root = self.reply()
+        child = self.reply(root)
+        grandchild = self.reply(child)
+        self.assertEqual(grandchild.depth, 2)
+        self.assertEqual(grandchild.path, path_segment(root.id) + path_segment(child.id) + path_segment(grandchild.id))
+        grandchild.refresh_from_db()
+        self.assertEqual(grandchild.path, root.path + path_segment(child.id) + path_segment(grandchild.id))
+
+    def test_whole_tree_in_one_query(self):
+        a = self.reply()
+        b = self.reply()
+        a1 = self.reply(a)
+        b1 = self.reply(b)
+        a2 = self.reply(a)
+        a1x = self.reply(a1)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'threaded': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.ids(response.data['data']), [
+            (a.id, [(a1.id, [(a1x.id, [])]), (a2.id, [])]),
+            (b.id, [(b1.id, [])]),
+        ])
+        comment_queries = [q for q in queries.captured_queries if 'FROM "discussions_comment"' in q['sql']]
+        self.assertEqual(len(comment_queries), 1)
+
+    def test_deleted_comment_keeps_replies(self):
+        root = self.reply(content='Secret')
+        child = self.reply(root)
+        Comment.objects.filter(id=root.id).update(is_deleted=True)
+        data = self.client.get(self.url, {'threaded': 'true'}).data['data']
+        self.assertEqual(data[0]['content'], '')
+        self.assertEqual(int(data[0]['replies'][0]['id']), child.id)
+
+    def test_thread_pages(self):
+        roots = [self.reply() for _ in range(3)]
+        replies = [self.reply(roots[0]) for _ in range(4)]
+        nested = self.reply(replies[0])
+
+        response = self.client.get(self.url, {'threaded': 'true', 'threads': 2, 'replies': 2})
+        data = response.data['data']
+        self.assertEqual([int(node['id']) for node in data], [roots[0].id, roots[1].id])
+        # First two replies in tree order: replies[0] and its own reply
+        self.assertEqual(self.ids(data[0]['replies']), [(replies[0].id, [(nested.id, [])])])
+        self.assertEqual(data[0]['total_replies'], 5)
+        self.assertEqual(data[1]['total_replies'], 0)
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([int(node['id']) for node in response.data['data']], [roots[2].id])
+        self.assertIsNone(response.data['next'])
+
+    def test_reply_must_be_on_same_post(self):
+        other = Comment.objects.create(post=self.posts[1], author=self.user, content='Elsewhere')
+        response = self.client.post(self.url, {'content': 'Hi', 'parent_id': other.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rebuild_command(self):
+        root = self.reply()
+        child = self.reply(root)
+        Comment.objects.update(path='', depth=0)
+        call_command('rebuild_comment_paths', stdout=StringIO())
+        child.refresh_from_db()
+        self.assertEqual((child.path, child.depth), (path_segment(root.id) + path_segment(child.id), 1))
+
+
+class MembershipCacheTestCase(DiscussionTestMixin, TestCase):
+    """Joined-room sets cached per user"""
+
+    def fresh_user(self, user=None):
+        # A new instance, as the next request would load it
+        return get_user_model().objects.get(pk=(user or self.voters[0]).pk)
+
+    def test_checks_do_not_query(self):
+        user = self.fresh_user()
+        other_room, _ = Exam.objects.create(user=self.user, title='Other', exam_time='2030-01-01') \
+            .get_or_create_discussion_room()
+        self.room.is_member(user)
+        with self.assertNumQueries(0):
+            self.assertFalse(self.room.is_member(user))
+            self.assertFalse(other_room.is_member(user))
+            self.assertFalse(self.exam.is_discussion_member(user))
+        # Cached across requests too
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertFalse(self.room.is_member(user))
+
+    def test_invalidated_on_change(self):
+        user = self.fresh_user()
+        self.assertFalse(self.room.is_member(user))
+        self.room.add_member(self.voters[0])
+        self.assertTrue(self.room.is_member(self.fresh_user()))
+        self.assertTrue(self.exam.is_discussion_member(self.fresh_user()))
+
+        self.voters[0].joined_discussion_rooms.remove(self.room)
+        self.assertFalse(self.room.is_member(self.fresh_user()))
+
+        self.room.members.add(self.voters[0])
+        self.assertTrue(self.room.is_member(self.fresh_user()))
+        self.room.members.clear()
+        self.assertFalse(self.room.is_member(self.fresh_user()))
+
+    def test_deleted_room(self):
+        self.assertIn(self.room.id, joined_rooms(self.fresh_user(self.user))[0])
+        room_id = self.room.id
+        self.room.delete()
+        self.assertNotIn(room_id, joined_rooms(self.fresh_user(self.user))[0])
+
+    def test_join_endpoint(self):
+        self.client.force_authenticate(user=self.voters[0])
+        response = self.client.post(f'/api/discussion-rooms/{self.room.id}/posts/', {'title': 'T', 'content': 'C'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.room.add_member(self.voters[0])
+        response = self.client.post(f'/api/discussion-rooms/{self.room.id}/posts/', {'title': 'T', 'content': 'C'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class RoomEventsTestCase(DiscussionTestMixin, TransactionTestCase):
+    """Realtime room events over WebSocket"""
+
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.user)
+        response = self.client.post(f'/api/discussion-rooms/{self.room.id}/events-ticket/')
+        self.assertEqual(response.data['data']['expires_in'], TICKET_MAX_AGE)
+        self.ticket = response.data['data']['ticket']
+
+    def connect(self, room_id=None, ticket=None, headers=()):
+        room_id = room_id or self.room.id
+        if ticket is None and not headers:
+            ticket = self.ticket
+        communicator = ApplicationCommunicator(websocket_application, {
+            'type': 'websocket',
+            'path': f'/ws/discussion-rooms/{room_id}/events/',
+            'query_string': f'ticket={ticket}'.encode() if ticket else b'',
+            'headers': list(headers),
+        })
+        return communicator
+
+    async def open(self, communicator):
+        await communicator.send_input({'type': 'websocket.connect'})
+        return await communicator.receive_output(1)
+
+    async def next_event(self, communicator):
+        message = await communicator.receive_output(2)
+        self.assertEqual(message['type'], 'websocket.send')
+        return json.loads(message['text'])
+
+    async def close(self, communicator):
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(1)
+
+    def test_post_comment_and_vote_events(self):
+        async def scenario():
+            communicator = self.connect()
+            self.assertEqual((await self.open(communicator))['type'], 'websocket.accept')
+
+            response = await sync_to_async(self.client.post)(
+                f'/api/discussion-rooms/{self.room.id}/posts/', {'title': 'Live', 'content': 'Now'}
+            )
+            event = await self.next_event(communicator)
+            self.assertEqual(event['type'], 'post.created')
+            self.assertEqual(event['data']['id'], response.data['id'])
+            post = await Post.objects.aget(id=response.data['id'])
+
+            await sync_to_async(self.client.post)(f'/api/discussion-rooms/posts/{post.id}/comments/', {'content': 'Hi'})
+            event = await self.next_event(communicator)
+            self.assertEqual((event['type'], event['data']['content']), ('comment.created', 'Hi'))
+
+            await sync_to_async(self.vote)(self.voters[0], post, 'up')
+            event = await self.next_event(communicator)
+            self.assertEqual(event['type'], 'post.voted')
+            self.assertEqual(event['data'], {
+                'post_id': post.id, 'upvotes': 1, 'downvotes': 0, 'score': 1,
+                'delta': {'upvotes': 1, 'score': 1},
+            })
+
+            await self.close(communicator)
+            self.assertEqual(get_broker().subscriber_count(self.room.id), 0)
+
+        async_to_sync(scenario)()
+
+    def test_token_header_and_no_token_in_query(self):
+        async def scenario():
+            communicator = self.connect(headers=[(b'authorization', f'Token {self.token.key}'.encode())])
+            self.assertEqual((await self.open(communicator))['type'], 'websocket.accept')
+            await self.close(communicator)
+
+            communicator = ApplicationCommunicator(websocket_application, {
+                'type': 'websocket',
+                'path': f'/ws/discussion-rooms/{self.room.id}/events/',
+                'query_string': f'token={self.token.key}'.encode(),
+                'headers': [],
+            })
+            await self.open(communicator)
+            self.assertEqual(
+                await communicator.receive_output(1), {'type': 'websocket.close', 'code': CLOSE_UNAUTHENTICATED}
+            )
+
+        async_to_sync(scenario)()
+
+    def test_refused_connections(self):
+        async def scenario():
+            other_room_ticket = sign_ticket(self.user, self.room.id + 100)
+            with patch('django.core.signing.time.time', return_value=time.time() - TICKET_MAX_AGE - 1):
+                expired_ticket = sign_ticket(self.user, self.room.id)
+            for communicator, code in [
+                (self.connect(ticket='invalid'), CLOSE_UNAUTHENTICATED),
+                (self.connect(ticket=other_room_ticket), CLOSE_UNAUTHENTICATED),
+                (self.connect(ticket=expired_ticket), CLOSE_UNAUTHENTICATED),
+                (self.connect(headers=[(b'authorization', b'Token invalid')]), CLOSE_UNAUTHENTICATED),
+                (self.connect(room_id=self.room.id + 100, ticket=other_room_ticket), CLOSE_NOT_FOUND),
+            ]:
+                self.assertEqual((await self.open(communicator))['type'], 'websocket.accept')
+                self.assertEqual(await communicator.receive_output(1), {'type': 'websocket.close', 'code': code})
+
+        async_to_sync(scenario)()
+
+    def test_separate_websocket_process_needs_cross_process_broker(self):
+        with override_settings(DISCUSSION_EVENTS_BACKEND='memory'), self.assertRaises(ImproperlyConfigured):
+            check_cross_process_broker()
+        with override_settings(DISCUSSION_EVENTS_BACKEND='redis'):
+            check_cross_process_broker()
+
+    def test_slow_subscriber_is_closed(self):
+        async def scenario():
+            subscription = Subscription(self.room.id, asyncio.get_running_loop(), queue_size=2)
+            for i in range(3):
+                subscription.put(str(i))
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+
+            await send_events(subscription, send, heartbeat=1)
+            # The queued events are dropped and the connection closed
+            self.assertEqual(sent, [{'type': 'websocket.close', 'code': CLOSE_TOO_SLOW}])
+
+        async_to_sync(scenario)()
+
+
+class VoteTestCase(DiscussionTestMixin, TestCase):
+    """Vote endpoints return counts only and write in one statement on PostgreSQL"""
+
+    def test_post_vote_response(self):
+        post = self.posts[0]
+        self.vote(self.voters[0], post, 'down')
+        response = self.vote(self.user, post, 'up')
+        self.assertEqual(response.data['data'], {
+            'id': post.id, 'upvotes': 1, 'downvotes': 1, 'score': 0, 'user_vote': 'up',
+        })
+
+    def test_comment_votes(self):
+        comment = Comment.objects.create(post=self.posts[0], author=self.user, content='Comment')
+        url = f'/api/discussion-rooms/comments/{comment.id}/vote/'
+        for vote_type, expected in [
+            ('up', (1, 0, 'up')),
+            ('up', (1, 0, 'up')),
+            ('down', (0, 1, 'down')),
+            ('remove', (0, 0, None)),
+            ('remove', (0, 0, None)),
+        ]:
+            data = self.client.post(url, {'vote_type': vote_type}).data['data']
+            self.assertEqual((data['upvotes'], data['downvotes'], data['user_vote']), expected)
+
+    @skipUnless(connection.vendor == 'postgresql', 'single-statement votes need PostgreSQL')
+    def test_single_statement(self):
+        post = self.posts[0]
+        for vote_type in ('up', 'down', 'remove'):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(f'/api/discussion-rooms/posts/{post.id}/vote/', {'vote_type': vote_type})
+            vote_queries = [q for q in queries.captured_queries if 'discussions_postvote' in q['sql']]
+            self.assertEqual(len(vote_queries), 1, vote_type)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'SQLite serializes writers with a database lock')
+class VoteConcurrencyTestCase(DiscussionTestMixin, TransactionTestCase):
+    """Many threads voting on one post leave its counters exact"""
+
+    def test_concurrent_votes(self):
+        post = self.posts[0]
+        User = get_user_model()
+        voters = self.voters + [
+            User.objects.create_user(email=f'extra{i}@example.com', username=f'extra{i}', password='testpass123')
+            for i in range(9)
+        ]
+        rng = random.Random(7)
+        # Every voter votes repeatedly, so the same user's requests also race each other
+        plan = [(rng.choice(voters), rng.choice(['up', 'down', 'remove'])) for _ in range(240)]
+
+        def cast(step):
+            user, vote_type = step
+            client = APIClient()
+            client.force_authenticate(user=user)
+            try:
+                return client.post(f'/api/discussion-rooms/posts/{post.id}/vote/', {'vote_type': vote_type}).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=12) as executor:
+            statuses = list(executor.map(cast, plan))
+        self.assertEqual(set(statuses), {status.HTTP_200_OK})
+
+        post.refresh_from_db()
+        upvotes = PostVote.objects.filter(post=post, vote_type='up').count()
+        downvotes = PostVote.objects.filter(post=post, vote_type='down').count()
+        self.assertEqual((post.upvotes, post.downvotes, post.score), (upvotes, downvotes, upvotes - downvotes))
+
+
+@override_settings(DISCUSSION_VOTE_BUFFER='memory', DISCUSSION_VOTE_FLUSH_INTERVAL=0)
+class VoteBufferTestCase(DiscussionTestMixin, TestCase):
+    """Write-behind vote buffering: votes show at once and reach the database on flush"""
+
+    def setUp(self):
+        super().setUp()
+        get_vote_buffer.cache_clear()
+        self.addCleanup(get_vote_buffer.cache_clear)
+        self.buffer = get_vote_buffer()
+
+    def test_votes_are_buffered_until_flush(self):
+        post = self.posts[0]
+        PostVote.objects.create(post=post, user=self.voters[0], vote_type='down')
+        post.record_vote_change(None, 'down')
+
+        response = self.vote(self.user, post, 'up')
+        self.assertEqual(response.data['data'], {
+            'id': post.id, 'upvotes': 1, 'downvotes': 1, 'score': 0, 'user_vote': 'up',
+        })
+        self.vote(self.voters[0], post, 'remove')
+        self.assertEqual(PostVote.objects.filter(post=post).count(), 1)
+
+        # Reads merge the buffer: the voter's own vote and everyone's pending deltas
+        data = self.client.get(f'/api/discussion-rooms/posts/{post.id}/').data
+        self.assertEqual((data['upvotes'], data['downvotes'], data['user_vote']), (1, 0, 'up'))
+        listed = {item['id']: item for item in self.client.get(f'/api/discussion-rooms/{self.room.id}/posts/').data['results']}
+        self.assertEqual((listed[post.id]['upvotes'], listed[post.id]['downvotes'], listed[post.id]['user_vote']), (1, 0, 'up'))
+
+        self.assertEqual(self.buffer.flush(), 2)
+        post.refresh_from_db()
+        self.assertEqual((post.upvotes, post.downvotes, post.score), (1, 0, 1))
+        self.assertEqual(dict(PostVote.objects.filter(post=post).values_list('user_id', 'vote_type')), {self.user.id: 'up'})
+        self.assertAlmostEqual(
+            post.hot_score, compute_rankings(1, 0, post.created_at, timezone.now())['hot_score'], places=3
+        )
+        self.assertEqual(self.buffer.pending_deltas(PostVote, [post.id]), {})
+        data = self.client.get(f'/api/discussion-rooms/posts/{post.id}/').data
+        self.assertEqual((data['upvotes'], data['downvotes'], data['user_vote']), (1, 0, 'up'))
+
+    def test_repeated_votes_collapse(self):
+        post = self.posts[0]
+        for vote_type in ('up', 'down', 'remove', 'up', 'up'):
+            self.vote(self.user, post, vote_type)
+        self.assertEqual(self.buffer.pending_deltas(PostVote, [post.id])[post.id]['upvotes'], 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(len([q for q in queries.captured_queries if 'discussions_postvote' in q['sql']]), 2)
+        post.refresh_from_db()
+        self.assertEqual((post.upvotes, post.downvotes), (1, 0))
+
+    def test_comment_votes(self):
+        comment = Comment.objects.create(post=self.posts[0], author=self.user, content='Comment')
+        url = f'/api/discussion-rooms/comments/{comment.id}/vote/'
+        data = self.client.post(url, {'vote_type': 'down'}).data['data']
+        self.assertEqual((data['upvotes'], data['downvotes'], data['user_vote']), (0, 1, 'down'))
+        self.assertFalse(comment.votes.exists())
+
+        self.buffer.flush()
+        self.assertEqual(list(comment.votes.values_list('vote_type', flat=True)), ['down'])
+        data = self.client.post(url, {'vote_type': 'remove'}).data['data']
+        self.assertEqual((data['upvotes'], data['downvotes'], data['user_vote']), (0, 0, None))
+        self.buffer.flush()
+        self.assertFalse(comment.votes.exists())
+
+    def test_votes_for_deleted_targets_are_dropped(self):
+        deleted, kept = self.posts[0], self.posts[1]
+        comment = Comment.objects.create(post=kept, author=self.user, content='Comment')
+        self.vote(self.user, deleted, 'up')
+        self.vote(self.voters[0], kept, 'up')
+        self.client.post(f'/api/discussion-rooms/comments/{comment.id}/vote/', {'vote_type': 'down'})
+        self.vote(self.voters[1], kept, 'down')
+        deleted.delete()
+        comment.delete()
+        self.voters[1].delete()
+
+        self.assertEqual(self.buffer.flush(), 1)
+        kept.refresh_from_db()
+        self.assertEqual((kept.upvotes, kept.downvotes), (1, 0))
+        self.assertEqual(list(PostVote.objects.values_list('post_id', 'user_id')), [(kept.id, self.voters[0].id)])
+        # Nothing is left to fail the next flush
+        self.assertEqual(self.buffer.pending_votes(PostVote, self.user.id, [deleted.id]), {})
+        self.assertEqual(self.buffer.pending_deltas(PostVote, [deleted.id, kept.id]), {})
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_vote_recorded_during_flush_is_kept(self):
+        post = self.posts[0]
+        self.vote(self.user, post, 'up')
+        write_votes = vote_buffer.write_votes
+
+        def write_and_vote_again(votes):
+            written = write_votes(votes)
+            self.buffer.record(PostVote, post.id, self.user.id, 'down', 'up')
+            return written
+
+        with patch.object(vote_buffer, 'write_votes', write_and_vote_again):
+            self.buffer.flush()
+        self.assertEqual(self.buffer.pending_votes(PostVote, self.user.id, [post.id]), {post.id: 'down'})
+        self.assertEqual(self.buffer.pending_deltas(PostVote, [post.id])[post.id]['upvotes'], -1)
+        self.buffer.flush()
+        post.refresh_from_db()
+        self.assertEqual((post.upvotes, post.downvotes), (0, 1))
+
+
+    def test_reads_of_deltas_wait_for_the_flush_commit(self):
+        """The flushed votes are committed and dropped from the buffer as one step for readers"""
+        post = self.posts[0]
+        self.vote(self.user, post, 'up')
+        savepoint_commit = connection.savepoint_commit
+        locked_at_commit = []
+
+        def record_lock(sid):
+            locked_at_commit.append(self.buffer._lock.locked())
+            return savepoint_commit(sid)
+
+        # Inside a test case the flush's outermost transaction is a savepoint
+        with patch.object(connection, 'savepoint_commit', record_lock):
+            self.buffer.flush()
+        self.assertEqual(locked_at_commit[-1], True)
+        self.assertFalse(self.buffer._lock.locked())
+        self.assertEqual(self.buffer.pending_deltas(PostVote, [post.id]), {})
+
+
+class PostSearchTestCase(DiscussionTestMixin, TestCase):
+    """?q= full-text search, ?tag= filters and the room's tag facets"""
+
+    def setUp(self):
+        super().setUp()
+        self.url = f'/api/discussion-rooms/{self.room.id}/posts/'
+        self.algebra = Post.objects.create(
+            room=self.room, author=self.user, title='Linear algebra notes',
+            content='Eigenvalues <b>and</b> eigenvectors', tags=['math', 'notes'],
+        )
+        self.mention = Post.objects.create(
+            room=self.room, author=self.user, title='Week plan',
+            content='Review linear maps before the exam', tags=['math'],
+        )
+
+    def test_search_ranks_and_highlights(self):
+        data = self.client.get(self.url, {'q': 'linea'}).data
+        self.assertEqual([post['id'] for post in data['results']], [self.algebra.id, self.mention.id])
+        self.assertEqual(data['results'][0]['highlight']['title'], '<mark>Linear</mark> algebra notes')
+        self.assertEqual(
+            data['results'][1]['highlight']['content'], 'Review <mark>linear</mark> maps before the exam'
+        )
+
+        data = self.client.get(self.url, {'q': 'eigen linear'}).data
+        self.assertEqual([post['id'] for post in data['results']], [self.algebra.id])
+        # User content is escaped around the marks
+        self.assertEqual(
+            data['results'][0]['highlight']['content'],
+            '<mark>Eigenvalues</mark> &lt;b&gt;and&lt;/b&gt; <mark>eigenvectors</mark>',
+        )
+        self.assertEqual(self.client.get(self.url, {'q': 'calculus'}).data['count'], 0)
+        self.assertIsNone(self.client.get(self.url).data['results'][0]['highlight'])
+
+    def test_tag_filter(self):
+        data = self.client.get(self.url, {'tag': 'math'}).data
+        self.assertEqual({post['id'] for post in data['results']}, {self.algebra.id, self.mention.id})
+        data = self.client.get(f'{self.url}?tag=math&tag=notes').data
+        self.assertEqual([post['id'] for post in data['results']], [self.algebra.id])
+        data = self.client.get(self.url, {'tag': 'notes', 'q': 'plan'}).data
+        self.assertEqual(data['count'], 0)
+
+    def test_tag_facets_follow_tag_changes(self):
+        facets = self.client.get(self.url).data['tag_facets']
+        self.assertEqual(facets, [{'tag': 'math', 'count': 2}, {'tag': 'notes', 'count': 1}])
+
+        # Known tags are adjusted in place, without a recount
+        with patch('discussions.search.count_tags') as count_tags:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.mention.tags = ['notes']
+                self.mention.save()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.algebra.delete()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.mention.title = 'Renamed'
+                self.mention.save()
+            facets = self.client.get(self.url).data['tag_facets']
+        count_tags.assert_not_called()
+        self.assertEqual(facets, [{'tag': 'notes', 'count': 1}])
+
+        # A tag the cache does not know yet has the room recounted
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {'title': 'Q', 'content': 'C', 'tags': ['notes', 'exam']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        facets = self.client.get(self.url).data['tag_facets']
+        self.assertEqual(facets, [{'tag': 'notes', 'count': 2}, {'tag': 'exam', 'count': 1}])
+
+    def test_tag_facets_counted_during_a_write_are_not_kept(self):
+        count_tags = search.count_tags
+
+        def count_then_write(room_id):
+            counts = count_tags(room_id)
+            # A post committed after the count but before it is cached
+            with self.captureOnCommitCallbacks(execute=True):
+                Post.objects.create(room=self.room, author=self.user, title='T', content='C', tags=['late'])
+            return counts
+
+        with patch.object(search, 'count_tags', count_then_write):
+            self.client.get(self.url)
+        facets = self.client.get(self.url).data['tag_facets']
+        self.assertIn({'tag': 'late', 'count': 1}, facets)
+
+    @skipUnless(connection.vendor == 'postgresql', 'GIN indexes are PostgreSQL only')
+    def test_gin_indexes_serve_search_and_tags(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+            try:
+                for queryset, index in [
+                    (search_posts(Post.objects.all(), 'linear'), 'discussions_post_search_gin'),
+                    (filter_tags(Post.objects.all(), ['math']), 'discussions_post_tags_gin'),
+                ]:
+                    self.assertIn(index, queryset.explain())
+            finally:
+                cursor.execute('RESET enable_seqscan')
+
+
+class PostAttachmentTestCase(DiscussionTestMixin, TestCase):
+    """Attachments are stored, described and thumbnailed"""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.media_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_override.enable()
+        self.url = f'/api/discussion-rooms/{self.room.id}/posts/'
+
+    def tearDown(self):
+        self.media_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        super().tearDown()
+
+    def image(self, name='photo.png', size=(1200, 600)):
+        output = BytesIO()
+        Image.new('RGBA', size, (200, 40, 40, 128)).save(output, 'PNG')
+        return SimpleUploadedFile(name, output.getvalue(), content_type='application/octet-stream')
+
+    def create_post(self, files):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                self.url, {'title': 'Files', 'content': 'See attached', 'attachments': files}, format='multipart'
+            )
+        return response, callbacks
+
+    def test_files_are_stored_with_metadata(self):
+        notes = SimpleUploadedFile('notes.txt', b'chapter 1', content_type='text/plain')
+        response, _callbacks = self.create_post([self.image(), notes])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        image, text = sorted(response.data['attachments'], key=lambda item: item['name'])[::-1]
+        self.assertEqual((image['name'], image['type'], image['content_type']), ('photo.png', 'image', 'image/png'))
+        self.assertEqual((text['name'], text['type'], text['content_type'], text['size']),
+                         ('notes.txt', 'file', 'text/plain', 9))
+        self.assertIsNone(image['thumbnail_url'])
+
+        attachment = PostAttachment.objects.get(id=text['id'])
+        self.assertTrue(text['url'].startswith('/media/post_attachments/'))
+        with attachment.file.open('rb') as stored:
+            self.assertEqual(stored.read(), b'chapter 1')
+        self.assertEqual(attachment.checksum, hashlib.sha256(b'chapter 1').hexdigest())
+
+    def test_thumbnail_is_generated_after_commit(self):
+        response, callbacks = self.create_post([self.image()])
+        attachment_id = response.data['attachments'][0]['id']
+        with patch('discussions.attachments.queue_thumbnails') as queue_thumbnails:
+            for callback in callbacks:
+                callback()
+        queue_thumbnails.assert_called_once_with([attachment_id])
+
+        self.assertTrue(generate_thumbnail(attachment_id))
+        self.assertFalse(generate_thumbnail(attachment_id))
+        attachment = PostAttachment.objects.get(id=attachment_id)
+        with attachment.thumbnail.open('rb') as thumbnail, Image.open(thumbnail) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (320, 160)))
+
+        data = self.client.get(f'/api/discussion-rooms/posts/{response.data["id"]}/').data
+        self.assertTrue(data['attachments'][0]['thumbnail_url'].startswith('/media/post_attachments/thumbnails/'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.get(id=response.data['id']).delete()
+        self.assertFalse(attachment.file.storage.exists(attachment.file.name))
+        self.assertFalse(attachment.thumbnail.storage.exists(attachment.thumbnail.name))
+
+    def test_failed_upload_stores_nothing(self):
+        storage = PostAttachment._meta.get_field('file').storage
+        save = storage.save
+
+        def flaky_save(name, content, **kwargs):
+            if content.name == 'broken.txt':
+                raise OSError('storage unavailable')
+            return save(name, content, **kwargs)
+
+        files = [SimpleUploadedFile(f'{name}.txt', b'x') for name in ('a', 'b', 'broken', 'c')]
+        with patch.object(storage, 'save', flaky_save), self.assertRaises(OSError):
+            self.create_post(files)
+        self.assertFalse(Post.objects.filter(title='Files').exists())
+        self.assertEqual(
+            [name for _root, _dirs, names in os.walk(self.media_root) for name in names], []
+        )
+
+    def test_frontend_multipart_format(self):
+        # As createPost in frontend/src/lib/api/discussions.ts builds the form
+        notes = SimpleUploadedFile('notes.txt', b'chapter 1', content_type='text/plain')
+        response = self.client.post(self.url, {
+            'title': 'Files', 'content': 'See attached', 'post_type': 'discussion',
+            'tags': json.dumps(['math', 'exam']), 'attachment_0': self.image(), 'attachment_1': notes,
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['tags'], ['math', 'exam'])
+        self.assertEqual([item['name'] for item in response.data['attachments']], ['photo.png', 'notes.txt'])
+
+        response = self.client.post(self.url, {'title': 'T', 'content': 'C', 'tags': '["math"'}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_only_allowed_types_are_stored(self):
+        for name, content in (
+            ('page.html', b'<script>alert(1)</script>'),
+            ('logo.svg', b'<svg xmlns="http://www.w3.org/2000/svg"></svg>'),
+            ('page.pdf', b'<html><script>alert(1)</script></html>'),
+            ('photo.png', b'%PDF-1.4'),
+            ('notes.txt', b'\x89PNG\r\n\x1a\n0000'),
+        ):
+            with self.subTest(name=name):
+                response, _callbacks = self.create_post([SimpleUploadedFile(name, content, content_type='image/png')])
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(PostAttachment.objects.exists())
+        self.assertEqual([name for _root, _dirs, names in os.walk(self.media_root) for name in names], [])
+
+    def test_size_limit_is_per_file(self):
+        # Three files, each under the limit, together well over it
+        with patch.object(AttachmentMultiPartParser, 'max_size', 100 * 1024):
+            files = [SimpleUploadedFile(f'{i}.txt', b'a' * 80 * 1024) for i in range(3)]
+            response, _callbacks = self.create_post(files)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            response, _callbacks = self.create_post([SimpleUploadedFile('big.txt', b'a' * 120 * 1024)])
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_attachment_limit(self):
+        files = [SimpleUploadedFile(f'{i}.txt', b'x') for i in range(MAX_ATTACHMENTS + 1)]
+        response, _callbacks = self.create_post(files)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PostFeedTestCase(DiscussionTestMixin, TestCase):
+    """The cross-room feed merges the posts of every joined room"""
+
+    url = '/api/discussion-rooms/feed/'
+
+    def setUp(self):
+        super().setUp()
+        other_exam = Exam.objects.create(user=self.user, title='Other', exam_time='2030-01-01')
+        self.other_room, _ = other_exam.get_or_create_discussion_room()
+        self.other_room.add_member(self.user)
+        unjoined_exam = Exam.objects.create(user=self.user, title='Unjoined', exam_time='2030-01-01')
+        unjoined_room, _ = unjoined_exam.get_or_create_discussion_room()
+        self.unjoined = Post.objects.create(room=unjoined_room, author=self.user, title='Hidden', content='C')
+        self.other_posts = [
+            Post.objects.create(room=self.other_room, author=self.user, title=f'Other {i}', content='C')
+            for i in range(4)
+        ]
+        # Interleave the two rooms in time, newest first: other 0, post 0, other 1, post 1, ...
+        now = timezone.now()
+        self.expected = []
+        for i in range(5):
+            if i < len(self.other_posts):
+                self.expected.append(self.other_posts[i])
+            self.expected.append(self.posts[i])
+        for age, post in enumerate(self.expected + [self.unjoined]):
+            Post.objects.filter(id=post.id).update(created_at=now - timedelta(minutes=age))
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [post['id'] for post in response.data['data']]
+            url = response.data['next']
+        return ids
+
+    def test_merges_joined_rooms_newest_first(self):
+        expected = [post.id for post in self.expected]
+        self.assertEqual(self.walk(f'{self.url}?page_size=3'), expected)
+        self.assertEqual(self.walk(f'{self.url}?page_size=100'), expected)
+
+    def test_sort_by_score(self):
+        Post.objects.filter(id=self.posts[4].id).update(top_score=5)
+        Post.objects.filter(id=self.other_posts[3].id).update(top_score=3)
+        ids = self.walk(f'{self.url}?sort=top&page_size=4')
+        self.assertEqual(ids[:2], [self.posts[4].id, self.other_posts[3].id])
+        self.assertEqual(sorted(ids), sorted(post.id for post in self.expected))
+
+    def test_left_rooms_drop_out(self):
+        self.other_room.remove_member(self.user)
+        self.assertEqual(self.walk(self.url), [post.id for post in self.posts])
+
+    @override_settings(DISCUSSION_FEED_CACHE_TIMEOUT=60)
+    def test_first_page_is_cached_until_a_room_changes(self):
+        url = f'{self.url}?page_size=3'
+        first = [post['id'] for post in self.client.get(url).data['data']]
+        with patch('discussions.feed.merge_room_pages') as merge:
+            cached = self.client.get(url).data
+        merge.assert_not_called()
+        self.assertEqual([post['id'] for post in cached['data']], first)
+        # The cached page still links to the rest of the feed
+        self.assertEqual(self.walk(cached['next']), [post.id for post in self.expected[3:]])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            new = Post.objects.create(room=self.other_room, author=self.user, title='New', content='C')
+        self.assertEqual([post['id'] for post in self.client.get(url).data['data']], [new.id] + first[:2])
+
+
+class PostRankingTestCase(DiscussionTestMixin, TestCase):
+    """Stored score / hot_score ranking"""
+
+    def age(self, post, hours):
+        Post.objects.filter(id=post.id).update(created_at=timezone.now() - timedelta(hours=hours))
+
+    def test_vote_updates_scores(self):
+        post = self.posts[0]
+        self.vote(self.voters[0], post, 'up')
+        self.vote(self.voters[1], post, 'up')
+        self.vote(self.voters[2], post, 'down')
+        post.refresh_from_db()
+        self.assertEqual(post.score, 1)
+        expected = compute_rankings(2, 1, post.created_at, timezone.now())
+        self.assertAlmostEqual(post.hot_score, expected['hot_score'], places=3)
+        self.assertAlmostEqual(post.top_score, expected['top_score'], places=6)
+        self.assertAlmostEqual(post.controversy_score, expected['controversy_score'], places=6)
+
+    def test_refresh_decays_older_posts(self):
+        """An older post with more votes sinks below a fresh one once the scores are refreshed"""
+        old, fresh = self.posts[0], self.posts[1]
+        for voter in self.voters:
+            self.vote(voter, old, 'up')
+        self.vote(self.voters[0], fresh, 'up')
+        self.age(old, 48)
+        self.age(fresh, 1)
+
+        call_command('refresh_post_rankings', stdout=StringIO())
+
+        response = self.client.get(f'/api/discussion-rooms/{self.room.id}/posts/')
+        ids = [item['id'] for item in response.data['results']]
+        self.assertLess(ids.index(fresh.id), ids.index(old.id))
+        old.refresh_from_db()
+        self.assertAlmostEqual(old.hot_score, 3 / 50 ** HOT_GRAVITY, places=6)
+
+    def test_refresh_skips_posts_outside_window(self):
+        post = self.posts[0]
+        Post.objects.filter(id=post.id).update(score=5, hot_score=1.0)
+        self.age(post, 24 * 60)
+        call_command('refresh_post_rankings', window_days=30, stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.hot_score, 1.0)
+
+    def test_controversial_sort(self):
+        for voter in self.voters[:2]:
+            self.vote(voter, self.posts[2], 'up')
+        self.vote(self.voters[2], self.posts[2], 'down')
+        self.vote(self.voters[0], self.posts[4], 'up')
+        self.vote(self.voters[1], self.posts[4], 'down')
+
+        response = self.client.get(f'/api/discussion-rooms/{self.room.id}/posts/', {'sort': 'controversial'})
+        ids = [item['id'] for item in response.data['results']]
+        self.assertEqual(ids[:2], [self.posts[4].id, self.posts[2].id])
+
+
+class RankingAlgorithmTestCase(TestCase):
+    """Ranking formulas, vectorized and scalar"""
+
+    votes = [(0, 0, 1.0), (3, 0, 5.0), (40, 2, 30.0), (5, 5, 0.0), (1, 9, 200.0), (0, 4, 12.5)]
+
+    def test_vectorized_matches_scalar(self):
+        upvotes, downvotes, ages = zip(*self.votes)
+        for algorithm in RANKINGS.values():
+            expected = [algorithm.score(*post) for post in self.votes]
+            with self.subTest(ranking=algorithm.name):
+                for value, scalar in zip(algorithm.score_many(upvotes, downvotes, ages), expected):
+                    self.assertAlmostEqual(value, scalar, places=9)
+
+    def test_fallback_without_numpy(self):
+        upvotes, downvotes, ages = zip(*self.votes)
+        with patch.object(ranking, 'NUMPY_AVAILABLE', False):
+            values = RANKINGS['top'].score_many(upvotes, downvotes, ages)
+        self.assertEqual(values, [RANKINGS['top'].score(*post) for post in self.votes])
+
+    def test_wilson_prefers_confidence(self):
+        top = RANKINGS['top']
+        self.assertGreater(top.score(40, 2, 0), top.score(3, 0, 0))
+        self.assertEqual(top.score(0, 0, 0), 0)
+
+    def test_controversy_needs_both_sides(self):
+        controversial = RANKINGS['controversial']
+        self.assertEqual(controversial.score(10, 0, 0), 0)
+        self.assertGreater(controversial.score(5, 5, 0), controversial.score(9, 1, 0))
@@ -7,6 +7,8 @@ urlpatterns = [
     
     # Direct discussion room endpoints
     path('<int:room_id>/posts/', views.PostListCreateView.as_view(), name='room-posts'),
+    path('<int:room_id>/events-ticket/', views.room_events_ticket, name='room-events-ticket'),
+    path('feed/', views.PostFeedView.as_view(), name='post-feed'),
     
     # Post endpoints
     path('posts/<int:pk>/', views.PostDetailView.as_view(), name='post-detail'),
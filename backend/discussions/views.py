@@ -2,16 +2,43 @@ from rest_framework import generics, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.parsers import JSONParser, FormParser
+from rest_framework.utils.urls import replace_query_param
 from django.shortcuts import get_object_or_404
+from django.db import transaction
 from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
 from exams.models import Exam
-from .models import DiscussionRoom, Post, Comment, PostVote, CommentVote
+from exams.upload_handlers import StreamingMultiPartParser
+from mysite.pagination import KeysetPaginationMixin
+from .models import DiscussionRoom, Post, Comment, PostVote, CommentVote, joined_rooms, vote_deltas
+from .ranking import get_ranking
+from .consumers import TICKET_MAX_AGE, sign_ticket
+from .comment_tree import PATH_STEP, build_tree, thread_key, thread_page
+from .attachments import MAX_ATTACHMENTS
+from .events import publish_room_event
+from .feed import FeedPagination
+from .search import filter_tags, search_posts, search_terms, tag_facets
+from .votes import cast_comment_vote, cast_post_vote
+from .vote_buffer import get_vote_buffer
 from .serializers import (
-    DiscussionRoomSerializer, PostSerializer, CommentSerializer,
+    DiscussionRoomSerializer, PostSerializer, CommentSerializer, CommentTreeSerializer,
     CreatePostSerializer, CreateCommentSerializer
 )
 
+# Maximum size of a single post attachment
+ATTACHMENT_MAX_SIZE = 20 * 1024 * 1024
+# Threaded comments: replies per thread by default, and the caps on ?threads= / ?replies=
+THREAD_REPLIES = 3
+MAX_THREADS = 100
+MAX_THREAD_REPLIES = 50
+
+
+class AttachmentMultiPartParser(StreamingMultiPartParser):
+    """Multipart parser that hashes and size-limits post attachments while streaming"""
+    max_size = ATTACHMENT_MAX_SIZE
+    max_files = MAX_ATTACHMENTS
+
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -102,39 +129,85 @@ def leave_discussion_room(request, exam_id):
     })
 
 
-class PostListCreateView(generics.ListCreateAPIView):
-    """Post list and create view"""
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def room_events_ticket(request, room_id):
+    """Short-lived ticket for opening the room's events WebSocket (see consumers)"""
+    room = get_object_or_404(DiscussionRoom, id=room_id)
+    return Response({
+        'success': True,
+        'data': {
+            'ticket': sign_ticket(request.user, room.id),
+            'expires_in': TICKET_MAX_AGE,
+        },
+        'message': _('Successfully issued room events ticket')
+    })
+
+
+class PostListCreateView(KeysetPaginationMixin, generics.ListCreateAPIView):
+    """Post list and create view (?pagination=cursor for keyset pagination)"""
     permission_classes = [IsAuthenticated]
     serializer_class = PostSerializer
+    parser_classes = [JSONParser, AttachmentMultiPartParser, FormParser]
     
     def get_queryset(self):
         room_id = self.kwargs.get('room_id')
         room = get_object_or_404(DiscussionRoom, id=room_id)
         
-        queryset = room.posts.all()
+        queryset = room.posts.select_related('room', 'author').prefetch_related('attachments')
         
         # Filter post type
         post_type = self.request.query_params.get('post_type')
         if post_type:
             queryset = queryset.filter(post_type=post_type)
         
+        # Filter tags (every ?tag= must be present)
+        tags = self.request.query_params.getlist('tag')
+        if tags:
+            queryset = filter_tags(queryset, tags)
+        
+        # Full-text search, ordered by relevance instead of ?sort
+        query = self.request.query_params.get('q', '').strip()
+        if query:
+            return search_posts(queryset, query)
+        
         # Sort
         sort_by = self.request.query_params.get('sort', 'hot')
         if sort_by == 'new':
             queryset = queryset.order_by('-created_at')
-        elif sort_by == 'top':
-            # Sort by upvotes count (need calculation)
-            queryset = queryset.extra(
-                select={'vote_score': 'SELECT COUNT(*) FROM discussions_postvote WHERE post_id = discussions_post.id AND vote_type = "up"'}
-            ).order_by('-vote_score', '-created_at')
-        else:  # hot
-            # Hot algorithm: combine time and upvotes
-            queryset = queryset.extra(
-                select={'hot_score': 'SELECT (COUNT(CASE WHEN vote_type = "up" THEN 1 END) - COUNT(CASE WHEN vote_type = "down" THEN 1 END)) * LOG(EXTRACT(EPOCH FROM NOW() - created_at) / 3600 + 1) FROM discussions_postvote WHERE post_id = discussions_post.id'}
-            ).order_by('-hot_score', '-created_at')
+        else:
+            # hot / top / controversial: stored ranking column (see discussions.ranking)
+            ranking = get_ranking(sort_by)
+            queryset = queryset.order_by(f'-{ranking.field}', '-created_at')
         
         return queryset
     
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # Highlighted in each result by PostSerializer
+        context['search_terms'] = search_terms(self.request.query_params.get('q'))
+        return context
+    
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if isinstance(response.data, dict):
+            # Most used tags of the whole room, for filtering by ?tag=
+            response.data['tag_facets'] = tag_facets(self.kwargs.get('room_id'))
+        return response
+    
+    def get_serializer_class(self):
+        if self.request.method == 'POST':
+            return CreatePostSerializer
+        return PostSerializer
+    
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        # Respond with the full post, attachments included
+        data = PostSerializer(serializer.instance, context=self.get_serializer_context()).data
+        return Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(data))
+    
     def perform_create(self, serializer):
         room_id = self.kwargs.get('room_id')
         room = get_object_or_404(DiscussionRoom, id=room_id)
@@ -144,7 +217,29 @@ class PostListCreateView(generics.ListCreateAPIView):
             from rest_framework import serializers
             raise serializers.ValidationError(_('You need to join the discussion room first to post'))
         
-        serializer.save(room=room, author=self.request.user)
+        post = serializer.save(room=room, author=self.request.user)
+        publish_room_event(room.id, 'post.created', PostSerializer(post).data)
+
+
+class PostFeedView(generics.ListAPIView):
+    """
+    Posts of every room the user has joined, merged across rooms
+    (?sort=new|hot|top|controversial, cursor pagination; see discussions.feed)
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = PostSerializer
+    pagination_class = FeedPagination
+    
+    def get_feed_room_ids(self):
+        return joined_rooms(self.request.user)[0]
+    
+    def get_queryset(self):
+        queryset = Post.objects.select_related('room', 'author').prefetch_related('attachments')
+        sort_by = self.request.query_params.get('sort', 'new')
+        if sort_by == 'new':
+            return queryset.order_by('-created_at')
+        ranking = get_ranking(sort_by)
+        return queryset.order_by(f'-{ranking.field}', '-created_at')
 
 
 class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -175,7 +270,7 @@ class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def vote_post(request, post_id):
-    """Vote for post"""
+    """Vote for post; responds with the new counts and the user's vote only"""
     post = get_object_or_404(Post, id=post_id)
     vote_type = request.data.get('vote_type')
     
@@ -185,37 +280,86 @@ def vote_post(request, post_id):
             'error': _('Invalid vote type')
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    # Get existing vote
-    existing_vote = PostVote.objects.filter(post=post, user=request.user).first()
-    
-    if vote_type == 'remove':
-        if existing_vote:
-            existing_vote.delete()
+    new_vote_type = None if vote_type == 'remove' else vote_type
+    buffer = get_vote_buffer()
+    if buffer is not None:
+        old_vote_type, new_vote_type, counts = buffer.cast(
+            PostVote, post.id, request.user, new_vote_type,
+            {'upvotes': post.upvotes, 'downvotes': post.downvotes, 'score': post.score}
+        )
     else:
-        if existing_vote:
-            existing_vote.vote_type = vote_type
-            existing_vote.save()
-        else:
-            PostVote.objects.create(post=post, user=request.user, vote_type=vote_type)
+        old_vote_type, new_vote_type = cast_post_vote(post, request.user, new_vote_type)
+        counts = {'upvotes': post.upvotes, 'downvotes': post.downvotes, 'score': post.score}
+    if old_vote_type != new_vote_type:
+        publish_room_event(post.room_id, 'post.voted', {
+            'post_id': post.id,
+            **counts,
+            'delta': vote_deltas(old_vote_type, new_vote_type),
+        })
     
-    # Return updated post data
-    serializer = PostSerializer(post, context={'request': request})
     return Response({
         'success': True,
-        'data': serializer.data,
+        'data': {'id': post.id, **counts, 'user_vote': new_vote_type},
         'message': _('Vote successful')
     })
 
 
-class CommentListCreateView(generics.ListCreateAPIView):
-    """Comment list and create view"""
+class CommentListCreateView(KeysetPaginationMixin, generics.ListCreateAPIView):
+    """
+    Comment list and create view (?pagination=cursor for keyset pagination)
+
+    ?threaded=true returns the comments as nested trees instead, in one query:
+    the whole post, or with ?threads=N a page of N top-level threads with
+    their first ?replies= replies each (next links to the following page).
+    """
     permission_classes = [IsAuthenticated]
     serializer_class = CommentSerializer
     
     def get_queryset(self):
         post_id = self.kwargs.get('post_id')
         post = get_object_or_404(Post, id=post_id)
-        return post.comments.filter(is_deleted=False)
+        return post.comments.filter(is_deleted=False).select_related('author')
+    
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('threaded') not in ('1', 'true'):
+            return super().list(request, *args, **kwargs)
+
+        post = get_object_or_404(Post, id=self.kwargs.get('post_id'))
+        # Deleted comments are kept (without content) so their replies stay attached
+        comments = post.comments.select_related('author').order_by('path')
+        params = request.query_params
+        try:
+            threads = min(int(params['threads']), MAX_THREADS) if 'threads' in params else None
+            replies = min(int(params.get('replies', THREAD_REPLIES)), MAX_THREAD_REPLIES)
+        except ValueError:
+            threads = replies = -1
+        after = params.get('after')
+        if (threads is not None and threads < 1) or replies < 0 \
+                or (after and not (after.isdigit() and len(after) == PATH_STEP)):
+            return Response({
+                'success': False,
+                'error': _('Invalid thread parameters')
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if threads is None:
+            rows = list(comments)
+        else:
+            rows = list(thread_page(comments, after=after, threads=threads, replies=replies))
+        roots = build_tree(rows)
+
+        response = {'success': True}
+        if threads is not None:
+            has_more = len(roots) > threads
+            roots = roots[:threads]
+            response['next'] = replace_query_param(
+                request.build_absolute_uri(), 'after', thread_key(roots[-1].path)
+            ) if has_more else None
+
+        serializer = CommentTreeSerializer(roots, many=True, context=self.get_serializer_context())
+        # Resolve user_vote for every comment in the tree at once, not level by level
+        serializer.child.load_user_votes(rows)
+        response['data'] = serializer.data
+        return Response(response)
     
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -231,14 +375,22 @@ class CommentListCreateView(generics.ListCreateAPIView):
             from rest_framework import serializers
             raise serializers.ValidationError(_('You need to join the discussion room first to comment'))
         
-        serializer.save(post=post, author=self.request.user)
+        parent = serializer.validated_data.get('parent_id')
+        if parent and parent.post_id != post.id:
+            from rest_framework import serializers
+            raise serializers.ValidationError({'parent_id': _('Parent comment belongs to another post')})
+        
+        with transaction.atomic():
+            comment = serializer.save(post=post, author=self.request.user)
+            post.update_counters(comments_count=1)
+            publish_room_event(post.room_id, 'comment.created', CommentSerializer(comment).data)
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def vote_comment(request, comment_id):
-    """Vote for comment"""
-    comment = get_object_or_404(Comment, id=comment_id)
+    """Vote for comment; responds with the new counts and the user's vote only"""
+    comment = get_object_or_404(Comment.objects.select_related('post'), id=comment_id)
     vote_type = request.data.get('vote_type')
     
     if vote_type not in ['up', 'down', 'remove']:
@@ -247,23 +399,24 @@ def vote_comment(request, comment_id):
             'error': _('Invalid vote type')
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    # Get existing vote
-    existing_vote = CommentVote.objects.filter(comment=comment, user=request.user).first()
-    
-    if vote_type == 'remove':
-        if existing_vote:
-            existing_vote.delete()
+    new_vote_type = None if vote_type == 'remove' else vote_type
+    buffer = get_vote_buffer()
+    if buffer is not None:
+        old_vote_type, new_vote_type, counts = buffer.cast(
+            CommentVote, comment.id, request.user, new_vote_type,
+            {'upvotes': comment.upvotes, 'downvotes': comment.downvotes}
+        )
     else:
-        if existing_vote:
-            existing_vote.vote_type = vote_type
-            existing_vote.save()
-        else:
-            CommentVote.objects.create(comment=comment, user=request.user, vote_type=vote_type)
+        old_vote_type, new_vote_type, counts = cast_comment_vote(comment, request.user, new_vote_type)
+    if old_vote_type != new_vote_type:
+        publish_room_event(comment.post.room_id, 'comment.voted', {
+            'comment_id': comment.id,
+            'post_id': comment.post_id,
+            **counts,
+        })
     
-    # Return updated comment data
-    serializer = CommentSerializer(comment, context={'request': request})
     return Response({
         'success': True,
-        'data': serializer.data,
+        'data': {'id': comment.id, **counts, 'user_vote': new_vote_type},
         'message': _('Vote successful')
-    })
\ No newline at end of file
+    })
@@ -0,0 +1,437 @@
+"""
+Write-behind vote buffering (DISCUSSION_VOTE_BUFFER)
+
+By default each vote is its own transaction (see votes), and a burst of
+votes on a popular post queues on that Post row. With a buffer configured
+the vote endpoints only record the user's latest vote per (post, user) or
+(comment, user), and every DISCUSSION_VOTE_FLUSH_INTERVAL seconds a flusher
+writes what has been buffered in one transaction:
+
+- per vote model, one DELETE for removed votes and one
+  INSERT ... ON CONFLICT DO UPDATE for the rest
+- the counters and rankings of the touched posts, recomputed from the
+  vote table
+
+A user flipping a vote back and forth between flushes reaches the database
+once. Until the flush, reads merge the buffer: the user's own pending votes
+replace the stored ones and the pending counter deltas are added to the
+counts, so a voter sees the vote immediately and everyone else within one
+flush interval. Entries leave the buffer only once the flush committed,
+and reads of the pending deltas wait from just before that commit until
+the flushed entries are gone: counters read from the database before the
+deltas never include a vote twice.
+
+Backends:
+
+- memory: a dict in this process (single worker, development)
+- redis: two hashes shared by every worker; each worker runs a flusher and
+  a Redis lock lets one of them flush at a time
+
+Votes for a post, comment or user deleted before the flush are dropped
+rather than retried.
+
+Counters are always recomputed on flush, so a delta computed against a
+vote that changed in the meantime only shows until the next flush.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from functools import cached_property, lru_cache
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import CommentVote, Post, PostVote, vote_deltas
+from .ranking import RANKINGS, compute_rankings
+
+logger = logging.getLogger(__name__)
+
+# Vote model -> its target field
+VOTE_TARGETS = {PostVote: 'post', CommentVote: 'comment'}
+
+REDIS_VOTES_KEY = 'discussions:vote-buffer:votes'
+REDIS_DELTAS_KEY = 'discussions:vote-buffer:deltas'
+REDIS_FLUSH_LOCK = 'discussions:vote-buffer:flush'
+REDIS_COMMITTING_KEY = 'discussions:vote-buffer:committing'
+# Seconds a crashed flusher may hold the Redis lock
+REDIS_FLUSH_LOCK_TIMEOUT = 60
+# Milliseconds readers wait at most on a flush that set the committing flag
+REDIS_COMMITTING_TIMEOUT = 5000
+# Seconds between checks of the committing flag
+REDIS_COMMITTING_POLL = 0.005
+
+
+def write_votes(votes):
+    """
+    Write buffered votes, {(vote label, target id, user id): vote type or
+    None}, and recompute the counters of the posts they touch; returns how
+    many were written
+
+    Votes whose post, comment or user has been deleted since they were
+    buffered are dropped: they can never be written, and a foreign key
+    error would fail every later flush of the same entries.
+    """
+    user_model = get_user_model()
+    user_ids = set(
+        user_model.objects.filter(pk__in={user_id for _, _, user_id in votes}).values_list('pk', flat=True)
+    )
+    written = 0
+    post_ids = set()
+    with transaction.atomic():
+        for vote_model, target in VOTE_TARGETS.items():
+            label = vote_model._meta.label_lower
+            rows = {(target_id, user_id): vote_type
+                    for (vote_label, target_id, user_id), vote_type in votes.items() if vote_label == label}
+            if not rows:
+                continue
+            # Locked so the targets cannot be deleted before the votes are inserted
+            target_model = vote_model._meta.get_field(target).related_model
+            target_ids = set(
+                target_model.objects.select_for_update().filter(id__in={target_id for target_id, _ in rows})
+                .order_by('id').values_list('id', flat=True)
+            )
+            rows = {(target_id, user_id): vote_type for (target_id, user_id), vote_type in rows.items()
+                    if target_id in target_ids and user_id in user_ids}
+            if not rows:
+                continue
+            written += len(rows)
+            if vote_model is PostVote:
+                post_ids.update(target_id for target_id, _ in rows)
+
+            removed = Q()
+            for (target_id, user_id), vote_type in rows.items():
+                if vote_type is None:
+                    removed |= Q(**{f'{target}_id': target_id, 'user_id': user_id})
+            if removed:
+                vote_model.objects.filter(removed).delete()
+
+            vote_model.objects.bulk_create(
+                [
+                    vote_model(**{f'{target}_id': target_id}, user_id=user_id, vote_type=vote_type)
+                    for (target_id, user_id), vote_type in rows.items() if vote_type is not None
+                ],
+                update_conflicts=True, unique_fields=[target, 'user'], update_fields=['vote_type'],
+            )
+        if post_ids:
+            recount_post_votes(post_ids)
+    if written < len(votes):
+        logger.info('Dropped %d buffered votes for deleted posts, comments or users', len(votes) - written)
+    return written
+
+
+def recount_post_votes(post_ids):
+    """Set the vote counters and rankings of these posts from the vote table"""
+    counts = defaultdict(Counter)
+    for post_id, vote_type, count in (
+        PostVote.objects.filter(post_id__in=post_ids).order_by()
+        .values('post_id', 'vote_type').annotate(count=Count('pk')).values_list('post_id', 'vote_type', 'count')
+    ):
+        counts[post_id][vote_type] = count
+
+    now = timezone.now()
+    posts = list(Post.objects.select_for_update().filter(id__in=post_ids).order_by('id').only('id', 'created_at'))
+    for post in posts:
+        post.upvotes = counts[post.id]['up']
+        post.downvotes = counts[post.id]['down']
+        post.score = post.upvotes - post.downvotes
+        for field, value in compute_rankings(post.upvotes, post.downvotes, post.created_at, now).items():
+            setattr(post, field, value)
+    Post.objects.bulk_update(
+        posts, ['upvotes', 'downvotes', 'score'] + [ranking.field for ranking in RANKINGS.values()]
+    )
+
+
+class VoteBuffer:
+    """Common API of the buffer backends; subclasses store the entries"""
+
+    def __init__(self, interval=None):
+        self.interval = interval if interval is not None else getattr(settings, 'DISCUSSION_VOTE_FLUSH_INTERVAL', 0.3)
+        self._flusher = None
+        self._start_lock = threading.Lock()
+
+    def record(self, vote_model, target_id, user_id, vote_type, stored_vote):
+        """
+        Buffer the user's vote (None removes it) and its counter deltas;
+        returns the vote it replaces, the pending one if any else stored_vote
+        """
+        raise NotImplementedError
+
+    def pending_votes(self, vote_model, user_id, target_ids):
+        """{target id: vote type or None} of the user's buffered votes"""
+        raise NotImplementedError
+
+    def pending_deltas(self, vote_model, target_ids):
+        """{target id: {counter: delta}} of the buffered votes"""
+        raise NotImplementedError
+
+    def flush(self):
+        """
+        Write the buffered votes; returns how many were written. Every
+        buffered entry is drained, including those write_votes had to drop
+        """
+        raise NotImplementedError
+
+    def cast(self, vote_model, target_id, user, vote_type, counts):
+        """
+        Buffer a vote from a request: returns (old vote, new vote, counts)
+        with the stored counts plus every pending delta for the target
+        """
+        stored_vote = vote_model.votes_by(user, [target_id]).get(target_id)
+        old_vote = self.record(vote_model, target_id, user.pk, vote_type, stored_vote)
+        self.start()
+        deltas = self.pending_deltas(vote_model, [target_id]).get(target_id, {})
+        return old_vote, vote_type, {field: value + deltas.get(field, 0) for field, value in counts.items()}
+
+    def start(self):
+        """Start this process's flusher thread (no-op with a flush interval of 0)"""
+        if self.interval <= 0 or self._flusher is not None:
+            return
+        with self._start_lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name='vote-buffer-flush', daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                # The entries stay buffered and are retried on the next tick
+                logger.exception('Failed to flush buffered votes')
+            finally:
+                close_old_connections()
+
+
+class InProcessVoteBuffer(VoteBuffer):
+    """Buffers the votes of this process"""
+
+    def __init__(self, interval=None):
+        super().__init__(interval)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # (vote label, target id, user id) -> vote type or None
+        self._votes = {}
+        # (vote label, target id) -> Counter of counter deltas
+        self._deltas = defaultdict(Counter)
+
+    def record(self, vote_model, target_id, user_id, vote_type, stored_vote):
+        label = vote_model._meta.label_lower
+        key = (label, target_id, user_id)
+        with self._lock:
+            old_vote = self._votes.get(key, stored_vote)
+            self._votes[key] = vote_type
+            self._deltas[(label, target_id)].update(vote_deltas(old_vote, vote_type))
+        return old_vote
+
+    def pending_votes(self, vote_model, user_id, target_ids):
+        label = vote_model._meta.label_lower
+        with self._lock:
+            return {
+                target_id: self._votes[(label, target_id, user_id)]
+                for target_id in target_ids if (label, target_id, user_id) in self._votes
+            }
+
+    def pending_deltas(self, vote_model, target_ids):
+        label = vote_model._meta.label_lower
+        with self._lock:
+            return {
+                target_id: dict(self._deltas[(label, target_id)])
+                for target_id in target_ids if (label, target_id) in self._deltas
+            }
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                votes = dict(self._votes)
+                deltas = {key: Counter(counter) for key, counter in self._deltas.items()}
+            if not votes:
+                return 0
+            locked = False
+            try:
+                with transaction.atomic():
+                    written = write_votes(votes)
+                    # Held across the commit: no read sees the votes both
+                    # committed and still pending
+                    self._lock.acquire()
+                    locked = True
+                self._discard(votes, deltas)
+            finally:
+                if locked:
+                    self._lock.release()
+            return written
+
+    def _discard(self, votes, deltas):
+        """Drop flushed entries; the caller holds _lock"""
+        for key, vote_type in votes.items():
+            # A vote recorded again during the flush stays for the next one
+            if key in self._votes and self._votes[key] == vote_type:
+                del self._votes[key]
+        for key, counter in deltas.items():
+            pending = self._deltas[key]
+            pending.subtract(counter)
+            if not any(pending.values()):
+                del self._deltas[key]
+
+
+class RedisVoteBuffer(VoteBuffer):
+    """
+    Buffers votes in Redis hashes shared by every worker: votes maps
+    "label:target:user" to the vote ('' for a removal) and deltas maps
+    "label:target:counter" to the pending delta
+    """
+
+    # Swaps the user's pending vote and adds the counter deltas, atomically
+    RECORD_SCRIPT = """
+        local old = redis.call('HGET', KEYS[1], ARGV[1])
+        if not old then old = ARGV[3] end
+        redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+        local function add(vote, sign)
+            if vote == 'up' then
+                redis.call('HINCRBY', KEYS[2], ARGV[4] .. 'upvotes', sign)
+                redis.call('HINCRBY', KEYS[2], ARGV[4] .. 'score', sign)
+            elseif vote == 'down' then
+                redis.call('HINCRBY', KEYS[2], ARGV[4] .. 'downvotes', sign)
+                redis.call('HINCRBY', KEYS[2], ARGV[4] .. 'score', -sign)
+            end
+        end
+        add(old, -1)
+        add(ARGV[2], 1)
+        return old
+    """
+
+    # Drops flushed votes (unless recorded again since) and their deltas,
+    # then clears the committing flag; ARGV holds the vote count, then
+    # field/vote pairs, then field/delta pairs
+    COMPLETE_SCRIPT = """
+        local votes = tonumber(ARGV[1])
+        for i = 2, votes * 2, 2 do
+            if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+                redis.call('HDEL', KEYS[1], ARGV[i])
+            end
+        end
+        for i = votes * 2 + 2, #ARGV, 2 do
+            if redis.call('HINCRBY', KEYS[2], ARGV[i], -tonumber(ARGV[i + 1])) == 0 then
+                redis.call('HDEL', KEYS[2], ARGV[i])
+            end
+        end
+        redis.call('DEL', KEYS[3])
+    """
+
+    def __init__(self, url=None, interval=None):
+        super().__init__(interval)
+        self.url = url or settings.DISCUSSION_VOTE_BUFFER_REDIS_URL
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self.url, decode_responses=True)
+        return self._client
+
+    @cached_property
+    def record_script(self):
+        return self.client.register_script(self.RECORD_SCRIPT)
+
+    @cached_property
+    def complete_script(self):
+        return self.client.register_script(self.COMPLETE_SCRIPT)
+
+    def record(self, vote_model, target_id, user_id, vote_type, stored_vote):
+        label = vote_model._meta.label_lower
+        old_vote = self.record_script(
+            keys=[REDIS_VOTES_KEY, REDIS_DELTAS_KEY],
+            args=[f'{label}:{target_id}:{user_id}', vote_type or '', stored_vote or '', f'{label}:{target_id}:'],
+        )
+        return old_vote or None
+
+    def pending_votes(self, vote_model, user_id, target_ids):
+        label = vote_model._meta.label_lower
+        target_ids = list(target_ids)
+        if not target_ids:
+            return {}
+        values = self.client.hmget(REDIS_VOTES_KEY, [f'{label}:{target_id}:{user_id}' for target_id in target_ids])
+        return {target_id: value or None for target_id, value in zip(target_ids, values) if value is not None}
+
+    def pending_deltas(self, vote_model, target_ids):
+        label = vote_model._meta.label_lower
+        fields = [(target_id, counter) for target_id in target_ids for counter in ('upvotes', 'downvotes', 'score')]
+        if not fields:
+            return {}
+        keys = [f'{label}:{target_id}:{counter}' for target_id, counter in fields]
+        while True:
+            # Deltas read while a flush commits may already be in the database
+            with self.client.pipeline() as pipe:
+                pipe.exists(REDIS_COMMITTING_KEY)
+                pipe.hmget(REDIS_DELTAS_KEY, keys)
+                committing, values = pipe.execute()
+            if not committing:
+                break
+            time.sleep(REDIS_COMMITTING_POLL)
+        deltas = defaultdict(dict)
+        for (target_id, counter), value in zip(fields, values):
+            if value is not None:
+                deltas[target_id][counter] = int(value)
+        return dict(deltas)
+
+    def flush(self):
+        lock = self.client.lock(REDIS_FLUSH_LOCK, timeout=REDIS_FLUSH_LOCK_TIMEOUT)
+        if not lock.acquire(blocking=False):
+            # Another worker is flushing
+            return 0
+        try:
+            with self.client.pipeline() as pipe:
+                pipe.hgetall(REDIS_VOTES_KEY)
+                pipe.hgetall(REDIS_DELTAS_KEY)
+                raw_votes, raw_deltas = pipe.execute()
+            if not raw_votes:
+                return 0
+
+            votes = {}
+            for field, vote_type in raw_votes.items():
+                label, target_id, user_id = field.rsplit(':', 2)
+                votes[(label, int(target_id), int(user_id))] = vote_type or None
+            args = [len(raw_votes)]
+            for field, vote_type in raw_votes.items():
+                args += [field, vote_type]
+            for field, delta in raw_deltas.items():
+                args += [field, delta]
+
+            committed = False
+            try:
+                with transaction.atomic():
+                    written = write_votes(votes)
+                    # Readers of the deltas wait from here until they are removed
+                    self.client.set(REDIS_COMMITTING_KEY, 1, px=REDIS_COMMITTING_TIMEOUT)
+                committed = True
+                self.complete_script(keys=[REDIS_VOTES_KEY, REDIS_DELTAS_KEY, REDIS_COMMITTING_KEY], args=args)
+            finally:
+                if not committed:
+                    self.client.delete(REDIS_COMMITTING_KEY)
+            return written
+        finally:
+            lock.release()
+
+
+VOTE_BUFFERS = {
+    'memory': 'discussions.vote_buffer.InProcessVoteBuffer',
+    'redis': 'discussions.vote_buffer.RedisVoteBuffer',
+}
+
+
+@lru_cache(maxsize=None)
+def get_vote_buffer():
+    """The process-wide vote buffer for DISCUSSION_VOTE_BUFFER, or None when votes are written directly"""
+    backend = getattr(settings, 'DISCUSSION_VOTE_BUFFER', '')
+    if not backend:
+        return None
+    return import_string(VOTE_BUFFERS.get(backend, backend))()
@@ -0,0 +1,165 @@
+"""
+Casting votes on posts and comments
+
+On PostgreSQL a vote is a single statement. Setting an up/down vote is
+
+    INSERT ... ON CONFLICT (post_id, user_id) DO UPDATE SET vote_type = EXCLUDED.vote_type
+    WHERE vote_type <> EXCLUDED.vote_type
+    RETURNING CASE WHEN xmax = 0 THEN NULL ELSE <the other type> END AS old_vote
+
+which returns no row when the vote is unchanged (so repeating a vote is a
+no-op), a NULL old vote for a new row and, as there are only two vote
+types, the opposite type when the vote was switched. Removing a vote is
+DELETE ... RETURNING vote_type.
+
+Under READ COMMITTED a statement that waited on another transaction's vote
+can still act on a snapshot taken before that vote committed, so post votes
+first lock the Post row: votes on one post queue there and each statement
+sees the votes before it. Votes on different posts never wait on each other.
+
+For posts the vote runs as a data-modifying CTE of an UPDATE that applies
+the counter delta to the Post row and returns the new counts. Comments have
+no counter columns, so their statement counts the votes as of its snapshot
+and the delta is added in Python.
+
+Other databases lock the existing vote with SELECT ... FOR UPDATE and write
+through the ORM.
+"""
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import CommentVote, Post, PostVote, vote_deltas
+
+OTHER_VOTE = {'up': 'down', 'down': 'up'}
+
+
+def _vote_sql(vote_model, target_column, vote_type):
+    """
+    (sql, params after the target and user ids) of the statement writing the
+    vote, which returns old_vote when the vote changed
+    """
+    table = vote_model._meta.db_table
+    if vote_type is None:
+        return (
+            f'DELETE FROM {table} WHERE {target_column} = %s AND user_id = %s '
+            f'RETURNING vote_type AS old_vote',
+            [],
+        )
+    return (
+        f'INSERT INTO {table} ({target_column}, user_id, vote_type, created_at) VALUES (%s, %s, %s, %s) '
+        f'ON CONFLICT ({target_column}, user_id) DO UPDATE SET vote_type = EXCLUDED.vote_type '
+        f'WHERE {table}.vote_type <> EXCLUDED.vote_type '
+        f'RETURNING CASE WHEN {table}.xmax = 0 THEN NULL ELSE %s END AS old_vote',
+        [vote_type, timezone.now(), OTHER_VOTE[vote_type]],
+    )
+
+
+def cast_post_vote(post, user, vote_type):
+    """
+    Set the user's vote on a post ('up', 'down' or None to remove it) and
+    keep its counters and rankings current
+
+    Returns (old vote, new vote); post.upvotes, downvotes and score hold the
+    new counts afterwards.
+    """
+    if connection.vendor != 'postgresql':
+        return _cast_post_vote_locking(post, user, vote_type)
+
+    vote_sql, extra = _vote_sql(PostVote, 'post_id', vote_type)
+    up = "(CASE WHEN %s = 'up' THEN 1 ELSE 0 END) - (CASE WHEN vote.old_vote = 'up' THEN 1 ELSE 0 END)"
+    down = "(CASE WHEN %s = 'down' THEN 1 ELSE 0 END) - (CASE WHEN vote.old_vote = 'down' THEN 1 ELSE 0 END)"
+    table = Post._meta.db_table
+    sql = (
+        f'WITH vote AS ({vote_sql}), '
+        f'delta AS (SELECT vote.old_vote, {up} AS up, {down} AS down FROM vote) '
+        f'UPDATE {table} SET upvotes = upvotes + delta.up, downvotes = downvotes + delta.down, '
+        f'score = score + delta.up - delta.down '
+        f'FROM delta WHERE {table}.id = %s '
+        f'RETURNING delta.old_vote, {table}.upvotes, {table}.downvotes, {table}.score'
+    )
+    params = [post.pk, user.pk, *extra, vote_type, vote_type, post.pk]
+    with transaction.atomic():
+        # Votes on one post queue on its row, so each statement's snapshot
+        # includes every vote committed before it
+        list(Post.objects.select_for_update().filter(pk=post.pk).values_list('pk', flat=True))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if row is None:
+            # Unchanged vote: nothing was written
+            post.refresh_from_db(fields=['upvotes', 'downvotes', 'score'])
+            return vote_type, vote_type
+        old_vote, post.upvotes, post.downvotes, post.score = row
+        post.refresh_rankings()
+    return old_vote, vote_type
+
+
+def _cast_post_vote_locking(post, user, vote_type):
+    with transaction.atomic():
+        existing_vote = PostVote.objects.select_for_update().filter(post=post, user=user).first()
+        old_vote = existing_vote.vote_type if existing_vote else None
+        if vote_type is None:
+            if existing_vote:
+                existing_vote.delete()
+        elif existing_vote:
+            if old_vote != vote_type:
+                existing_vote.vote_type = vote_type
+                existing_vote.save(update_fields=['vote_type'])
+        else:
+            PostVote.objects.create(post=post, user=user, vote_type=vote_type)
+        post.record_vote_change(old_vote, vote_type)
+    if old_vote == vote_type:
+        post.refresh_from_db(fields=['upvotes', 'downvotes', 'score'])
+    return old_vote, vote_type
+
+
+def cast_comment_vote(comment, user, vote_type):
+    """
+    Set the user's vote on a comment ('up', 'down' or None to remove it)
+
+    Returns (old vote, new vote, {'upvotes': n, 'downvotes': n}) with the
+    counts after the change.
+    """
+    if connection.vendor != 'postgresql':
+        return _cast_comment_vote_locking(comment, user, vote_type)
+
+    vote_sql, extra = _vote_sql(CommentVote, 'comment_id', vote_type)
+    table = CommentVote._meta.db_table
+    count = f"(SELECT COUNT(*) FROM {table} WHERE comment_id = %s AND vote_type = %s)"
+    sql = (
+        f'WITH vote AS ({vote_sql}) '
+        f'SELECT EXISTS (SELECT 1 FROM vote), (SELECT old_vote FROM vote), {count}, {count}'
+    )
+    params = [comment.pk, user.pk, *extra, comment.pk, 'up', comment.pk, 'down']
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        changed, old_vote, upvotes, downvotes = cursor.fetchone()
+    if not changed:
+        old_vote = vote_type
+    # The counts were taken from the snapshot before the vote was written
+    counts = {'upvotes': upvotes, 'downvotes': downvotes}
+    for field, delta in vote_deltas(old_vote, vote_type).items():
+        if field in counts:
+            counts[field] += delta
+    return old_vote, vote_type, counts
+
+
+def _cast_comment_vote_locking(comment, user, vote_type):
+    with transaction.atomic():
+        existing_vote = CommentVote.objects.select_for_update().filter(comment=comment, user=user).first()
+        old_vote = existing_vote.vote_type if existing_vote else None
+        if vote_type is None:
+            if existing_vote:
+                existing_vote.delete()
+        elif existing_vote:
+            if old_vote != vote_type:
+                existing_vote.vote_type = vote_type
+                existing_vote.save(update_fields=['vote_type'])
+        else:
+            CommentVote.objects.create(comment=comment, user=user, vote_type=vote_type)
+        counts = {
+            'upvotes': comment.votes.filter(vote_type='up').count(),
+            'downvotes': comment.votes.filter(vote_type='down').count(),
+        }
+    return old_vote, vote_type, counts
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Exam
+from .models import Exam, MaterialBlob
 
 @admin.register(Exam)
 class ExamAdmin(admin.ModelAdmin):
@@ -18,4 +18,10 @@ class ExamAdmin(admin.ModelAdmin):
 		('附加信息', {
 			'fields': ('material', 'created_at', 'updated_at')
 		}),
-	)
\ No newline at end of file
+	)
+
+@admin.register(MaterialBlob)
+class MaterialBlobAdmin(admin.ModelAdmin):
+	list_display = ('name', 'size', 'content_type', 'ref_count', 'created_at')
+	search_fields = ('checksum', 'name')
+	readonly_fields = ('checksum', 'name', 'size', 'content_type', 'ref_count', 'created_at')
@@ -0,0 +1,147 @@
+"""
+Direct-to-storage uploads for exam materials
+
+Instead of proxying the file through Django, the client asks for an upload
+session, sends the bytes straight to storage, then calls finalize so the
+object can be verified and attached to Exam.material.
+
+- GCS: a resumable upload session URI created by google-cloud-storage
+- Local: a signed URL served by receive_direct_material_upload that appends the
+  chunks to MEDIA_ROOT, following the same Content-Range protocol
+"""
+
+import os
+import re
+import uuid
+import logging
+from typing import Optional
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils.text import get_valid_filename
+
+from .storage_utils import gcs_manager
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_PREFIX = 'exam_materials/'
+SESSION_SALT = 'exams.direct_upload'
+# GCS keeps resumable sessions for a week; local sessions follow the same limit
+SESSION_MAX_AGE = 7 * 24 * 60 * 60
+CHUNK_SIZE = 256 * 1024
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)$')
+
+
+class DirectUploadError(Exception):
+    """Raised when an upload session cannot be created or verified"""
+
+
+def build_object_name(file_name: str) -> str:
+    """Unique object name under exam_materials/ for a client-supplied file name"""
+    safe_name = get_valid_filename(os.path.basename(file_name)) or 'material'
+    return f"{UPLOAD_PREFIX}{uuid.uuid4().hex}/{safe_name}"
+
+
+def sign_session(exam_id: int, object_name: str, size: int, content_type: str) -> str:
+    """Session token binding an object name to the exam it may be attached to"""
+    return signing.dumps({
+        'exam_id': exam_id,
+        'name': object_name,
+        'size': size,
+        'content_type': content_type,
+    }, salt=SESSION_SALT, compress=True)
+
+
+def load_session(token: str) -> dict:
+    """Decode a session token; raises DirectUploadError if invalid or expired"""
+    try:
+        return signing.loads(token, salt=SESSION_SALT, max_age=SESSION_MAX_AGE)
+    except signing.BadSignature as e:
+        raise DirectUploadError('Invalid or expired upload session') from e
+
+
+class GCSDirectUploadBackend:
+    """Resumable upload sessions straight to the GCS bucket"""
+
+    def create_session(self, request, token: str, session: dict) -> dict:
+        if not gcs_manager.bucket:
+            raise DirectUploadError('GCS client not initialized')
+
+        blob = gcs_manager.bucket.blob(session['name'])
+        upload_url = blob.create_resumable_upload_session(
+            content_type=session['content_type'],
+            size=session['size'],
+            origin=request.headers.get('Origin'),
+            timeout=gcs_manager.timeout,
+        )
+        return {'upload_url': upload_url, 'method': 'PUT'}
+
+    def get_object_size(self, object_name: str) -> Optional[int]:
+        if not gcs_manager.bucket:
+            return None
+        blob = gcs_manager.bucket.get_blob(object_name, timeout=gcs_manager.timeout)
+        return blob.size if blob else None
+
+    def delete_object(self, object_name: str) -> None:
+        gcs_manager.delete_blob(object_name)
+
+
+class LocalDirectUploadBackend:
+    """Filesystem-backed sessions for running without GCS"""
+
+    def create_session(self, request, token: str, session: dict) -> dict:
+        upload_url = request.build_absolute_uri(
+            reverse('direct-material-upload', kwargs={'token': token})
+        )
+        return {'upload_url': upload_url, 'method': 'PUT'}
+
+    def get_object_size(self, object_name: str) -> Optional[int]:
+        if not default_storage.exists(object_name):
+            return None
+        return default_storage.size(object_name)
+
+    def delete_object(self, object_name: str) -> None:
+        if default_storage.exists(object_name):
+            default_storage.delete(object_name)
+
+    def receive_chunk(self, session: dict, stream, content_range: Optional[str]) -> int:
+        """
+        Write one chunk of a resumable upload and return the bytes stored so far.
+        Follows the GCS protocol: Content-Range "bytes start-end/total", or
+        "bytes */total" to query the current offset.
+        """
+        path = default_storage.path(session['name'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+
+        start = 0
+        if content_range:
+            match = CONTENT_RANGE_RE.match(content_range.strip())
+            if not match:
+                raise DirectUploadError('Malformed Content-Range header')
+            if match.group(1) is None:
+                return offset
+            start = int(match.group(1))
+        if start != offset:
+            raise DirectUploadError(f'Chunk starts at {start}, expected {offset}')
+
+        with open(path, 'ab') as destination:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                if offset > session['size']:
+                    raise DirectUploadError('Upload exceeds the declared size')
+                destination.write(chunk)
+        return offset
+
+
+def get_direct_upload_backend():
+    """Backend matching the configured media storage"""
+    if getattr(settings, 'USE_GCS', False):
+        return GCSDirectUploadBackend()
+    return LocalDirectUploadBackend()
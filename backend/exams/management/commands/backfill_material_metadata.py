@@ -0,0 +1,73 @@
+"""
+Populate Exam material metadata (size, content type, SHA-256, upload time)
+for rows uploaded before the metadata columns existed.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from exams.models import Exam
+
+
+def _read_metadata(exam):
+    """Hash a stored material file; runs in a worker thread, no DB access"""
+    try:
+        with exam.material.open('rb') as material_file:
+            exam.set_material_metadata(material_file)
+        # Best estimate of the original upload time for legacy rows
+        exam.material_uploaded_at = exam.updated_at
+        return exam, None
+    except Exception as e:
+        return exam, e
+
+
+class Command(BaseCommand):
+    help = 'Backfill material metadata for exams uploaded before it was recorded'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of exams fetched and updated per batch')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Number of concurrent storage reads per batch')
+        parser.add_argument('--force', action='store_true',
+                            help='Recompute metadata even for rows that already have it')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Exam.objects.filter(material__isnull=False).exclude(material='')
+        if not options['force']:
+            queryset = queryset.filter(Q(material_checksum='') | Q(material_size__isnull=True))
+
+        started = time.monotonic()
+        updated = failed = 0
+        last_id = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                # Keyset batches so rows updated in earlier batches are not re-scanned
+                batch = list(queryset.filter(id__gt=last_id).order_by('id')[:batch_size])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+
+                done = []
+                for exam, error in executor.map(_read_metadata, batch):
+                    if error:
+                        failed += 1
+                        self.stderr.write(f'Exam {exam.id} ({exam.material.name}): {error}')
+                    else:
+                        done.append(exam)
+
+                Exam.objects.bulk_update(done, [
+                    'material_size', 'material_content_type',
+                    'material_checksum', 'material_uploaded_at',
+                ])
+                updated += len(done)
+                self.stdout.write(f'Processed up to exam {last_id}: {updated} updated, {failed} failed')
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Backfilled {updated} exams ({failed} failed) in {elapsed:.1f}s'
+        ))
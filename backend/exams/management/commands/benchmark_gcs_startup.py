@@ -0,0 +1,68 @@
+"""
+Measure what GCS client creation adds to process start-up.
+
+Each run starts a fresh interpreter that sets up Django and imports the exams
+views (as a gunicorn worker or management command does), with and without
+forcing the GCS client into existence, e.g.
+
+    python manage.py benchmark_gcs_startup --runs 5
+
+The "eager" column is what every process paid when the client was created
+at import time; "lazy" is what processes that never touch GCS pay now.
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+STARTUP_SCRIPT = '''
+import django
+django.setup()
+import exams.views
+'''
+
+EAGER_SCRIPT = STARTUP_SCRIPT + '''
+from exams.storage_utils import gcs_manager
+gcs_manager.client
+'''
+
+
+class Command(BaseCommand):
+    help = 'Compare process start-up time with lazy and eager GCS client creation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5,
+                            help='Fresh interpreters started per variant')
+
+    def handle(self, *args, **options):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+        if not settings.USE_GCS:
+            self.stdout.write(self.style.WARNING(
+                'USE_GCS is off, so the eager variant does not create a client either; '
+                'set USE_GCS=true to measure credential resolution'
+            ))
+
+        lazy = self.measure(STARTUP_SCRIPT, env, options['runs'])
+        eager = self.measure(EAGER_SCRIPT, env, options['runs'])
+
+        self.stdout.write(f"{'variant':<8}{'median':>10}{'min':>10}{'max':>10}")
+        for name, timings in (('lazy', lazy), ('eager', eager)):
+            self.stdout.write(
+                f"{name:<8}{statistics.median(timings):>9.3f}s{min(timings):>9.3f}s{max(timings):>9.3f}s"
+            )
+        saving = statistics.median(eager) - statistics.median(lazy)
+        self.stdout.write(self.style.SUCCESS(f'Saved per process start: {saving:.3f}s'))
+
+    def measure(self, script, env, runs):
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, '-c', script], env=env, check=True,
+                           cwd=settings.BASE_DIR, capture_output=True)
+            timings.append(time.perf_counter() - started)
+        return timings
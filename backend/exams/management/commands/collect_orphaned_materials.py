@@ -0,0 +1,136 @@
+"""
+Delete stored material objects that no Exam references any more.
+
+Objects under exam_materials/ are scanned page by page (GCS list pages, or a
+directory walk for local storage). Each page is checked against the database
+with one query per table, so memory stays bounded by the page size however
+large the bucket grows. Objects younger than --min-age-hours are skipped:
+they may belong to an upload whose transaction has not committed yet or to a
+direct upload session that has not been finalized.
+
+    python manage.py collect_orphaned_materials --dry-run
+    python manage.py collect_orphaned_materials --workers 16
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from exams.direct_uploads import SESSION_MAX_AGE, UPLOAD_PREFIX
+from exams.models import Exam, MaterialBlob
+from exams.storage_utils import gcs_manager
+
+
+def iter_gcs_objects(prefix, page_size):
+    """(name, size, updated) for each object under prefix in the GCS bucket"""
+    for blob in gcs_manager.iter_blobs(prefix, page_size=page_size):
+        yield blob.name, blob.size or 0, blob.updated
+
+
+def iter_local_objects(prefix):
+    """(name, size, updated) for each file under prefix in MEDIA_ROOT"""
+    root = os.path.join(settings.MEDIA_ROOT, prefix)
+    for directory, _dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            stat = os.stat(path)
+            name = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+            yield name, stat.st_size, datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def referenced_names(names):
+    """The subset of names still referenced by an exam or a material blob"""
+    referenced = set(Exam.objects.filter(material__in=names).values_list('material', flat=True))
+    referenced.update(MaterialBlob.objects.filter(name__in=names).values_list('name', flat=True))
+    return referenced
+
+
+class Command(BaseCommand):
+    help = 'Delete exam material objects in storage that are no longer referenced'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report orphans without deleting them')
+        parser.add_argument('--page-size', type=int, default=1000,
+                            help='Objects listed and checked against the database per page')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Concurrent deletions')
+        parser.add_argument('--min-age-hours', type=float, default=SESSION_MAX_AGE / 3600,
+                            help='Skip objects modified more recently than this (defaults to the '
+                                 'direct upload session lifetime)')
+        parser.add_argument('--prefix', default=UPLOAD_PREFIX,
+                            help='Storage prefix to scan')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=options['min_age_hours'])
+
+        if getattr(settings, 'USE_GCS', False):
+            objects = iter_gcs_objects(options['prefix'], options['page_size'])
+            delete = gcs_manager.delete_blob
+        else:
+            objects = iter_local_objects(options['prefix'])
+            delete = self.delete_local
+
+        started = time.monotonic()
+        scanned = orphaned = deleted = failed = reclaimed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for page in chunked(objects, options['page_size']):
+                scanned += len(page)
+                referenced = referenced_names([name for name, _size, _updated in page])
+                orphans = [
+                    (name, size) for name, size, updated in page
+                    if name not in referenced and updated is not None and updated < cutoff
+                ]
+                orphaned += len(orphans)
+
+                if dry_run:
+                    for name, size in orphans:
+                        self.stdout.write(f'Would delete {name} ({size} bytes)')
+                        reclaimed += size
+                    continue
+
+                names = [name for name, _size in orphans]
+                for (name, size), ok in zip(orphans, executor.map(delete, names)):
+                    if ok:
+                        deleted += 1
+                        reclaimed += size
+                    else:
+                        failed += 1
+                        self.stderr.write(f'Failed to delete {name}')
+
+                elapsed = max(time.monotonic() - started, 1e-6)
+                self.stdout.write(
+                    f'Scanned {scanned} objects ({scanned / elapsed:.0f}/s), '
+                    f'deleted {deleted} ({deleted / elapsed:.1f}/s)'
+                )
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        action = 'Would reclaim' if dry_run else 'Reclaimed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {reclaimed / (1024 * 1024):.1f}MB from {orphaned} orphaned objects '
+            f'({deleted} deleted, {failed} failed) out of {scanned} scanned in {elapsed:.1f}s '
+            f'({scanned / elapsed:.0f} objects/s)'
+        ))
+
+    def delete_local(self, name):
+        try:
+            os.remove(os.path.join(settings.MEDIA_ROOT, name))
+            return True
+        except OSError:
+            return False
@@ -0,0 +1,143 @@
+"""
+Worker that extracts text from queued exam materials.
+
+Run it next to gunicorn, e.g. `python manage.py process_material_extractions`.
+Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so several workers
+can share the queue; extraction itself runs in a process pool.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from exams.models import Exam, MaterialExtraction, MaterialTextChunk
+from exams.text_extraction import UnsupportedMaterial, extract_pages, split_page
+
+
+class Command(BaseCommand):
+    help = 'Extract text from uploaded exam materials in background worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2,
+                            help='Number of extraction processes')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Jobs claimed per round (defaults to 2x workers)')
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+                            help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--max-attempts', type=int, default=3,
+                            help='Attempts before a job is marked failed')
+        parser.add_argument('--stale-minutes', type=int, default=30,
+                            help='Re-queue jobs left processing longer than this (crashed workers)')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue once and exit')
+
+    def handle(self, *args, **options):
+        self.max_attempts = options['max_attempts']
+        self.storage = Exam._meta.get_field('material').storage
+        batch_size = options['batch_size'] or options['workers'] * 2
+
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                self.requeue_stale(options['stale_minutes'])
+                jobs = self.claim(batch_size)
+                if jobs:
+                    self.run_batch(pool, jobs)
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+
+    def requeue_stale(self, minutes):
+        """Re-queue jobs of crashed workers, failing those that used up their attempts"""
+        now = timezone.now()
+        stale = MaterialExtraction.objects.filter(
+            status='processing', updated_at__lt=now - timedelta(minutes=minutes)
+        )
+        # A job that keeps taking its worker down must not be retried forever
+        stale.filter(attempts__gte=self.max_attempts).update(
+            status='failed', error='The worker stopped while extracting this material', updated_at=now
+        )
+        stale.filter(attempts__lt=self.max_attempts).update(status='pending')
+
+    def claim(self, batch_size):
+        """Mark up to batch_size pending jobs as processing and return them"""
+        with transaction.atomic():
+            ids = list(
+                MaterialExtraction.objects.select_for_update(skip_locked=True)
+                .filter(status='pending')
+                .order_by('created_at')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            MaterialExtraction.objects.filter(id__in=ids).update(
+                status='processing', attempts=F('attempts') + 1, updated_at=timezone.now()
+            )
+        return list(MaterialExtraction.objects.filter(id__in=ids))
+
+    def run_batch(self, pool, jobs):
+        futures = {}
+        try:
+            for job in jobs:
+                try:
+                    path = self.download(job.name)
+                except Exception as e:
+                    self.finish_failed(job, e)
+                    continue
+                futures[job.id] = (job, path, pool.submit(extract_pages, path, job.content_type))
+
+            for job, path, future in futures.values():
+                try:
+                    pages = future.result()
+                except UnsupportedMaterial as e:
+                    job.status = 'unsupported'
+                    job.error = str(e)
+                    job.save(update_fields=['status', 'error', 'updated_at'])
+                except Exception as e:
+                    self.finish_failed(job, e)
+                else:
+                    try:
+                        self.store_pages(job, pages)
+                    except Exception as e:
+                        # e.g. text the database rejects: fail the job, not the worker
+                        self.finish_failed(job, e)
+                    else:
+                        self.stdout.write(f'Extracted {len(pages)} pages from {job.name}')
+        finally:
+            for _job, path, _future in futures.values():
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def download(self, name):
+        """Copy a stored material to a local temp file for the worker process"""
+        suffix = os.path.splitext(name)[1]
+        with self.storage.open(name, 'rb') as source, \
+                tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as target:
+            shutil.copyfileobj(source, target)
+        return target.name
+
+    def store_pages(self, job, pages):
+        chunks = [
+            MaterialTextChunk(extraction=job, page_number=page_number, chunk_index=index, text=text)
+            for page_number, page in enumerate(pages, start=1)
+            for index, text in enumerate(split_page(page))
+        ]
+        with transaction.atomic():
+            job.chunks.all().delete()
+            MaterialTextChunk.objects.bulk_create(chunks, batch_size=500)
+            job.status = 'done'
+            job.page_count = len(pages)
+            job.error = ''
+            job.save(update_fields=['status', 'page_count', 'error', 'updated_at'])
+
+    def finish_failed(self, job, error):
+        job.status = 'failed' if job.attempts >= self.max_attempts else 'pending'
+        job.error = str(error)
+        job.save(update_fields=['status', 'error', 'updated_at'])
+        self.stderr.write(f'Extraction of {job.name} failed: {error}')
@@ -0,0 +1,115 @@
+"""
+Content-addressed storage for exam materials
+
+Material files are stored once per SHA-256 under
+exam_materials/sha256/<xx>/<checksum><ext> and reference-counted through
+MaterialBlob. Uploading content that is already stored only bumps the
+reference count; the object is deleted when its last reference goes away.
+Works with whatever storage backs Exam.material (GCS or FileSystemStorage).
+"""
+
+import os
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+CONTENT_PREFIX = 'exam_materials/sha256/'
+
+
+def content_addressed_name(checksum, file_name):
+    """Deterministic object name for a checksum, keeping the file extension"""
+    ext = os.path.splitext(file_name or '')[1].lower()
+    return f"{CONTENT_PREFIX}{checksum[:2]}/{checksum}{ext}"
+
+
+def store_material(storage, file, checksum, size, content_type):
+    """
+    Store a material file unless identical content is already stored.
+    Returns the object name to save on Exam.material; the reference count
+    is incremented in the caller's transaction.
+    """
+    from .models import MaterialBlob
+
+    if MaterialBlob.objects.filter(checksum=checksum).update(ref_count=F('ref_count') + 1):
+        # Duplicate upload: metadata-only operation
+        return MaterialBlob.objects.values_list('name', flat=True).get(checksum=checksum)
+
+    name = storage.save(content_addressed_name(checksum, file.name), file)
+    return register_blob(storage, name, checksum, size, content_type)
+
+
+def adopt_material(storage, name, checksum, size, content_type):
+    """
+    Reference an object that was uploaded straight to storage. If the same
+    content is already stored, the new object is deleted and the existing
+    one is referenced instead.
+    """
+    from .models import MaterialBlob
+
+    if MaterialBlob.objects.filter(checksum=checksum).update(ref_count=F('ref_count') + 1):
+        existing = MaterialBlob.objects.values_list('name', flat=True).get(checksum=checksum)
+        if existing != name:
+            transaction.on_commit(lambda: storage.delete(name))
+        return existing
+    return register_blob(storage, name, checksum, size, content_type)
+
+
+def register_blob(storage, name, checksum, size, content_type):
+    """
+    Record an object that is already in storage as a blob with one reference.
+    If another request registered the same content first, the new object is
+    dropped and the existing one is referenced instead.
+    """
+    from .models import MaterialBlob
+
+    try:
+        with transaction.atomic():
+            MaterialBlob.objects.create(
+                checksum=checksum,
+                name=name,
+                size=size,
+                content_type=content_type,
+                ref_count=1,
+            )
+        return name
+    except IntegrityError:
+        existing = MaterialBlob.objects.select_for_update().get(checksum=checksum)
+        existing.ref_count = F('ref_count') + 1
+        existing.save(update_fields=['ref_count'])
+        if existing.name != name:
+            storage.delete(name)
+        return existing.name
+
+
+def release_material(storage, name):
+    """
+    Drop one reference to a stored material and delete the object after
+    commit once nothing references it any more
+    """
+    from .models import Exam, MaterialBlob
+
+    if not name:
+        return
+
+    with transaction.atomic():
+        blob = MaterialBlob.objects.select_for_update().filter(name=name).first()
+        if blob is not None:
+            if blob.ref_count > 1:
+                blob.ref_count = F('ref_count') - 1
+                blob.save(update_fields=['ref_count'])
+                return
+            blob.delete()
+        elif Exam.objects.filter(material=name).exists():
+            # Legacy object (uploaded before deduplication) still in use
+            return
+
+    def delete_object():
+        try:
+            storage.delete(name)
+        except Exception as e:
+            logger.error(f"Failed to delete material {name}: {e}")
+
+    transaction.on_commit(delete_object)
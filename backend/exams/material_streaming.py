@@ -0,0 +1,141 @@
+"""
+Byte-range and conditional-GET streaming of exam materials
+
+build_material_response answers one GET/HEAD for a stored material:
+
+- ETag is the content SHA-256 and Last-Modified the upload time, so
+  If-None-Match / If-Modified-Since revalidations get a 304 without touching
+  storage (django.utils.cache.get_conditional_response)
+- a single "Range: bytes=..." request gets 206 with only those bytes, honouring
+  If-Range; multi-range requests get the whole file, which RFC 9110 allows
+- local storage is handed to the front-end server with X-Accel-Redirect when
+  MATERIAL_ACCEL_REDIRECT_PREFIX is set, otherwise read in chunks
+- GCS objects are fetched chunk by chunk with ranged downloads
+
+The file is never read into memory as a whole.
+"""
+
+import re
+import mimetypes
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from .storage_utils import gcs_manager
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested byte range lies outside the file"""
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive for a single-range Range header, or None when the
+    whole file should be sent (no header, multiple ranges, unknown unit)
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def if_range_matches(request, etag, last_modified):
+    """Whether the If-Range precondition (if any) allows a partial response"""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return last_modified is not None and parse_http_date_safe(if_range) == last_modified
+
+
+def iter_local_file(storage, name, start, end, chunk_size=STREAM_CHUNK_SIZE):
+    with storage.open(name, 'rb') as source:
+        source.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = source.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def build_material_response(request, exam):
+    """Streaming (or 304/206/416) response for exam.material"""
+    storage = exam.material.storage
+    name = exam.material.name
+    size = exam.material_size if exam.material_size is not None else storage.size(name)
+    content_type = (
+        exam.material_content_type
+        or mimetypes.guess_type(name)[0]
+        or 'application/octet-stream'
+    )
+    etag = quote_etag(exam.material_checksum) if exam.material_checksum else None
+    last_modified = int(exam.material_uploaded_at.timestamp()) if exam.material_uploaded_at else None
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    try:
+        byte_range = parse_range(request.headers.get('Range'), size)
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range and not if_range_matches(request, etag, last_modified):
+        byte_range = None
+    start, end = byte_range or (0, size - 1)
+
+    accel_prefix = getattr(settings, 'MATERIAL_ACCEL_REDIRECT_PREFIX', None)
+    if request.method == 'HEAD' or size == 0:
+        response = HttpResponse(content_type=content_type)
+    elif accel_prefix and not getattr(settings, 'USE_GCS', False):
+        # nginx serves the file (and the Range) from an internal location
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = accel_prefix + quote(name)
+        response['X-Accel-Buffering'] = 'no'
+        byte_range = None
+    elif getattr(settings, 'USE_GCS', False):
+        chunks = gcs_manager.iter_blob_range(name, start, end, STREAM_CHUNK_SIZE)
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+    else:
+        chunks = iter_local_file(storage, name, start, end)
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+
+    if byte_range:
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    if 'X-Accel-Redirect' not in response:
+        response['Content-Length'] = str(end - start + 1 if size else 0)
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = 'private, no-cache'
+    if etag:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    response['Content-Disposition'] = f"inline; filename*=UTF-8''{quote(exam.material_file_name)}"
+    return response
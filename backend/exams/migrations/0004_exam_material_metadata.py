@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-17 09:00
+# 记录资料文件元数据（大小、类型、SHA-256、上传时间），同时合并两个 0002 分支
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exams', '0002_smart_add_fields'),
+        ('exams', '0003_fix_existing_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exam',
+            name='material_size',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Material Size'),
+        ),
+        migrations.AddField(
+            model_name='exam',
+            name='material_content_type',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='Material Content Type'),
+        ),
+        migrations.AddField(
+            model_name='exam',
+            name='material_checksum',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='Material SHA-256'),
+        ),
+        migrations.AddField(
+            model_name='exam',
+            name='material_uploaded_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Material Uploaded At'),
+        ),
+    ]
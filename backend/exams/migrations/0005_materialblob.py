@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:00
+# 内容寻址存储：按 SHA-256 去重并对资料文件进行引用计数
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exams', '0004_exam_material_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterialBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checksum', models.CharField(max_length=64, unique=True, verbose_name='SHA-256')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Object Name')),
+                ('size', models.BigIntegerField(blank=True, null=True)),
+                ('content_type', models.CharField(blank=True, default='', max_length=100)),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='Reference Count')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Material Blob',
+                'verbose_name_plural': 'Material Blobs',
+            },
+        ),
+    ]
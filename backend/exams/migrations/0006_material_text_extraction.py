@@ -0,0 +1,51 @@
+# Generated by Django 5.2.5 on 2026-10-17 11:00
+# 资料文本提取：按内容哈希记录提取任务，并按页分块保存文本
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exams', '0005_materialblob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterialExtraction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checksum', models.CharField(max_length=64, unique=True, verbose_name='SHA-256')),
+                ('name', models.CharField(max_length=255, verbose_name='Object Name')),
+                ('content_type', models.CharField(blank=True, default='', max_length=100)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed'), ('unsupported', 'Unsupported')], default='pending', max_length=20)),
+                ('page_count', models.PositiveIntegerField(default=0)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Material Extraction',
+                'verbose_name_plural': 'Material Extractions',
+                'indexes': [models.Index(fields=['status', 'created_at'], name='exams_mater_status_1f52c5_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MaterialTextChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_number', models.PositiveIntegerField()),
+                ('chunk_index', models.PositiveIntegerField(default=0)),
+                ('text', models.TextField()),
+                ('extraction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='exams.materialextraction')),
+            ],
+            options={
+                'verbose_name': 'Material Text Chunk',
+                'verbose_name_plural': 'Material Text Chunks',
+                'ordering': ['extraction', 'page_number', 'chunk_index'],
+                'constraints': [models.UniqueConstraint(fields=('extraction', 'page_number', 'chunk_index'), name='exams_unique_material_text_chunk')],
+            },
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.5 on 2026-10-17 12:00
+# PostgreSQL专用：考试全文搜索（tsvector 触发器 + GIN 索引 + pg_trgm 三元组索引）
+# 其他数据库（本地 SQLite）只添加字段，搜索走 icontains 回退路径
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def add_search_index(apps, schema_editor):
+    """为PostgreSQL创建搜索触发器和索引"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    cursor = schema_editor.connection.cursor()
+
+    # 维护 search_vector：标题权重 A，分类 B，描述 C
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION exams_exam_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector :=
+                setweight(to_tsvector('simple', coalesce(NEW.title, '')), 'A') ||
+                setweight(to_tsvector('simple', coalesce(NEW.category, '')), 'B') ||
+                setweight(to_tsvector('simple', coalesce(NEW.description, '')), 'C');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+    """)
+    cursor.execute("DROP TRIGGER IF EXISTS exams_exam_search_vector_trigger ON exams_exam;")
+    cursor.execute("""
+        CREATE TRIGGER exams_exam_search_vector_trigger
+        BEFORE INSERT OR UPDATE OF title, description, category, search_vector ON exams_exam
+        FOR EACH ROW EXECUTE FUNCTION exams_exam_search_vector_update();
+    """)
+
+    # 回填现有数据（触发器会重新计算）
+    cursor.execute("UPDATE exams_exam SET title = title;")
+
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS exams_exam_search_vector_gin
+        ON exams_exam USING gin (search_vector);
+    """)
+
+    # 三元组模糊匹配（短查询、部分词、拼写错误），扩展不可用时跳过
+    cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm';")
+    if cursor.fetchone():
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS exams_exam_title_trgm
+            ON exams_exam USING gin (title gin_trgm_ops);
+        """)
+
+
+def remove_search_index(apps, schema_editor):
+    """回滚操作"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    cursor = schema_editor.connection.cursor()
+    cursor.execute("DROP INDEX IF EXISTS exams_exam_title_trgm;")
+    cursor.execute("DROP INDEX IF EXISTS exams_exam_search_vector_gin;")
+    cursor.execute("DROP TRIGGER IF EXISTS exams_exam_search_vector_trigger ON exams_exam;")
+    cursor.execute("DROP FUNCTION IF EXISTS exams_exam_search_vector_update();")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exams', '0006_material_text_extraction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exam',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(add_search_index, remove_search_index),
+    ]
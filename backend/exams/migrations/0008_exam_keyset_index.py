@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:00
+# 考试列表游标分页索引 (created_at, id)
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exams', '0007_exam_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='exam',
+            index=models.Index(fields=['-created_at', '-id'], name='exams_exam_created_id_idx'),
+        ),
+    ]
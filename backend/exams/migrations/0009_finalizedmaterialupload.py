@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-17 14:00
+# 直传会话只能完成一次，重复提交不会再次增加引用计数
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exams', '0008_exam_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FinalizedMaterialUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_name', models.CharField(max_length=255, unique=True, verbose_name='Object Name')),
+                ('finalized_at', models.DateTimeField(auto_now_add=True)),
+                ('exam', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='exams.exam')),
+            ],
+            options={
+                'verbose_name': 'Finalized Material Upload',
+                'verbose_name_plural': 'Finalized Material Uploads',
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-17 14:30
+# 资料按SHA-256去重存储后，单独保存上传时的原始文件名用于展示和下载
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exams', '0009_finalizedmaterialupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exam',
+            name='material_original_name',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Material File Name'),
+        ),
+    ]
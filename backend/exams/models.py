@@ -1,8 +1,108 @@
-from django.db import models
+import os
+import re
+import hashlib
+import mimetypes
+from functools import lru_cache
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField, TrigramSimilarity
+from django.db import connection, models, transaction
+from django.db.models.functions import Cast, Coalesce
 from django.conf import settings
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from .validators import validate_exam_material
 
+
+# Text search configuration used by the exams_exam search_vector trigger.
+# 'simple' does no stemming, which keeps mixed Chinese/English titles searchable.
+SEARCH_CONFIG = 'simple'
+
+
+@lru_cache(maxsize=None)
+def _has_trigram_extension():
+	"""Whether pg_trgm is installed (migration 0007 creates it where available)"""
+	with connection.cursor() as cursor:
+		cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+		return cursor.fetchone() is not None
+
+
+class ExamQuerySet(models.QuerySet):
+	"""QuerySet helpers for exam list/detail endpoints"""
+
+	def search(self, query):
+		"""
+		Ranked search over title, description and category.
+		PostgreSQL: prefix-matching tsquery against the GIN-indexed search_vector,
+		plus trigram similarity on title for typos and partial words.
+		Other databases (SQLite for local runs): icontains per term, ranked by field.
+		"""
+		terms = re.findall(r'\w+', query)
+		if not terms:
+			return self.none()
+
+		if connection.vendor == 'postgresql':
+			ts_query = SearchQuery(
+				' & '.join(f'{term}:*' for term in terms),
+				config=SEARCH_CONFIG,
+				search_type='raw',
+			)
+			matches = models.Q(search_vector=ts_query)
+			rank = SearchRank(models.F('search_vector'), ts_query)
+			if _has_trigram_extension():
+				matches |= models.Q(title__trigram_similar=query)
+				rank = rank + TrigramSimilarity('title', query)
+			# ts_rank is a float4; as float8 the value round-trips exactly through cursors
+			rank = Cast(rank, models.FloatField())
+			return self.filter(matches).annotate(search_rank=rank).order_by('-search_rank', '-created_at')
+
+		matches = models.Q()
+		rank = models.Value(0)
+		for term in terms:
+			matches &= (
+				models.Q(title__icontains=term)
+				| models.Q(category__icontains=term)
+				| models.Q(description__icontains=term)
+			)
+			for field, weight in (('title', 3), ('category', 2), ('description', 1)):
+				rank = rank + models.Case(
+					models.When(**{f'{field}__icontains': term}, then=models.Value(weight)),
+					default=models.Value(0),
+				)
+		return self.filter(matches).annotate(search_rank=rank).order_by('-search_rank', '-created_at')
+
+	def with_discussion_stats(self, user=None):
+		"""
+		Annotate discussion room stats so serializing a page costs one query.
+		Adds room_exists, room_members_count, room_posts_count and room_is_member.
+		"""
+		from discussions.models import DiscussionRoom, Post
+
+		memberships = DiscussionRoom.members.through.objects.filter(
+			discussionroom__exam=models.OuterRef('pk')
+		)
+		members_count = memberships.order_by().values('discussionroom__exam').annotate(
+			count=models.Count('pk')
+		).values('count')
+		posts_count = Post.objects.filter(
+			room__exam=models.OuterRef('pk')
+		).order_by().values('room__exam').annotate(
+			count=models.Count('pk')
+		).values('count')
+
+		if user is not None and user.is_authenticated:
+			is_member = models.Exists(memberships.filter(user_id=user.pk))
+		else:
+			is_member = models.Value(False, output_field=models.BooleanField())
+
+		return self.select_related('user').annotate(
+			room_exists=models.Exists(DiscussionRoom.objects.filter(exam=models.OuterRef('pk'))),
+			room_members_count=Coalesce(models.Subquery(members_count), 0),
+			room_posts_count=Coalesce(models.Subquery(posts_count), 0),
+			room_is_member=is_member,
+		)
+
+
 class Exam(models.Model):
 	user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='exams')
 	title = models.CharField(max_length=200, verbose_name=_('Exam Title'))
@@ -17,17 +117,129 @@ class Exam(models.Model):
 		validators=[validate_exam_material],
 		help_text=_('Upload PDF, DOC, or DOCX files (max 10MB)')
 	)
+	# Material metadata, recorded when the file is stored so reads never hit storage
+	material_size = models.BigIntegerField(null=True, blank=True, verbose_name=_('Material Size'))
+	material_content_type = models.CharField(max_length=100, blank=True, default='', verbose_name=_('Material Content Type'))
+	material_checksum = models.CharField(max_length=64, blank=True, default='', verbose_name=_('Material SHA-256'))
+	material_uploaded_at = models.DateTimeField(null=True, blank=True, verbose_name=_('Material Uploaded At'))
+	# The uploader's file name; stored objects are named after their SHA-256
+	material_original_name = models.CharField(max_length=255, blank=True, default='', verbose_name=_('Material File Name'))
+	# Maintained by a PostgreSQL trigger (migration 0007); unused on other databases
+	search_vector = SearchVectorField(null=True, editable=False)
 	created_at = models.DateTimeField(auto_now_add=True)
 	updated_at = models.DateTimeField(auto_now=True)
 
+	objects = ExamQuerySet.as_manager()
+
 	class Meta:
 		ordering = ['-created_at']
 		verbose_name = _('Exam')
 		verbose_name_plural = _('Exams')
+		indexes = [
+			# Keyset pagination on (created_at, id)
+			models.Index(fields=['-created_at', '-id'], name='exams_exam_created_id_idx'),
+		]
 
 	def __str__(self):
 		return str(self.title)
 
+	@classmethod
+	def from_db(cls, db, field_names, values):
+		instance = super().from_db(db, field_names, values)
+		# Remember the stored material so a replaced or cleared file can be released
+		if 'material' in field_names:
+			instance._loaded_material = values[field_names.index('material')]
+		return instance
+
+	def save(self, *args, **kwargs):
+		from .material_store import release_material, store_material
+		from .text_extraction import queue_material_extraction
+
+		previous = getattr(self, '_loaded_material', None)
+		stored = False
+		with transaction.atomic():
+			# A newly assigned file is uncommitted until storage saves it
+			if self.material and not self.material._committed:
+				self.set_material_metadata(self.material.file)
+				# Identical content is stored once and shared between exams
+				self.material.name = store_material(
+					self.material.storage, self.material.file, self.material_checksum,
+					self.material_size, self.material_content_type
+				)
+				self.material._committed = True
+				stored = True
+			elif not self.material and self.material_uploaded_at:
+				self.clear_material_metadata()
+			super().save(*args, **kwargs)
+
+			current = self.material.name if self.material else None
+			# Re-uploading identical content still took a new reference
+			if previous and (previous != current or stored):
+				release_material(self.material.storage, previous)
+			if current and current != previous and self.material_checksum:
+				# Text extraction runs in a background worker; known content is reused
+				queue_material_extraction(self.material_checksum, current, self.material_content_type)
+		self._loaded_material = current
+
+	def set_material_metadata(self, file):
+		"""Record size, content type and SHA-256 of a material file"""
+		# StreamingUploadHandler already hashed the file while it was received
+		checksum = getattr(file, 'sha256', None)
+		if checksum:
+			size = file.size
+		else:
+			digest = hashlib.sha256()
+			size = 0
+			for chunk in file.chunks():
+				digest.update(chunk)
+				size += len(chunk)
+			if hasattr(file, 'seek'):
+				file.seek(0)
+			checksum = digest.hexdigest()
+
+		content_type = (
+			getattr(file, 'detected_content_type', None)
+			or getattr(file, 'content_type', None)
+			or mimetypes.guess_type(file.name)[0]
+		)
+		self.material_size = size
+		self.material_content_type = content_type or 'application/octet-stream'
+		self.material_checksum = checksum
+		self.material_uploaded_at = timezone.now()
+		self.material_original_name = os.path.basename(file.name or '')[:255]
+
+	def clear_material_metadata(self):
+		"""Reset material metadata after the file is removed"""
+		self.material_size = None
+		self.material_content_type = ''
+		self.material_checksum = ''
+		self.material_uploaded_at = None
+		self.material_original_name = ''
+
+	@property
+	def material_file_name(self):
+		"""Name shown to users and offered for downloads"""
+		if self.material_original_name:
+			return self.material_original_name
+		if self.material and self.material.name:
+			# Uploaded before original names were kept
+			return os.path.basename(self.material.name)
+		return 'material'
+
+	def get_material_info(self):
+		"""Material info answered from the database, without a storage round trip"""
+		if not self.material:
+			return None
+		return {
+			'name': self.material.name,
+			'file_name': self.material_file_name,
+			'url': self.material.url,
+			'size': self.material_size,
+			'content_type': self.material_content_type or None,
+			'checksum': self.material_checksum or None,
+			'uploaded_at': self.material_uploaded_at.isoformat() if self.material_uploaded_at else None,
+		}
+
 
 	# Discussion room related methods
 	@property
@@ -60,13 +272,9 @@ class Exam(models.Model):
 
 	def is_discussion_member(self, user):
 		"""Check if user is a member of this exam's discussion room"""
-		try:
-			room = self.discussion_room
-			if room:
-				return room.is_member(user)
-			return False
-		except:
-			return False
+		from discussions.models import joined_rooms
+		exam_ids = joined_rooms(user)[1]
+		return self.pk in exam_ids
 
 	@property
 	def discussion_members_count(self):
@@ -88,4 +296,96 @@ class Exam(models.Model):
 				return room.posts.count()  # Use posts.count() instead of posts_count
 			return 0
 		except:
-			return 0
\ No newline at end of file
+			return 0
+
+
+class MaterialBlob(models.Model):
+	"""A stored material object, shared by every exam that uploaded the same content"""
+	checksum = models.CharField(max_length=64, unique=True, verbose_name=_('SHA-256'))
+	name = models.CharField(max_length=255, unique=True, verbose_name=_('Object Name'))
+	size = models.BigIntegerField(null=True, blank=True)
+	content_type = models.CharField(max_length=100, blank=True, default='')
+	ref_count = models.PositiveIntegerField(default=0, verbose_name=_('Reference Count'))
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	class Meta:
+		verbose_name = _('Material Blob')
+		verbose_name_plural = _('Material Blobs')
+
+	def __str__(self):
+		return f"{self.name} ({self.ref_count} refs)"
+
+
+class FinalizedMaterialUpload(models.Model):
+	"""A finalized direct upload; its session token cannot be finalized again"""
+	object_name = models.CharField(max_length=255, unique=True, verbose_name=_('Object Name'))
+	exam = models.ForeignKey(Exam, on_delete=models.CASCADE, related_name='+')
+	finalized_at = models.DateTimeField(auto_now_add=True)
+
+	class Meta:
+		verbose_name = _('Finalized Material Upload')
+		verbose_name_plural = _('Finalized Material Uploads')
+
+	def __str__(self):
+		return self.object_name
+
+
+class MaterialExtraction(models.Model):
+	"""Text extraction job and result for one material content hash"""
+	STATUS_CHOICES = [
+		('pending', _('Pending')),
+		('processing', _('Processing')),
+		('done', _('Done')),
+		('failed', _('Failed')),
+		('unsupported', _('Unsupported')),
+	]
+
+	checksum = models.CharField(max_length=64, unique=True, verbose_name=_('SHA-256'))
+	name = models.CharField(max_length=255, verbose_name=_('Object Name'))
+	content_type = models.CharField(max_length=100, blank=True, default='')
+	status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+	page_count = models.PositiveIntegerField(default=0)
+	attempts = models.PositiveIntegerField(default=0)
+	error = models.TextField(blank=True, default='')
+	created_at = models.DateTimeField(auto_now_add=True)
+	updated_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		verbose_name = _('Material Extraction')
+		verbose_name_plural = _('Material Extractions')
+		indexes = [
+			models.Index(fields=['status', 'created_at']),
+		]
+
+	def __str__(self):
+		return f"{self.name} ({self.status})"
+
+
+class MaterialTextChunk(models.Model):
+	"""A chunk of extracted text from one page of a material"""
+	extraction = models.ForeignKey(MaterialExtraction, on_delete=models.CASCADE, related_name='chunks')
+	page_number = models.PositiveIntegerField()
+	chunk_index = models.PositiveIntegerField(default=0)
+	text = models.TextField()
+
+	class Meta:
+		ordering = ['extraction', 'page_number', 'chunk_index']
+		verbose_name = _('Material Text Chunk')
+		verbose_name_plural = _('Material Text Chunks')
+		constraints = [
+			models.UniqueConstraint(
+				fields=['extraction', 'page_number', 'chunk_index'],
+				name='exams_unique_material_text_chunk',
+			),
+		]
+
+	def __str__(self):
+		return f"Page {self.page_number}.{self.chunk_index} of {self.extraction.name}"
+
+
+@receiver(post_delete, sender=Exam)
+def release_deleted_exam_material(sender, instance, **kwargs):
+	"""Release the material of a deleted exam (including cascade deletes)"""
+	if instance.material:
+		from .material_store import release_material
+		release_material(instance.material.storage, instance.material.name)
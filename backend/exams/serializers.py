@@ -11,10 +11,10 @@ class ExamSerializer(serializers.ModelSerializer):
 	user_id = serializers.CharField(source='user.id', read_only=True)
 	user_name = serializers.CharField(source='user.username', read_only=True)
 	
-	# Discussion room related fields
-	has_discussion_room = serializers.ReadOnlyField()
-	discussion_members_count = serializers.ReadOnlyField()
-	discussion_posts_count = serializers.ReadOnlyField()
+	# Discussion room related fields (read from Exam.objects.with_discussion_stats annotations)
+	has_discussion_room = serializers.SerializerMethodField()
+	discussion_members_count = serializers.SerializerMethodField()
+	discussion_posts_count = serializers.SerializerMethodField()
 	is_discussion_member = serializers.SerializerMethodField()
 	
 	class Meta:
@@ -28,8 +28,28 @@ class ExamSerializer(serializers.ModelSerializer):
 		read_only_fields = ['created_at', 'updated_at']
 
 
+	def get_has_discussion_room(self, obj):
+		"""Check if the exam has a discussion room"""
+		if hasattr(obj, 'room_exists'):
+			return obj.room_exists
+		return obj.has_discussion_room()
+
+	def get_discussion_members_count(self, obj):
+		"""Get discussion room members count"""
+		if hasattr(obj, 'room_members_count'):
+			return obj.room_members_count
+		return obj.discussion_members_count
+
+	def get_discussion_posts_count(self, obj):
+		"""Get discussion room posts count"""
+		if hasattr(obj, 'room_posts_count'):
+			return obj.room_posts_count
+		return obj.discussion_posts_count
+
 	def get_is_discussion_member(self, obj):
 		"""Check if current user is a discussion room member"""
+		if hasattr(obj, 'room_is_member'):
+			return obj.room_is_member
 		request = self.context.get('request')
 		if request and request.user.is_authenticated:
 			return obj.is_discussion_member(request.user)
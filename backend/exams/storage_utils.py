@@ -3,29 +3,95 @@ Google Cloud Storage utility functions
 Based on Google's official documentation
 """
 
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
+from requests.adapters import HTTPAdapter
 from django.conf import settings
+from django.core.cache import cache
 import os
+import hashlib
 import logging
-from typing import Optional, List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, Optional, List, Tuple
+from urllib.parse import quote
 
 logger = logging.getLogger(__name__)
 
+# Signed URLs are cached until less than this fraction of their lifetime remains
+SIGNED_URL_MIN_REMAINING_RATIO = 0.5
+SIGNED_URL_CACHE_PREFIX = 'gcs:signed-url'
+
+# HTTP connection pool shared by all threads of a worker process
+GCS_HTTP_POOL_SIZE = getattr(settings, 'GCS_HTTP_POOL_SIZE', 10)
+# (connect, read) timeouts in seconds for every GCS API call
+GCS_TIMEOUT = (
+    getattr(settings, 'GCS_CONNECT_TIMEOUT', 5),
+    getattr(settings, 'GCS_READ_TIMEOUT', 60),
+)
+
 
 class GCSManager:
-    """Google Cloud Storage Manager with enhanced functionality"""
+    """
+    Google Cloud Storage Manager with enhanced functionality
+
+    The client is created on first use rather than at import, so processes
+    that never touch GCS (most management commands) skip credential
+    resolution, and it is never created when USE_GCS is off.
+    Initialization is guarded by a lock and the client is then shared by
+    all threads; its requests session keeps a connection pool of
+    GCS_HTTP_POOL_SIZE.
+    """
     
-    def __init__(self):
-        """Initialize GCS client with secure authentication"""
-        try:
-            # Use default authentication (attached service account preferred)
-            self.client = storage.Client()
-            self.bucket_name = getattr(settings, 'GS_BUCKET_NAME', 'innergrow-media')
-            self.bucket = self.client.bucket(self.bucket_name)
-        except Exception as e:
-            logger.error(f"Failed to initialize GCS client: {e}")
-            self.client = None
-            self.bucket = None
+    def __init__(self, pool_size: int = GCS_HTTP_POOL_SIZE, timeout=GCS_TIMEOUT):
+        self.bucket_name = getattr(settings, 'GS_BUCKET_NAME', 'innergrow-media')
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._client = None
+        self._bucket = None
+        self._initialized = False
+        self._lock = threading.Lock()
+    
+    @property
+    def client(self) -> Optional[storage.Client]:
+        self._ensure_initialized()
+        return self._client
+    
+    @property
+    def bucket(self) -> Optional[storage.Bucket]:
+        self._ensure_initialized()
+        return self._bucket
+    
+    def _ensure_initialized(self) -> None:
+        """Create the client once per process; later calls return immediately"""
+        if self._initialized:
+            return
+        with self._lock:
+            if self._initialized:
+                return
+            if not getattr(settings, 'USE_GCS', False):
+                # Media is on the local filesystem; there is nothing to talk to
+                self._initialized = True
+                return
+            try:
+                self._client = self._create_client()
+                self._bucket = self._client.bucket(self.bucket_name)
+            except Exception as e:
+                logger.error(f"Failed to initialize GCS client: {e}")
+                self._client = None
+                self._bucket = None
+            self._initialized = True
+    
+    def _create_client(self) -> storage.Client:
+        """Initialize GCS client with secure authentication and a sized connection pool"""
+        # Use default authentication (attached service account preferred)
+        credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+        session = AuthorizedSession(credentials)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        return storage.Client(project=project, credentials=credentials, _http=session)
     
     def upload_blob(self, source_file_path: str, destination_blob_name: str) -> bool:
         """
@@ -42,7 +108,7 @@ class GCSManager:
             
         try:
             blob = self.bucket.blob(destination_blob_name)
-            blob.upload_from_filename(source_file_path)
+            blob.upload_from_filename(source_file_path, timeout=self.timeout)
             logger.info(f"File {source_file_path} uploaded to {destination_blob_name}")
             return True
         except Exception as e:
@@ -68,7 +134,7 @@ class GCSManager:
             blob = self.bucket.blob(destination_blob_name)
             if content_type:
                 blob.content_type = content_type
-            blob.upload_from_string(file_content)
+            blob.upload_from_string(file_content, timeout=self.timeout)
             logger.info(f"File content uploaded to {destination_blob_name}")
             return True
         except Exception as e:
@@ -90,13 +156,38 @@ class GCSManager:
             
         try:
             blob = self.bucket.blob(source_blob_name)
-            blob.download_to_filename(destination_file_path)
+            blob.download_to_filename(destination_file_path, timeout=self.timeout)
             logger.info(f"Blob {source_blob_name} downloaded to {destination_file_path}")
             return True
         except Exception as e:
             logger.error(f"Failed to download {source_blob_name}: {e}")
             return False
     
+    def iter_blob_range(self, blob_name: str, start: int, end: int,
+                        chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+        """
+        Stream part of a blob without holding it in memory
+        Args:
+            blob_name: Name of the blob in GCS
+            start: First byte offset
+            end: Last byte offset (inclusive)
+            chunk_size: Bytes fetched per ranged download
+        Returns:
+            Iterator[bytes]: The requested bytes, chunk by chunk
+        """
+        if not self.bucket:
+            logger.error("GCS client not initialized")
+            return
+        
+        blob = self.bucket.blob(blob_name)
+        position = start
+        while position <= end:
+            chunk_end = min(position + chunk_size - 1, end)
+            yield blob.download_as_bytes(
+                start=position, end=chunk_end, raw_download=True, checksum=None, timeout=self.timeout
+            )
+            position = chunk_end + 1
+    
     def get_blob_content(self, blob_name: str) -> Optional[bytes]:
         """
         Get blob content as bytes
@@ -111,7 +202,7 @@ class GCSManager:
             
         try:
             blob = self.bucket.blob(blob_name)
-            return blob.download_as_bytes()
+            return blob.download_as_bytes(timeout=self.timeout)
         except Exception as e:
             logger.error(f"Failed to get content of {blob_name}: {e}")
             return None
@@ -129,14 +220,29 @@ class GCSManager:
             return []
             
         try:
-            blobs = self.client.list_blobs(self.bucket_name, prefix=prefix)
-            blob_names = [blob.name for blob in blobs]
+            blob_names = [blob.name for blob in self.iter_blobs(prefix)]
             logger.info(f"Found {len(blob_names)} blobs with prefix '{prefix}'")
             return blob_names
         except Exception as e:
             logger.error(f"Failed to list blobs: {e}")
             return []
     
+    def iter_blobs(self, prefix: Optional[str] = None, page_size: int = 1000) -> Iterator[storage.Blob]:
+        """
+        Iterate over the blobs in the bucket, fetching one page of results at a time
+        Args:
+            prefix: Filter blobs by prefix (e.g., 'exam_materials/')
+            page_size: Blobs requested per list call
+        Returns:
+            Iterator[Blob]: Blobs in lexicographic name order
+        """
+        if not self.bucket:
+            logger.error("GCS client not initialized")
+            return iter(())
+        return iter(self.client.list_blobs(
+            self.bucket_name, prefix=prefix, page_size=page_size, timeout=self.timeout
+        ))
+    
     def delete_blob(self, blob_name: str) -> bool:
         """
         Delete a blob from the bucket
@@ -151,7 +257,7 @@ class GCSManager:
             
         try:
             blob = self.bucket.blob(blob_name)
-            blob.delete()
+            blob.delete(timeout=self.timeout)
             logger.info(f"Blob {blob_name} deleted from bucket {self.bucket_name}")
             return True
         except Exception as e:
@@ -171,7 +277,7 @@ class GCSManager:
             
         try:
             blob = self.bucket.blob(blob_name)
-            return blob.exists()
+            return blob.exists(timeout=self.timeout)
         except Exception as e:
             logger.error(f"Failed to check existence of {blob_name}: {e}")
             return False
@@ -189,7 +295,7 @@ class GCSManager:
             
         try:
             blob = self.bucket.blob(blob_name)
-            blob.reload()  # Fetch latest metadata
+            blob.reload(timeout=self.timeout)  # Fetch latest metadata
             
             return {
                 'name': blob.name,
@@ -204,12 +310,34 @@ class GCSManager:
             logger.error(f"Failed to get info for {blob_name}: {e}")
             return None
     
-    def generate_signed_url(self, blob_name: str, expiration_minutes: int = 60) -> Optional[str]:
+    def get_blobs_info(self, blob_names: Iterable[str], max_workers: Optional[int] = None) -> Dict[str, Optional[dict]]:
+        """
+        Get metadata for several blobs, fetched concurrently
+        Args:
+            blob_names: Names of the blobs
+            max_workers: Concurrent lookups (defaults to the HTTP connection pool size)
+        Returns:
+            dict: Blob name -> blob information, or None for blobs that failed
+        """
+        names = list(dict.fromkeys(blob_names))
+        if not names or not self.bucket:
+            return {name: None for name in names}
+        
+        # More threads than pooled connections would just queue on the pool
+        workers = min(max_workers or self.pool_size, self.pool_size, len(names))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(names, executor.map(self.get_blob_info, names)))
+    
+    def generate_signed_url(self, blob_name: str, expiration_minutes: int = 60,
+                            expires_at: Optional[datetime] = None,
+                            file_name: Optional[str] = None) -> Optional[str]:
         """
         Generate a signed URL for temporary access to a blob
         Args:
             blob_name: Name of the blob
             expiration_minutes: URL expiration time in minutes
+            expires_at: Absolute expiration time (overrides expiration_minutes)
+            file_name: Download name sent in Content-Disposition instead of the blob name
         Returns:
             str: Signed URL or None if failed
         """
@@ -218,18 +346,73 @@ class GCSManager:
             
         try:
             blob = self.bucket.blob(blob_name)
-            from datetime import datetime, timedelta
             
             url = blob.generate_signed_url(
-                expiration=datetime.utcnow() + timedelta(minutes=expiration_minutes),
-                method='GET'
+                expiration=expires_at or datetime.utcnow() + timedelta(minutes=expiration_minutes),
+                method='GET',
+                response_disposition=f"inline; filename*=UTF-8''{quote(file_name)}" if file_name else None,
             )
             logger.info(f"Generated signed URL for {blob_name}")
             return url
         except Exception as e:
             logger.error(f"Failed to generate signed URL for {blob_name}: {e}")
             return None
+    
+    def get_signed_url(self, blob_name: str, expiration_minutes: int = 60,
+                       file_name: Optional[str] = None) -> Tuple[Optional[str], Optional[datetime]]:
+        """
+        Get a signed URL from the Django cache, signing a new one only when no
+        cached URL for this blob, download name and expiry bucket has enough
+        lifetime left
+        Args:
+            blob_name: Name of the blob
+            expiration_minutes: Requested URL lifetime in minutes (the expiry bucket)
+            file_name: Download name, see generate_signed_url
+        Returns:
+            tuple: (signed URL, expiration time) or (None, None) if failed
+        """
+        if not self.bucket:
+            return None, None
+        
+        key = self._signed_url_cache_key(blob_name, expiration_minutes, file_name)
+        cached = cache.get(key)
+        if cached:
+            return cached
+        
+        expires_at = datetime.now(timezone.utc) + timedelta(minutes=expiration_minutes)
+        url = self.generate_signed_url(blob_name, expires_at=expires_at, file_name=file_name)
+        if not url:
+            return None, None
+        
+        # Drop the entry once the remaining lifetime falls below the threshold
+        timeout = int(expiration_minutes * 60 * (1 - SIGNED_URL_MIN_REMAINING_RATIO))
+        if timeout > 0:
+            cache.set(key, (url, expires_at), timeout)
+        return url, expires_at
+    
+    def invalidate_signed_urls(self, blob_name: str) -> None:
+        """
+        Invalidate every cached signed URL for a blob (all expiry buckets)
+        Args:
+            blob_name: Name of the blob that was deleted or replaced
+        """
+        version_key = self._signed_url_version_key(blob_name)
+        try:
+            cache.incr(version_key)
+        except ValueError:
+            cache.set(version_key, 1, None)
+    
+    def _signed_url_version_key(self, blob_name: str) -> str:
+        digest = hashlib.sha256(blob_name.encode('utf-8')).hexdigest()
+        return f"{SIGNED_URL_CACHE_PREFIX}:version:{digest}"
+    
+    def _signed_url_cache_key(self, blob_name: str, expiration_minutes: int,
+                              file_name: Optional[str] = None) -> str:
+        version = cache.get(self._signed_url_version_key(blob_name), 0)
+        # Exams sharing a deduplicated blob may offer it under different names
+        digest = hashlib.sha256(f"{blob_name}\0{file_name or ''}".encode('utf-8')).hexdigest()
+        return f"{SIGNED_URL_CACHE_PREFIX}:{digest}:{version}:{expiration_minutes}"
 
 
-# Global instance
+# Global instance; the client itself is created on first use
 gcs_manager = GCSManager()
@@ -1,3 +1,919 @@
-from django.test import TestCase
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest.mock import Mock, patch
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import DataError
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework import status
+from discussions.models import Post
+from .models import Exam, MaterialBlob, MaterialExtraction
+from .storage_utils import GCSManager
+from .management.commands.process_material_extractions import Command as ExtractionCommand
+from .text_extraction import normalize_text
+from .upload_handlers import MULTIPART_OVERHEAD, MaterialMultiPartParser, StreamingUploadHandler
 
-# Create your tests here.
+
+class ExamListQueryTestCase(TestCase):
+	"""Exam list/detail discussion stats tests"""
+
+	def setUp(self):
+		self.user = get_user_model().objects.create_user(
+			email='test@example.com',
+			username='testuser',
+			password='testpass123',
+			first_name='Test'
+		)
+		self.other_user = get_user_model().objects.create_user(
+			email='other@example.com',
+			username='otheruser',
+			password='otherpass123',
+			first_name='Other'
+		)
+
+		self.client = APIClient()
+		self.client.force_authenticate(user=self.user)
+
+		self.exams = [
+			Exam.objects.create(
+				user=self.other_user,
+				title=f'Exam {i}',
+				description='Description',
+				exam_time='2030-01-01'
+			)
+			for i in range(5)
+		]
+		room, _ = self.exams[0].get_or_create_discussion_room()
+		room.add_member(self.user)
+		room.add_member(self.other_user)
+		Post.objects.create(room=room, author=self.user, title='Post', content='Content')
+		Post.objects.create(room=room, author=self.other_user, title='Post 2', content='Content')
+		self.exams[1].get_or_create_discussion_room()
+
+	def test_list_query_count_is_constant(self):
+		"""Listing exams does not issue per-exam discussion queries"""
+		# session/auth lookups are bypassed by force_authenticate: count + page
+		with self.assertNumQueries(2):
+			response = self.client.get('/api/exams/')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.data['count'], 5)
+
+	def test_list_discussion_stats(self):
+		"""Annotated stats match the room state"""
+		response = self.client.get('/api/exams/')
+		results = {item['id']: item for item in response.data['results']}
+
+		with_members = results[self.exams[0].id]
+		self.assertTrue(with_members['has_discussion_room'])
+		self.assertEqual(with_members['discussion_members_count'], 2)
+		self.assertEqual(with_members['discussion_posts_count'], 2)
+		self.assertTrue(with_members['is_discussion_member'])
+
+		empty_room = results[self.exams[1].id]
+		self.assertTrue(empty_room['has_discussion_room'])
+		self.assertEqual(empty_room['discussion_members_count'], 0)
+		self.assertEqual(empty_room['discussion_posts_count'], 0)
+		self.assertFalse(empty_room['is_discussion_member'])
+
+		no_room = results[self.exams[2].id]
+		self.assertFalse(no_room['has_discussion_room'])
+		self.assertEqual(no_room['discussion_members_count'], 0)
+		self.assertFalse(no_room['is_discussion_member'])
+
+	def test_detail_discussion_stats(self):
+		"""Detail view uses the same annotated queryset"""
+		with self.assertNumQueries(1):
+			response = self.client.get(f'/api/exams/{self.exams[0].id}/')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.data['discussion_members_count'], 2)
+		self.assertTrue(response.data['is_discussion_member'])
+
+
+class ExamSearchTestCase(TestCase):
+	"""Exam list search (?q=) tests"""
+
+	def setUp(self):
+		self.user = get_user_model().objects.create_user(
+			email='test@example.com',
+			username='testuser',
+			password='testpass123',
+			first_name='Test'
+		)
+		self.client = APIClient()
+		self.client.force_authenticate(user=self.user)
+
+		def create(title, description='', category=''):
+			return Exam.objects.create(
+				user=self.user,
+				title=title,
+				description=description,
+				category=category,
+				exam_time='2030-01-01'
+			)
+
+		self.title_match = create('Linear Algebra Final')
+		self.description_match = create('Midterm', description='Covers linear maps and matrices')
+		self.category_match = create('Quiz 3', category='Linear Systems')
+		self.unrelated = create('Organic Chemistry', description='Reactions')
+
+	def search(self, query):
+		response = self.client.get('/api/exams/', {'q': query})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		return [item['id'] for item in response.data['results']]
+
+	def test_title_matches_rank_first(self):
+		"""Title hits outrank category hits, which outrank description hits"""
+		self.assertEqual(self.search('linear'), [
+			self.title_match.id,
+			self.category_match.id,
+			self.description_match.id,
+		])
+
+	def test_prefix_and_all_terms(self):
+		"""Terms match word prefixes and every term must match"""
+		self.assertEqual(self.search('alg fin'), [self.title_match.id])
+		self.assertEqual(self.search('linear chemistry'), [])
+
+	def test_search_vector_follows_updates(self):
+		"""Edited exams are found by their new title"""
+		self.unrelated.title = 'Linear Programming'
+		self.unrelated.save()
+		self.assertIn(self.unrelated.id, self.search('programming'))
+
+	def test_blank_query_lists_everything(self):
+		self.assertEqual(len(self.search('  ')), 4)
+
+
+class KeysetPaginationTestCase(TestCase):
+	"""Cursor pagination (?pagination=cursor) on the exam list"""
+
+	def setUp(self):
+		self.user = get_user_model().objects.create_user(
+			email='test@example.com',
+			username='testuser',
+			password='testpass123',
+			first_name='Test'
+		)
+		self.client = APIClient()
+		self.client.force_authenticate(user=self.user)
+
+		self.exams = [
+			Exam.objects.create(user=self.user, title=f'Exam {i}', exam_time='2030-01-01')
+			for i in range(7)
+		]
+		# Identical timestamps must still page without gaps or repeats
+		Exam.objects.filter(id__in=[e.id for e in self.exams[2:5]]).update(created_at=self.exams[2].created_at)
+
+	def walk(self, url, key):
+		ids, pages = [], 0
+		while url:
+			response = self.client.get(url)
+			self.assertEqual(response.status_code, status.HTTP_200_OK)
+			self.assertTrue(response.data['success'])
+			ids += [item['id'] for item in response.data['data']]
+			url = response.data[key]
+			pages += 1
+		return ids, pages
+
+	def test_pages_forward_without_count(self):
+		"""Every row is returned once, in list order, without a COUNT query"""
+		expected = list(Exam.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+		with self.assertNumQueries(1):
+			first = self.client.get('/api/exams/', {'pagination': 'cursor', 'page_size': 3})
+		self.assertIsNone(first.data['previous'])
+
+		ids, pages = self.walk('/api/exams/?pagination=cursor&page_size=3', 'next')
+		self.assertEqual(ids, expected)
+		self.assertEqual(pages, 3)
+
+	def test_previous_link(self):
+		"""The previous link returns the page before"""
+		first = self.client.get('/api/exams/', {'pagination': 'cursor', 'page_size': 3})
+		second = self.client.get(first.data['next'])
+		back = self.client.get(second.data['previous'])
+		self.assertEqual(
+			[item['id'] for item in back.data['data']],
+			[item['id'] for item in first.data['data']],
+		)
+
+	def test_search_results_page_by_rank(self):
+		"""Cursor mode also works on annotated ranking scores"""
+		# Equal ranks fall back to (created_at, id)
+		expected = list(Exam.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+		ids, _pages = self.walk('/api/exams/?q=exam&pagination=cursor&page_size=2', 'next')
+		self.assertEqual(ids, expected)
+
+	def test_invalid_cursor(self):
+		response = self.client.get('/api/exams/', {'cursor': 'not-a-cursor'})
+		self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_page_number_mode_unchanged(self):
+		response = self.client.get('/api/exams/')
+		self.assertEqual(response.data['count'], 7)
+
+
+PDF_BYTES = b'%PDF-1.4\n' + b'0' * 2048
+
+
+class MaterialTestMixin:
+	"""Store uploaded materials in a throwaway MEDIA_ROOT"""
+
+	def setUp(self):
+		super().setUp()
+		# Cached joined-room sets outlive the rolled back rows of earlier tests
+		cache.clear()
+		self.media_root = tempfile.mkdtemp()
+		self.media_override = override_settings(MEDIA_ROOT=self.media_root)
+		self.media_override.enable()
+		self.user = get_user_model().objects.create_user(
+			email='owner@example.com',
+			username='owner',
+			password='testpass123',
+			first_name='Owner'
+		)
+		self.client = APIClient()
+		self.client.force_authenticate(user=self.user)
+		self.exam = Exam.objects.create(
+			user=self.user,
+			title='Exam',
+			description='Description',
+			exam_time='2030-01-01'
+		)
+
+	def tearDown(self):
+		self.media_override.disable()
+		shutil.rmtree(self.media_root, ignore_errors=True)
+		super().tearDown()
+
+	def upload(self, content=PDF_BYTES, name='paper.pdf', content_type='application/pdf'):
+		return self.client.post(
+			f'/api/exams/{self.exam.id}/upload-material/',
+			{'file': SimpleUploadedFile(name, content, content_type=content_type)},
+			format='multipart'
+		)
+
+
+class MaterialMetadataTestCase(MaterialTestMixin, TestCase):
+	"""Material metadata recorded at upload time"""
+
+	def test_upload_records_metadata(self):
+		response = self.upload()
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+		self.exam.refresh_from_db()
+		self.assertEqual(self.exam.material_size, len(PDF_BYTES))
+		self.assertEqual(self.exam.material_content_type, 'application/pdf')
+		self.assertEqual(self.exam.material_checksum, hashlib.sha256(PDF_BYTES).hexdigest())
+		self.assertIsNotNone(self.exam.material_uploaded_at)
+
+	def test_material_info_reads_database(self):
+		self.upload()
+		with self.assertNumQueries(1):
+			response = self.client.get(f'/api/exams/{self.exam.id}/material-info/')
+		material = response.data['data']['material']
+		self.assertEqual(material['size'], len(PDF_BYTES))
+		self.assertEqual(material['checksum'], hashlib.sha256(PDF_BYTES).hexdigest())
+
+		response = self.client.get('/api/exams/my-materials/')
+		materials = response.data['data']['materials']
+		self.assertEqual(len(materials), 1)
+		self.assertEqual(materials[0]['content_type'], 'application/pdf')
+
+	def test_delete_clears_metadata(self):
+		self.upload()
+		response = self.client.delete(f'/api/exams/{self.exam.id}/delete-material/')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+		self.exam.refresh_from_db()
+		self.assertIsNone(self.exam.material_size)
+		self.assertEqual(self.exam.material_checksum, '')
+
+	def test_backfill_command(self):
+		self.upload()
+		Exam.objects.filter(id=self.exam.id).update(
+			material_size=None, material_checksum='', material_content_type='', material_uploaded_at=None
+		)
+
+		call_command('backfill_material_metadata', batch_size=1, workers=2, stdout=StringIO())
+
+		self.exam.refresh_from_db()
+		self.assertEqual(self.exam.material_size, len(PDF_BYTES))
+		self.assertEqual(self.exam.material_checksum, hashlib.sha256(PDF_BYTES).hexdigest())
+		self.assertEqual(self.exam.material_content_type, 'application/pdf')
+		self.assertIsNotNone(self.exam.material_uploaded_at)
+
+	def test_download_url_rejects_invalid_expiration(self):
+		self.upload()
+		for value in ('abc', None, 0, -5):
+			with self.subTest(value=value):
+				response = self.client.post(
+					f'/api/exams/{self.exam.id}/download-url/', {'expiration_minutes': value}, format='json'
+				)
+				self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+				self.assertFalse(response.data['success'])
+		response = self.client.post(
+			f'/api/exams/{self.exam.id}/download-url/', {'expiration_minutes': '30'}, format='json'
+		)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class UserMaterialsTestCase(MaterialTestMixin, TestCase):
+	"""Paged my-materials listing"""
+
+	def setUp(self):
+		super().setUp()
+		self.exams = [self.exam]
+		for i in range(4):
+			self.exams.append(Exam.objects.create(user=self.user, title=f'Exam {i}', exam_time='2030-01-01'))
+		for i, exam in enumerate(self.exams):
+			self.exam = exam
+			self.upload(content=PDF_BYTES + bytes([i]))
+
+	def test_pages_through_materials(self):
+		ids, counts, url = [], [], '/api/exams/my-materials/?page_size=2'
+		while url:
+			response = self.client.get(url)
+			self.assertEqual(response.status_code, status.HTTP_200_OK)
+			counts.append(response.data['data']['total_count'])
+			ids += [item['exam_id'] for item in response.data['data']['materials']]
+			url = response.data['data']['next']
+		# Only the first page pays for the COUNT
+		self.assertEqual(counts, [5, None, None])
+		self.assertEqual(ids, [exam.id for exam in reversed(self.exams)])
+
+	def test_legacy_rows_use_one_batched_lookup(self):
+		"""Rows without stored metadata are filled from a single batched storage call"""
+		legacy = self.exams[:2]
+		Exam.objects.filter(id__in=[exam.id for exam in legacy]).update(
+			material_size=None, material_content_type=''
+		)
+		names = {Exam.objects.get(id=exam.id).material.name for exam in legacy}
+		infos = {name: {'size': 123, 'content_type': 'application/pdf', 'created': None} for name in names}
+
+		with patch('exams.views.gcs_manager.get_blobs_info', return_value=infos) as get_blobs_info:
+			response = self.client.get('/api/exams/my-materials/')
+
+		get_blobs_info.assert_called_once()
+		self.assertEqual(set(get_blobs_info.call_args.args[0]), names)
+		by_exam = {item['exam_id']: item for item in response.data['data']['materials']}
+		self.assertEqual(by_exam[legacy[0].id]['size'], 123)
+		self.assertEqual(by_exam[self.exams[4].id]['size'], len(PDF_BYTES) + 1)
+
+	def test_manager_batch_lookup_dedupes(self):
+		manager = GCSManager(pool_size=4)
+		manager._initialized, manager._bucket = True, object()
+		with patch.object(manager, 'get_blob_info', side_effect=lambda name: {'name': name}):
+			infos = manager.get_blobs_info(['a', 'b', 'a', 'c'])
+		self.assertEqual(list(infos), ['a', 'b', 'c'])
+		self.assertEqual(infos['b'], {'name': 'b'})
+
+
+class OrphanedMaterialCollectionTestCase(MaterialTestMixin, TestCase):
+	"""collect_orphaned_materials command on local storage"""
+
+	def write_object(self, name, age_hours):
+		path = os.path.join(self.media_root, name)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path, 'wb') as f:
+			f.write(b'orphan')
+		mtime = time.time() - age_hours * 3600
+		os.utime(path, (mtime, mtime))
+		return path
+
+	def test_deletes_only_old_unreferenced_objects(self):
+		self.upload()
+		self.exam.refresh_from_db()
+		referenced = os.path.join(self.media_root, self.exam.material.name)
+		os.utime(referenced, (0, 0))
+		orphan = self.write_object('exam_materials/old.pdf', age_hours=24 * 30)
+		pending = self.write_object('exam_materials/abc/in-flight.pdf', age_hours=1)
+
+		out = StringIO()
+		call_command('collect_orphaned_materials', dry_run=True, page_size=1, stdout=out)
+		self.assertIn('Would delete exam_materials/old.pdf', out.getvalue())
+		self.assertTrue(os.path.exists(orphan))
+
+		call_command('collect_orphaned_materials', page_size=1, workers=2, stdout=StringIO())
+		self.assertFalse(os.path.exists(orphan))
+		self.assertTrue(os.path.exists(referenced))
+		self.assertTrue(os.path.exists(pending))
+
+
+class MaterialStreamingTestCase(MaterialTestMixin, TestCase):
+	"""Range / conditional GET material streaming"""
+
+	def setUp(self):
+		super().setUp()
+		self.upload()
+		self.exam.refresh_from_db()
+		self.url = f'/api/exams/{self.exam.id}/material/'
+		self.etag = f'"{self.exam.material_checksum}"'
+
+	def test_full_download(self):
+		response = self.client.get(self.url)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(b''.join(response.streaming_content), PDF_BYTES)
+		self.assertEqual(response['Content-Length'], str(len(PDF_BYTES)))
+		self.assertEqual(response['ETag'], self.etag)
+		self.assertEqual(response['Accept-Ranges'], 'bytes')
+		self.assertIn('Last-Modified', response)
+
+	def test_range_requests(self):
+		response = self.client.get(self.url, HTTP_RANGE='bytes=0-7')
+		self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+		self.assertEqual(b''.join(response.streaming_content), PDF_BYTES[:8])
+		self.assertEqual(response['Content-Range'], f'bytes 0-7/{len(PDF_BYTES)}')
+
+		response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+		self.assertEqual(b''.join(response.streaming_content), PDF_BYTES[-10:])
+
+		response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(PDF_BYTES)}-')
+		self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+		self.assertEqual(response['Content-Range'], f'bytes */{len(PDF_BYTES)}')
+
+	def test_conditional_requests(self):
+		response = self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag)
+		self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+		# A stale If-Range validator gets the whole (changed) file
+		response = self.client.get(self.url, HTTP_RANGE='bytes=0-7', HTTP_IF_RANGE='"stale"')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		response = self.client.get(self.url, HTTP_RANGE='bytes=0-7', HTTP_IF_RANGE=self.etag)
+		self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+
+	@override_settings(MATERIAL_ACCEL_REDIRECT_PREFIX='/protected-media/')
+	def test_accel_redirect(self):
+		response = self.client.get(self.url, HTTP_RANGE='bytes=0-7')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.exam.material.name}')
+		self.assertEqual(response.content, b'')
+
+	def test_requires_membership(self):
+		stranger = get_user_model().objects.create_user(
+			email='stranger@example.com', username='stranger', password='testpass123', first_name='S'
+		)
+		self.client.force_authenticate(user=stranger)
+		self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+	def test_gcs_range_is_fetched_in_chunks(self):
+		manager = GCSManager()
+		manager._initialized, manager._bucket = True, Mock()
+		download = manager._bucket.blob.return_value.download_as_bytes
+		download.side_effect = lambda start, end, **kwargs: PDF_BYTES[start:end + 1]
+
+		chunks = list(manager.iter_blob_range('exam_materials/a.pdf', 5, 1004, chunk_size=400))
+		self.assertEqual(b''.join(chunks), PDF_BYTES[5:1005])
+		self.assertEqual([call.kwargs['start'] for call in download.call_args_list], [5, 405, 805])
+
+
+class SignedUrlCacheTestCase(TestCase):
+	"""Signed download URL cache on GCSManager"""
+
+	def setUp(self):
+		cache.clear()
+		self.manager = GCSManager()
+		with override_settings(USE_GCS=True), \
+				patch('exams.storage_utils.google.auth.default', return_value=(None, 'project')), \
+				patch('exams.storage_utils.storage.Client'):
+			self.manager.bucket
+		self.sign = self.manager.bucket.blob.return_value.generate_signed_url
+		self.sign.side_effect = lambda **kwargs: f'https://signed/{self.sign.call_count}'
+
+	def test_reuses_cached_url(self):
+		first, expires_at = self.manager.get_signed_url('exam_materials/a.pdf', 60)
+		second, _ = self.manager.get_signed_url('exam_materials/a.pdf', 60)
+		self.assertEqual(first, second)
+		self.assertEqual(self.sign.call_count, 1)
+		self.assertIsNotNone(expires_at)
+
+	def test_expiry_buckets_are_separate(self):
+		self.manager.get_signed_url('exam_materials/a.pdf', 60)
+		self.manager.get_signed_url('exam_materials/a.pdf', 1440)
+		self.assertEqual(self.sign.call_count, 2)
+
+	def test_invalidate_drops_all_buckets(self):
+		first, _ = self.manager.get_signed_url('exam_materials/a.pdf', 60)
+		self.manager.get_signed_url('exam_materials/a.pdf', 1440)
+		self.manager.invalidate_signed_urls('exam_materials/a.pdf')
+
+		second, _ = self.manager.get_signed_url('exam_materials/a.pdf', 60)
+		self.assertNotEqual(first, second)
+		self.assertEqual(self.sign.call_count, 3)
+
+
+@override_settings(USE_GCS=True)
+class GCSManagerInitTestCase(TestCase):
+	"""Lazy, once-per-process GCS client creation"""
+
+	def setUp(self):
+		auth = patch('exams.storage_utils.google.auth.default', return_value=(None, 'project'))
+		client = patch('exams.storage_utils.storage.Client')
+		self.auth_default = auth.start()
+		self.client_class = client.start()
+		self.addCleanup(auth.stop)
+		self.addCleanup(client.stop)
+
+	def test_client_created_on_first_use(self):
+		manager = GCSManager()
+		self.auth_default.assert_not_called()
+		self.assertIs(manager.client, self.client_class.return_value)
+		self.assertIsNotNone(manager.bucket)
+		self.assertEqual(self.client_class.call_count, 1)
+
+	def test_concurrent_first_use_creates_one_client(self):
+		manager = GCSManager()
+		with ThreadPoolExecutor(max_workers=8) as pool:
+			clients = list(pool.map(lambda _: manager.client, range(32)))
+		self.assertEqual(self.client_class.call_count, 1)
+		self.assertTrue(all(client is clients[0] for client in clients))
+
+	def test_connection_pool_size(self):
+		GCSManager(pool_size=32).client
+		session = self.client_class.call_args.kwargs['_http']
+		self.assertEqual(session.get_adapter('https://storage.googleapis.com')._pool_maxsize, 32)
+
+	@override_settings(USE_GCS=False)
+	def test_disabled_without_gcs(self):
+		manager = GCSManager()
+		self.assertIsNone(manager.client)
+		self.assertIsNone(manager.bucket)
+		self.auth_default.assert_not_called()
+
+
+class DirectUploadTestCase(MaterialTestMixin, TestCase):
+	"""Two-step direct upload flow on the filesystem backend"""
+
+	def create_session(self, size=len(PDF_BYTES), file_name='paper.pdf'):
+		return self.client.post(
+			f'/api/exams/{self.exam.id}/material-upload-session/',
+			{'file_name': file_name, 'content_type': 'application/pdf', 'size': size},
+			format='json'
+		)
+
+	def test_resumable_upload_and_finalize(self):
+		response = self.create_session()
+		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+		session = response.data['data']
+		self.assertTrue(session['object_name'].startswith('exam_materials/'))
+
+		half = len(PDF_BYTES) // 2
+		response = self.client.generic(
+			'PUT', session['upload_url'], PDF_BYTES[:half],
+			content_type='application/octet-stream',
+			HTTP_CONTENT_RANGE=f'bytes 0-{half - 1}/{len(PDF_BYTES)}'
+		)
+		self.assertEqual(response.status_code, 308)
+		self.assertEqual(response['Range'], f'bytes=0-{half - 1}')
+
+		# Finalizing an incomplete upload is rejected
+		response = self.client.post(
+			f'/api/exams/{self.exam.id}/material-upload-session/finalize/',
+			{'session_token': session['session_token']}, format='json'
+		)
+		self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+		response = self.client.generic(
+			'PUT', session['upload_url'], PDF_BYTES[half:],
+			content_type='application/octet-stream',
+			HTTP_CONTENT_RANGE=f'bytes {half}-{len(PDF_BYTES) - 1}/{len(PDF_BYTES)}'
+		)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+		response = self.client.post(
+			f'/api/exams/{self.exam.id}/material-upload-session/finalize/',
+			{'session_token': session['session_token']}, format='json'
+		)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+		self.exam.refresh_from_db()
+		self.assertEqual(self.exam.material.name, session['object_name'])
+		self.assertEqual(self.exam.material_size, len(PDF_BYTES))
+		self.assertEqual(self.exam.material_checksum, hashlib.sha256(PDF_BYTES).hexdigest())
+
+	def upload_and_finalize(self, content, file_name='paper.pdf', content_type='application/pdf'):
+		session = self.client.post(
+			f'/api/exams/{self.exam.id}/material-upload-session/',
+			{'file_name': file_name, 'content_type': content_type, 'size': len(content)}, format='json'
+		).data['data']
+		self.client.generic('PUT', session['upload_url'], content, content_type='application/octet-stream')
+		finalize = lambda: self.client.post(
+			f'/api/exams/{self.exam.id}/material-upload-session/finalize/',
+			{'session_token': session['session_token']}, format='json'
+		)
+		return session, finalize
+
+	def test_content_type_comes_from_magic_bytes(self):
+		_session, finalize = self.upload_and_finalize(PDF_BYTES, content_type='text/html')
+		self.assertEqual(finalize().status_code, status.HTTP_200_OK)
+		self.exam.refresh_from_db()
+		self.assertEqual(self.exam.material_content_type, 'application/pdf')
+		self.assertEqual(self.exam.material_original_name, 'paper.pdf')
+
+	def test_rejects_content_not_matching_extension(self):
+		html = b'<html><script>alert(1)</script></html>'
+		session, finalize = self.upload_and_finalize(html, content_type='application/pdf')
+		response = finalize()
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		self.exam.refresh_from_db()
+		self.assertFalse(self.exam.material)
+		self.assertFalse(Exam._meta.get_field('material').storage.exists(session['object_name']))
+
+	def test_finalize_is_single_use(self):
+		session, finalize = self.upload_and_finalize(PDF_BYTES)
+		with self.captureOnCommitCallbacks(execute=True):
+			self.assertEqual(finalize().status_code, status.HTTP_200_OK)
+		with self.captureOnCommitCallbacks(execute=True):
+			response = finalize()
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(MaterialBlob.objects.get().ref_count, 1)
+		self.exam.refresh_from_db()
+		self.assertEqual(self.exam.material.name, session['object_name'])
+
+	def test_rejects_oversize_chunk(self):
+		session = self.create_session(size=10).data['data']
+		response = self.client.generic(
+			'PUT', session['upload_url'], PDF_BYTES, content_type='application/octet-stream'
+		)
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_rejects_invalid_session(self):
+		response = self.create_session(file_name='paper.exe')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+		response = self.client.post(
+			f'/api/exams/{self.exam.id}/material-upload-session/finalize/',
+			{'session_token': 'forged'}, format='json'
+		)
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StreamingUploadHandlerTestCase(MaterialTestMixin, TestCase):
+	"""Single-pass hashing, size limit and magic byte sniffing"""
+
+	def test_upload_exposes_handler_results(self):
+		docx = b'PK\x03\x04' + b'1' * 512
+		response = self.upload(docx, name='notes.docx', content_type='application/octet-stream')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+		self.exam.refresh_from_db()
+		self.assertEqual(self.exam.material_checksum, hashlib.sha256(docx).hexdigest())
+		self.assertEqual(
+			self.exam.material_content_type,
+			'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+		)
+
+	def test_rejects_mismatched_magic_bytes(self):
+		response = self.upload(b'MZ\x90\x00' + b'0' * 512, name='paper.pdf')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		self.exam.refresh_from_db()
+		self.assertFalse(self.exam.material)
+
+	def test_rejects_oversize_upload(self):
+		with patch.object(MaterialMultiPartParser, 'max_size', 1024):
+			response = self.upload()
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		self.exam.refresh_from_db()
+		self.assertFalse(self.exam.material)
+
+
+	def test_body_limit_covers_every_file(self):
+		megabyte = 1024 * 1024
+		handler = StreamingUploadHandler(max_size=megabyte, max_files=3)
+		handler.handle_raw_input(None, {}, 3 * megabyte, 'boundary')
+		self.assertIsNone(handler.error)
+		handler.handle_raw_input(None, {}, 3 * megabyte + MULTIPART_OVERHEAD + 1, 'boundary')
+		self.assertIsNotNone(handler.error)
+
+
+class ContentAddressedStorageTestCase(MaterialTestMixin, TestCase):
+	"""Deduplicated, reference-counted material storage"""
+
+	def setUp(self):
+		super().setUp()
+		self.second_exam = Exam.objects.create(
+			user=self.user,
+			title='Second Exam',
+			description='Description',
+			exam_time='2030-01-01'
+		)
+
+	def upload_to(self, exam, content=PDF_BYTES):
+		return self.client.post(
+			f'/api/exams/{exam.id}/upload-material/',
+			{'file': SimpleUploadedFile('paper.pdf', content, content_type='application/pdf')},
+			format='multipart'
+		)
+
+	def test_duplicate_upload_shares_object(self):
+		self.upload_to(self.exam)
+		self.upload_to(self.second_exam)
+
+		self.exam.refresh_from_db()
+		self.second_exam.refresh_from_db()
+		self.assertEqual(self.exam.material.name, self.second_exam.material.name)
+		self.assertIn(hashlib.sha256(PDF_BYTES).hexdigest(), self.exam.material.name)
+
+		blob = MaterialBlob.objects.get()
+		self.assertEqual(blob.ref_count, 2)
+		self.assertTrue(self.exam.material.storage.exists(blob.name))
+
+	def test_original_file_name_is_shown(self):
+		self.upload_to(self.exam)
+		self.exam.refresh_from_db()
+		self.assertIn(hashlib.sha256(PDF_BYTES).hexdigest(), self.exam.material.name)
+		self.assertEqual(self.exam.material_original_name, 'paper.pdf')
+
+		response = self.client.get(f'/api/exams/{self.exam.id}/material/')
+		self.assertEqual(response['Content-Disposition'], "inline; filename*=UTF-8''paper.pdf")
+		response = self.client.get('/api/exams/my-materials/')
+		self.assertEqual(response.data['data']['materials'][0]['material_name'], 'paper.pdf')
+		response = self.client.post(f'/api/exams/{self.exam.id}/download-url/', {}, format='json')
+		self.assertEqual(response.data['data']['file_name'], 'paper.pdf')
+		response = self.client.get(f'/api/exams/{self.exam.id}/material-info/')
+		self.assertEqual(response.data['data']['material']['file_name'], 'paper.pdf')
+
+	def test_object_deleted_with_last_reference(self):
+		self.upload_to(self.exam)
+		self.upload_to(self.second_exam)
+		name = MaterialBlob.objects.get().name
+		storage = Exam._meta.get_field('material').storage
+
+		with self.captureOnCommitCallbacks(execute=True):
+			self.client.delete(f'/api/exams/{self.exam.id}/delete-material/')
+		self.assertEqual(MaterialBlob.objects.get().ref_count, 1)
+		self.assertTrue(storage.exists(name))
+
+		self.second_exam.refresh_from_db()
+		with self.captureOnCommitCallbacks(execute=True):
+			self.second_exam.delete()
+		self.assertFalse(MaterialBlob.objects.exists())
+		self.assertFalse(storage.exists(name))
+
+	def test_replacing_material_releases_previous(self):
+		self.upload_to(self.exam)
+		with self.captureOnCommitCallbacks(execute=True):
+			self.upload_to(self.exam, b'%PDF-1.7\n' + b'9' * 100)
+		blob = MaterialBlob.objects.get()
+		self.assertEqual(blob.ref_count, 1)
+
+		# Uploading the same content again keeps a single reference
+		with self.captureOnCommitCallbacks(execute=True):
+			self.upload_to(self.exam, b'%PDF-1.7\n' + b'9' * 100)
+		self.assertEqual(MaterialBlob.objects.get().ref_count, 1)
+
+
+def make_pdf(pages):
+	"""Minimal PDF with one line of Helvetica text per page"""
+	font_ref = 3 + 2 * len(pages)
+	kids = ' '.join(f'{3 + 2 * i} 0 R' for i in range(len(pages)))
+	objects = [b'<</Type/Catalog/Pages 2 0 R>>', f'<</Type/Pages/Kids[{kids}]/Count {len(pages)}>>'.encode()]
+	for i, text in enumerate(pages):
+		stream = f'BT /F1 12 Tf 72 720 Td ({text}) Tj ET'.encode()
+		objects.append(
+			f'<</Type/Page/Parent 2 0 R/MediaBox[0 0 612 792]/Contents {4 + 2 * i} 0 R'
+			f'/Resources<</Font<</F1 {font_ref} 0 R>>>>>>'.encode()
+		)
+		objects.append(b'<</Length %d>>stream\n' % len(stream) + stream + b'\nendstream')
+	objects.append(b'<</Type/Font/Subtype/Type1/BaseFont/Helvetica>>')
+
+	out = BytesIO()
+	out.write(b'%PDF-1.4\n')
+	offsets = []
+	for number, body in enumerate(objects, start=1):
+		offsets.append(out.tell())
+		out.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+	xref = out.tell()
+	out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+	for offset in offsets:
+		out.write(b'%010d 00000 n \n' % offset)
+	out.write(b'trailer\n<</Size %d/Root 1 0 R>>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+	return out.getvalue()
+
+
+def make_docx(pages):
+	"""Minimal DOCX with explicit page breaks between pages"""
+	ns = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+	breaks = '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'.join(
+		f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p>' for text in pages
+	)
+	out = BytesIO()
+	with zipfile.ZipFile(out, 'w') as archive:
+		archive.writestr('word/document.xml', f'<w:document xmlns:w="{ns}"><w:body>{breaks}</w:body></w:document>')
+	return out.getvalue()
+
+
+class TextExtractionTestCase(MaterialTestMixin, TestCase):
+	"""Background text extraction pipeline"""
+
+	def run_worker(self):
+		call_command('process_material_extractions', workers=1, once=True, stdout=StringIO(), stderr=StringIO())
+
+	def test_upload_queues_and_worker_extracts_pages(self):
+		with self.captureOnCommitCallbacks(execute=True):
+			self.upload(make_pdf(['Hello exam', 'Second page']))
+		extraction = MaterialExtraction.objects.get()
+		self.assertEqual(extraction.status, 'pending')
+
+		self.run_worker()
+
+		extraction.refresh_from_db()
+		self.assertEqual(extraction.status, 'done')
+		self.assertEqual(extraction.page_count, 2)
+		self.assertEqual(
+			[(chunk.page_number, chunk.text) for chunk in extraction.chunks.all()],
+			[(1, 'Hello exam'), (2, 'Second page')]
+		)
+
+	def test_docx_extraction(self):
+		with self.captureOnCommitCallbacks(execute=True):
+			self.upload(make_docx(['First', 'Second']), name='notes.docx')
+		self.run_worker()
+
+		extraction = MaterialExtraction.objects.get()
+		self.assertEqual(extraction.status, 'done')
+		self.assertEqual([chunk.text for chunk in extraction.chunks.all()], ['First', 'Second'])
+
+	def test_nul_characters_are_dropped(self):
+		self.assertEqual(normalize_text('Hello\x00 exam\x00'), 'Hello exam')
+
+	def test_storage_error_fails_the_job_not_the_worker(self):
+		with self.captureOnCommitCallbacks(execute=True):
+			self.upload(make_pdf(['Broken']))
+
+		def failing_store_pages(command, job, pages):
+			raise DataError('invalid byte sequence')
+
+		with patch.object(ExtractionCommand, 'store_pages', failing_store_pages):
+			call_command(
+				'process_material_extractions', workers=1, once=True, max_attempts=2,
+				stdout=StringIO(), stderr=StringIO()
+			)
+		extraction = MaterialExtraction.objects.get()
+		self.assertEqual((extraction.status, extraction.attempts), ('failed', 2))
+		self.assertIn('invalid byte sequence', extraction.error)
+
+	def test_stale_job_out_of_attempts_is_failed(self):
+		old = timezone.now() - timedelta(hours=1)
+		retried = MaterialExtraction.objects.create(checksum='a' * 64, name='a.pdf', content_type='application/pdf')
+		exhausted = MaterialExtraction.objects.create(checksum='b' * 64, name='b.pdf', content_type='application/pdf')
+		MaterialExtraction.objects.filter(id=retried.id).update(status='processing', attempts=1, updated_at=old)
+		MaterialExtraction.objects.filter(id=exhausted.id).update(status='processing', attempts=3, updated_at=old)
+
+		command = ExtractionCommand()
+		command.max_attempts = 3
+		command.requeue_stale(30)
+		retried.refresh_from_db()
+		exhausted.refresh_from_db()
+		self.assertEqual(retried.status, 'pending')
+		self.assertEqual(exhausted.status, 'failed')
+
+	def test_failed_extraction_is_requeued_on_upload(self):
+		content = make_pdf(['Again'])
+		with self.captureOnCommitCallbacks(execute=True):
+			self.upload(content)
+		MaterialExtraction.objects.update(status='failed', attempts=3, error='Timeout')
+
+		other_exam = Exam.objects.create(
+			user=self.user, title='Other', description='Description', exam_time='2030-01-01'
+		)
+		with self.captureOnCommitCallbacks(execute=True):
+			self.client.post(
+				f'/api/exams/{other_exam.id}/upload-material/',
+				{'file': SimpleUploadedFile('copy.pdf', content, content_type='application/pdf')},
+				format='multipart'
+			)
+		extraction = MaterialExtraction.objects.get()
+		self.assertEqual((extraction.status, extraction.attempts, extraction.error), ('pending', 0, ''))
+		self.run_worker()
+		extraction.refresh_from_db()
+		self.assertEqual(extraction.status, 'done')
+
+	def test_same_content_reuses_extraction(self):
+		content = make_pdf(['Shared'])
+		with self.captureOnCommitCallbacks(execute=True):
+			self.upload(content)
+		self.run_worker()
+
+		other_exam = Exam.objects.create(
+			user=self.user, title='Other', description='Description', exam_time='2030-01-01'
+		)
+		with self.captureOnCommitCallbacks(execute=True):
+			self.client.post(
+				f'/api/exams/{other_exam.id}/upload-material/',
+				{'file': SimpleUploadedFile('copy.pdf', content, content_type='application/pdf')},
+				format='multipart'
+			)
+		extraction = MaterialExtraction.objects.get()
+		self.assertEqual(extraction.status, 'done')
+		self.assertEqual(extraction.attempts, 1)
@@ -0,0 +1,136 @@
+"""
+Background text extraction for exam materials
+
+Uploads only queue a MaterialExtraction row (after commit); the
+process_material_extractions management command claims queued rows and
+extracts text page by page in worker processes, storing it as
+MaterialTextChunk rows. Extractions are keyed by content SHA-256, so
+uploading content that was already extracted reuses the earlier result.
+"""
+
+import io
+import re
+import logging
+import zipfile
+from xml.etree import ElementTree
+
+from django.db import transaction
+from django.utils import timezone
+
+try:
+    from pypdf import PdfReader
+    PDF_EXTRACTION_AVAILABLE = True
+except ImportError:
+    PDF_EXTRACTION_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Maximum characters stored in a single MaterialTextChunk row
+CHUNK_CHARS = 4000
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+class UnsupportedMaterial(Exception):
+    """Raised when no extractor is available for a file type"""
+
+
+def queue_material_extraction(checksum, name, content_type):
+    """
+    Queue text extraction for stored content unless it was already queued
+    or extracted; a failed extraction is queued again
+    """
+    from .models import MaterialExtraction
+
+    def create_job():
+        # Content stored again after a failed extraction gets a fresh set of attempts
+        retried = MaterialExtraction.objects.filter(checksum=checksum, status='failed').update(
+            status='pending', attempts=0, error='', name=name, content_type=content_type,
+            updated_at=timezone.now(),
+        )
+        if not retried:
+            MaterialExtraction.objects.get_or_create(
+                checksum=checksum,
+                defaults={'name': name, 'content_type': content_type},
+            )
+
+    transaction.on_commit(create_job)
+
+
+def extract_pdf_pages(path):
+    """Yield the text of each PDF page"""
+    if not PDF_EXTRACTION_AVAILABLE:
+        raise UnsupportedMaterial('pypdf is not installed')
+    reader = PdfReader(path)
+    for page in reader.pages:
+        yield page.extract_text() or ''
+
+
+def extract_docx_pages(path):
+    """
+    Return the text of each DOCX page. DOCX has no fixed layout, so pages are
+    split on the explicit and last-rendered page breaks saved by Word.
+    """
+    with zipfile.ZipFile(path) as archive:
+        document = archive.read('word/document.xml')
+
+    pages, paragraphs, runs = [], [], []
+    for _event, element in ElementTree.iterparse(io.BytesIO(document), events=('end',)):
+        tag = element.tag
+        if tag == f'{WORD_NS}t':
+            runs.append(element.text or '')
+        elif tag == f'{WORD_NS}tab':
+            runs.append('\t')
+        elif tag == f'{WORD_NS}p':
+            paragraphs.append(''.join(runs))
+            runs = []
+            element.clear()
+        elif tag == f'{WORD_NS}lastRenderedPageBreak' or (
+            tag == f'{WORD_NS}br' and element.get(f'{WORD_NS}type') == 'page'
+        ):
+            paragraphs.append(''.join(runs))
+            runs = []
+            pages.append('\n'.join(paragraphs))
+            paragraphs = []
+    paragraphs.append(''.join(runs))
+    pages.append('\n'.join(paragraphs))
+
+    # Word often writes both kinds of break for one page boundary
+    pages = [page for page in pages if page.strip()]
+    return pages or ['']
+
+
+def extract_pages(path, content_type):
+    """
+    Extract text page by page. Runs inside a worker process, so it only
+    touches the local file and returns plain data.
+    Returns a list of page texts.
+    """
+    if content_type == 'application/pdf':
+        pages = extract_pdf_pages(path)
+    elif content_type.endswith('wordprocessingml.document') or path.lower().endswith('.docx'):
+        pages = extract_docx_pages(path)
+    else:
+        raise UnsupportedMaterial(f'No text extractor for {content_type}')
+    return [normalize_text(text) for text in pages]
+
+
+def normalize_text(text):
+    """Collapse runs of blank space left by PDF layout and drop NULs, which PostgreSQL text rejects"""
+    text = text.replace('\x00', '')
+    text = re.sub(r'[ \t\r\f\v]+', ' ', text)
+    return re.sub(r'\n\s*\n+', '\n\n', text).strip()
+
+
+def split_page(text, size=CHUNK_CHARS):
+    """Split one page into chunks of at most `size` characters, on whitespace when possible"""
+    chunks = []
+    while len(text) > size:
+        cut = text.rfind(' ', 0, size)
+        if cut <= 0:
+            cut = size
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
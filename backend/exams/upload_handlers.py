@@ -0,0 +1,189 @@
+"""
+Streaming upload handling for exam materials and post attachments
+
+StreamingUploadHandler sits in front of Django's memory/temp-file handlers
+and inspects every chunk as it arrives: it hashes (SHA-256), counts bytes,
+aborts as soon as the size limit is crossed and sniffs the magic bytes of
+the first chunk. Results are attached to the UploadedFile objects, so views
+never need a second read of the file.
+"""
+
+import hashlib
+import os
+
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import MultiPartParser
+
+from .validators import MAX_MATERIAL_SIZE
+
+DOCX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# (magic bytes, detected content type)
+FILE_SIGNATURES = [
+    (b'%PDF-', 'application/pdf'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/msword'),  # OLE2 compound document
+    (b'PK\x03\x04', 'application/zip'),  # OOXML (docx) container
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+# Long enough for every signature above and the RIFF....WEBP header
+SNIFF_LENGTH = 12
+
+# Extension -> content type the magic bytes must show
+MATERIAL_TYPES = {
+    '.pdf': 'application/pdf',
+    '.doc': 'application/msword',
+    '.docx': 'application/zip',
+}
+
+# Allowance for multipart boundaries and form fields on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+def sniff_content_type(head):
+    """Content type detected from the leading bytes, or None if unknown"""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, content_type in FILE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    return None
+
+
+def material_content_type(file_name, head):
+    """
+    Content type of a material whose magic bytes match its extension in
+    MATERIAL_TYPES, or None if they do not
+    """
+    ext = os.path.splitext(file_name or '')[1].lower()
+    expected = MATERIAL_TYPES.get(ext)
+    if expected is None or sniff_content_type(head) != expected:
+        return None
+    return DOCX_CONTENT_TYPE if ext == '.docx' else expected
+
+
+class UploadRejected(ParseError):
+    """Upload aborted by StreamingUploadHandler"""
+
+
+class StreamingUploadHandler(FileUploadHandler):
+    """Hash, size and sniff each uploaded file in a single pass"""
+
+    def __init__(self, request=None, max_size=None, allowed_types=None, max_files=1):
+        super().__init__(request)
+        # max_size applies to each file; the body may carry max_files of them
+        self.max_size = max_size
+        self.max_files = max_files
+        self.allowed_types = allowed_types
+        self.results = {}
+        self.error = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # Reject before reading a byte when the whole body is obviously too large
+        if self.max_size and content_length and content_length > self.max_body_size:
+            self.error = _('Upload too large. Size should not exceed %(size)sMB in total.') % {
+                'size': self.max_body_size // (1024 * 1024)
+            }
+        return None
+
+    @property
+    def max_body_size(self):
+        return self.max_size * self.max_files + MULTIPART_OVERHEAD
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if self.error:
+            raise StopUpload(connection_reset=True)
+        if self.allowed_types is not None:
+            ext = os.path.splitext(self.file_name or '')[1].lower()
+            if ext not in self.allowed_types:
+                self.reject(_('File type not allowed. Please upload PDF, DOC, or DOCX files only.'))
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = b''
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.max_size and self.size > self.max_size:
+            self.reject(_('File too large. Size should not exceed %(size)sMB.') % {
+                'size': self.max_size // (1024 * 1024)
+            })
+
+        if len(self.head) < SNIFF_LENGTH:
+            self.head += raw_data[:SNIFF_LENGTH - len(self.head)]
+            if len(self.head) >= SNIFF_LENGTH:
+                self.check_signature()
+
+        self.digest.update(raw_data)
+        # Pass the chunk on to the handler that actually stores the file
+        return raw_data
+
+    def file_complete(self, file_size):
+        if len(self.head) < SNIFF_LENGTH:
+            self.check_signature()
+        detected = sniff_content_type(self.head)
+        if detected == 'application/zip' and (self.file_name or '').lower().endswith('.docx'):
+            detected = DOCX_CONTENT_TYPE
+        # Files of a field complete in order, matching the order in request.FILES
+        self.results.setdefault(self.field_name, []).append({
+            'sha256': self.digest.hexdigest(),
+            'size': self.size,
+            'detected_content_type': detected,
+        })
+        return None
+
+    def check_signature(self):
+        """Confirm the magic bytes match the file extension"""
+        if self.allowed_types is None:
+            return
+        ext = os.path.splitext(self.file_name or '')[1].lower()
+        if sniff_content_type(self.head) != self.allowed_types.get(ext):
+            self.reject(_('File content does not match its extension.'))
+
+    def reject(self, message):
+        """Abort the upload without reading the rest of the request body"""
+        self.error = message
+        raise StopUpload(connection_reset=True)
+
+
+class StreamingMultiPartParser(MultiPartParser):
+    """
+    MultiPartParser that installs StreamingUploadHandler first in the chain
+    and attaches its results (sha256, detected_content_type) to each file.
+    """
+
+    # Per file
+    max_size = None
+    allowed_types = None
+    # Files one request may carry, which bounds the whole body
+    max_files = 1
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        handler = StreamingUploadHandler(
+            request._request, max_size=self.max_size, allowed_types=self.allowed_types,
+            max_files=self.max_files,
+        )
+        request._request.upload_handlers = [handler, *request._request.upload_handlers]
+
+        data_and_files = super().parse(stream, media_type, parser_context)
+        if handler.error:
+            raise UploadRejected(handler.error)
+
+        for field_name, files in data_and_files.files.lists():
+            results = handler.results.get(field_name, [])
+            for uploaded_file, result in zip(files, results):
+                uploaded_file.sha256 = result['sha256']
+                uploaded_file.detected_content_type = result['detected_content_type']
+        return data_and_files
+
+
+class MaterialMultiPartParser(StreamingMultiPartParser):
+    """Multipart parser for exam material uploads (PDF/DOC/DOCX, 50MB)"""
+
+    max_size = MAX_MATERIAL_SIZE
+    allowed_types = MATERIAL_TYPES
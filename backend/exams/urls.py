@@ -10,6 +10,12 @@ urlpatterns = [
     path('<int:exam_id>/delete-material/', views.delete_exam_material, name='delete-exam-material'),
     path('<int:exam_id>/material-info/', views.get_exam_material_info, name='get-exam-material-info'),
     path('<int:exam_id>/download-url/', views.generate_material_download_url, name='generate-material-download-url'),
+    path('<int:exam_id>/material/', views.stream_exam_material, name='stream-exam-material'),
+    
+    # Direct-to-storage upload endpoints
+    path('<int:exam_id>/material-upload-session/', views.create_material_upload_session, name='create-material-upload-session'),
+    path('<int:exam_id>/material-upload-session/finalize/', views.finalize_material_upload, name='finalize-material-upload'),
+    path('direct-uploads/<str:token>/', views.receive_direct_material_upload, name='direct-material-upload'),
     
     # User materials management
     path('my-materials/', views.list_user_materials, name='list-user-materials'),
@@ -2,14 +2,16 @@ import os
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 
+ALLOWED_MATERIAL_EXTENSIONS = ['.pdf', '.doc', '.docx']
+MAX_MATERIAL_SIZE = 50 * 1024 * 1024  # 50MB in bytes
+
 
 def validate_file_extension(value):
     """Validate file extension for exam materials"""
     
-    allowed_extensions = ['.pdf', '.doc', '.docx']
     ext = os.path.splitext(value.name)[1].lower()
     
-    if ext not in allowed_extensions:
+    if ext not in ALLOWED_MATERIAL_EXTENSIONS:
         raise ValidationError(
             _('File type not allowed. Please upload PDF, DOC, or DOCX files only.'),
             code='invalid_extension',
@@ -19,9 +21,7 @@ def validate_file_extension(value):
 def validate_file_size(value):
     """Validate file size (max 10MB)"""
     
-    max_size = 50 * 1024 * 1024  # 10MB in bytes
-    
-    if value.size > max_size:
+    if value.size > MAX_MATERIAL_SIZE:
         raise ValidationError(
             _('File too large. Size should not exceed 10MB.'),
             code='file_too_large',
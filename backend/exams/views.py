@@ -1,31 +1,53 @@
 # pyright: reportMissingImports=false
 from rest_framework import generics, status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, parser_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.exceptions import NotFound
+from rest_framework.parsers import FormParser
+from datetime import datetime, timezone as dt_timezone
+import os
 from django.shortcuts import get_object_or_404
-from django.db import models
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from django.db import models, transaction
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
-from .models import Exam
+from mysite.pagination import KeysetPagination, KeysetPaginationMixin
+from .models import Exam, FinalizedMaterialUpload
 from .serializers import ExamSerializer
 from .storage_utils import gcs_manager
+from .validators import ALLOWED_MATERIAL_EXTENSIONS, MAX_MATERIAL_SIZE
+from .upload_handlers import SNIFF_LENGTH, MaterialMultiPartParser, UploadRejected, material_content_type
+from .material_store import adopt_material
+from .material_streaming import build_material_response
+from .direct_uploads import (
+    DirectUploadError, LocalDirectUploadBackend, build_object_name,
+    get_direct_upload_backend, load_session, sign_session
+)
 
 # Note: Discussion room views are imported dynamically to avoid circular imports
 
 # AI services are no longer used for study plans
 
-class ExamListCreateView(generics.ListCreateAPIView):
-    """Exam list and create view"""
+class ExamListCreateView(KeysetPaginationMixin, generics.ListCreateAPIView):
+    """Exam list and create view (?pagination=cursor for keyset pagination)"""
     
     permission_classes = [IsAuthenticated]
     serializer_class = ExamSerializer
-    parser_classes = [MultiPartParser, FormParser]  # Support file uploads
+    parser_classes = [MaterialMultiPartParser, FormParser]  # Support file uploads
     
     def get_queryset(self):
-        """Get all exams (visible to all users)"""
-        return Exam.objects.all()  # type: ignore
+        """Get all exams (visible to all users) with discussion stats annotated"""
+        queryset = Exam.objects.with_discussion_stats(self.request.user)  # type: ignore
+        
+        # Ranked search over title, description and category
+        query = self.request.query_params.get('q', '').strip()
+        if query:
+            queryset = queryset.search(query)
+        
+        return queryset
     
     def perform_create(self, serializer):
         """Create exam and associate with current user"""
@@ -36,11 +58,11 @@ class ExamDetailView(generics.RetrieveUpdateDestroyAPIView):
     
     permission_classes = [IsAuthenticated]
     serializer_class = ExamSerializer
-    parser_classes = [MultiPartParser, FormParser]  # Support file uploads
+    parser_classes = [MaterialMultiPartParser, FormParser]  # Support file uploads
     
     def get_queryset(self):
-        """Get all exams (all users can view details)"""
-        return Exam.objects.all()  # type: ignore
+        """Get all exams (all users can view details) with discussion stats annotated"""
+        return Exam.objects.with_discussion_stats(self.request.user)  # type: ignore
     
     def update(self, request, *args, **kwargs):
         """Only creator can update exam"""
@@ -75,6 +97,7 @@ class ExamDetailView(generics.RetrieveUpdateDestroyAPIView):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@parser_classes([MaterialMultiPartParser, FormParser])
 def upload_exam_material(request, exam_id):
     """Upload material file for an exam"""
     
@@ -89,8 +112,17 @@ def upload_exam_material(request, exam_id):
                 'message': _('Only the exam creator can upload materials')
             }, status=status.HTTP_403_FORBIDDEN)
         
-        # Check if file is provided
-        if 'file' not in request.FILES:
+        # Check if file is provided (parsing streams it through StreamingUploadHandler)
+        try:
+            files = request.FILES
+        except UploadRejected as e:
+            return Response({
+                'success': False,
+                'error': str(e.detail),
+                'message': _('File validation failed')
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        if 'file' not in files:
             return Response({
                 'success': False,
                 'error': _('No file provided'),
@@ -99,7 +131,7 @@ def upload_exam_material(request, exam_id):
         
         uploaded_file = request.FILES['file']
         
-        # Validate file
+        # Validate file (size, type and magic bytes are already checked while streaming)
         try:
             from .validators import validate_exam_material
             validate_exam_material(uploaded_file)
@@ -110,11 +142,16 @@ def upload_exam_material(request, exam_id):
                 'message': _('File validation failed')
             }, status=status.HTTP_400_BAD_REQUEST)
         
+        # Cached signed URLs for the replaced file must not outlive it
+        if exam.material:
+            gcs_manager.invalidate_signed_urls(exam.material.name)
+        
         # Save file to exam
         exam.material = uploaded_file
         exam.save()
         
         # Return updated exam data
+        exam = Exam.objects.with_discussion_stats(request.user).get(id=exam.id)
         serializer = ExamSerializer(exam, context={'request': request})
         return Response({
             'success': True,
@@ -130,6 +167,192 @@ def upload_exam_material(request, exam_id):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_material_upload_session(request, exam_id):
+    """Start a direct-to-storage upload so the file bytes bypass Django"""
+    
+    exam = get_object_or_404(Exam, id=exam_id)
+    
+    # Check permissions: only creator can upload materials
+    if request.user != exam.user:
+        return Response({
+            'success': False,
+            'error': _('You do not have permission to upload materials for this exam'),
+            'message': _('Only the exam creator can upload materials')
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    file_name = request.data.get('file_name', '')
+    content_type = request.data.get('content_type') or 'application/octet-stream'
+    try:
+        size = int(request.data.get('size', 0))
+    except (TypeError, ValueError):
+        size = 0
+    
+    ext = os.path.splitext(file_name)[1].lower()
+    if ext not in ALLOWED_MATERIAL_EXTENSIONS:
+        return Response({
+            'success': False,
+            'error': _('File type not allowed. Please upload PDF, DOC, or DOCX files only.'),
+            'message': _('File validation failed')
+        }, status=status.HTTP_400_BAD_REQUEST)
+    if size <= 0 or size > MAX_MATERIAL_SIZE:
+        return Response({
+            'success': False,
+            'error': _('File size must be between 1 byte and 50MB'),
+            'message': _('File validation failed')
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    object_name = build_object_name(file_name)
+    token = sign_session(exam.id, object_name, size, content_type)
+    try:
+        upload = get_direct_upload_backend().create_session(request, token, {
+            'name': object_name,
+            'size': size,
+            'content_type': content_type,
+        })
+    except Exception as e:
+        return Response({
+            'success': False,
+            'error': str(e),
+            'message': _('Failed to create upload session')
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    return Response({
+        'success': True,
+        'data': {
+            'upload_url': upload['upload_url'],
+            'method': upload['method'],
+            'object_name': object_name,
+            'session_token': token,
+            'content_type': content_type,
+            'size': size,
+        },
+        'message': _('Upload session created successfully')
+    }, status=status.HTTP_201_CREATED)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def finalize_material_upload(request, exam_id):
+    """Verify a directly uploaded object and attach it to the exam"""
+    
+    exam = get_object_or_404(Exam, id=exam_id)
+    
+    if request.user != exam.user:
+        return Response({
+            'success': False,
+            'error': _('You do not have permission to upload materials for this exam'),
+            'message': _('Only the exam creator can upload materials')
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    try:
+        session = load_session(request.data.get('session_token', ''))
+    except DirectUploadError as e:
+        return Response({
+            'success': False,
+            'error': str(e),
+            'message': _('Invalid upload session')
+        }, status=status.HTTP_400_BAD_REQUEST)
+    if session['exam_id'] != exam.id:
+        return Response({
+            'success': False,
+            'error': _('Upload session does not belong to this exam'),
+            'message': _('Invalid upload session')
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Session tokens are single-use: a replayed or retried finalize only
+    # reports the result, it must not reference the object a second time
+    if FinalizedMaterialUpload.objects.filter(object_name=session['name']).exists():
+        return finalized_material_response(request, exam)
+    
+    backend = get_direct_upload_backend()
+    stored_size = backend.get_object_size(session['name'])
+    if stored_size is None or stored_size != session['size']:
+        return Response({
+            'success': False,
+            'error': _('Uploaded object is missing or incomplete'),
+            'message': _('Please finish uploading the file before finalizing')
+        }, status=status.HTTP_409_CONFLICT)
+    
+    try:
+        storage = exam.material.storage
+        with storage.open(session['name'], 'rb') as material_file:
+            # The bytes never passed StreamingUploadHandler: sniff them here and
+            # take the content type from the sniff, not from the client
+            content_type = material_content_type(session['name'], material_file.read(SNIFF_LENGTH))
+            if content_type is not None:
+                material_file.seek(0)
+                exam.set_material_metadata(material_file)
+        if content_type is None:
+            backend.delete_object(session['name'])
+            return Response({
+                'success': False,
+                'error': _('File content does not match its extension.'),
+                'message': _('File validation failed')
+            }, status=status.HTTP_400_BAD_REQUEST)
+        exam.material_content_type = content_type
+        
+        previous_name = exam.material.name if exam.material else None
+        with transaction.atomic():
+            _finalized, created = FinalizedMaterialUpload.objects.get_or_create(
+                object_name=session['name'], defaults={'exam': exam}
+            )
+            if created:
+                # Deduplicate against content that is already stored
+                exam.material.name = adopt_material(
+                    storage, session['name'], exam.material_checksum,
+                    exam.material_size, exam.material_content_type
+                )
+                exam.save()
+        # Cached signed URLs for the replaced file must not outlive it
+        if created and previous_name:
+            gcs_manager.invalidate_signed_urls(previous_name)
+    except Exception as e:
+        return Response({
+            'success': False,
+            'error': str(e),
+            'message': _('Failed to upload material')
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    return finalized_material_response(request, exam)
+
+
+def finalized_material_response(request, exam):
+    exam = Exam.objects.with_discussion_stats(request.user).get(id=exam.id)
+    serializer = ExamSerializer(exam, context={'request': request})
+    return Response({
+        'success': True,
+        'data': serializer.data,
+        'message': _('Material uploaded successfully')
+    }, status=status.HTTP_200_OK)
+
+
+@csrf_exempt
+@require_http_methods(['PUT'])
+def receive_direct_material_upload(request, token):
+    """
+    Local stand-in for a GCS resumable upload URI.
+    The signed token authorizes the upload, like a GCS session URI does.
+    """
+    try:
+        session = load_session(token)
+        backend = get_direct_upload_backend()
+        if not isinstance(backend, LocalDirectUploadBackend):
+            raise DirectUploadError('Direct uploads go to cloud storage')
+        offset = backend.receive_chunk(session, request, request.headers.get('Content-Range'))
+    except DirectUploadError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if offset < session['size']:
+        # Resume Incomplete, as returned by GCS
+        response = HttpResponse(status=308)
+        if offset:
+            response['Range'] = f'bytes=0-{offset - 1}'
+        return response
+    return JsonResponse({'success': True, 'name': session['name'], 'size': offset}, status=status.HTTP_200_OK)
+
+
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
 def delete_exam_material(request, exam_id):
@@ -147,8 +370,8 @@ def delete_exam_material(request, exam_id):
             }, status=status.HTTP_403_FORBIDDEN)
         
         if exam.material:
-            # Delete the file from storage
-            exam.material.delete(save=False)
+            # Release the file; storage is deleted once no exam references it
+            gcs_manager.invalidate_signed_urls(exam.material.name)
             exam.material = None
             exam.save()
             
@@ -186,27 +409,11 @@ def get_exam_material_info(request, exam_id):
                 'message': _('This exam has no material file')
             }, status=status.HTTP_404_NOT_FOUND)
         
-        # Get file info from storage
-        file_info = {
-            'name': exam.material.name,
-            'url': exam.material.url,
-            'size': None,
-            'content_type': None,
-            'uploaded_at': exam.updated_at.isoformat() if exam.updated_at else None
-        }
-        
-        # If using GCS, get additional metadata
-        if hasattr(exam.material, 'name') and gcs_manager.client:
-            # Extract blob name from file path
-            blob_name = exam.material.name
-            blob_info = gcs_manager.get_blob_info(blob_name)
-            if blob_info:
-                file_info.update({
-                    'size': blob_info.get('size'),
-                    'content_type': blob_info.get('content_type'),
-                    'created': blob_info.get('created').isoformat() if blob_info.get('created') else None,
-                    'updated': blob_info.get('updated').isoformat() if blob_info.get('updated') else None
-                })
+        # Metadata is recorded at upload time, so no storage round trip is needed
+        file_info = exam.get_material_info()
+        # Kept for clients that read the former GCS blob fields
+        file_info['created'] = file_info['uploaded_at']
+        file_info['updated'] = exam.updated_at.isoformat() if exam.updated_at else None
         
         return Response({
             'success': True,
@@ -250,25 +457,38 @@ def generate_material_download_url(request, exam_id):
             }, status=status.HTTP_403_FORBIDDEN)
         
         # Get expiration time from request (default 1 hour)
-        expiration_minutes = request.data.get('expiration_minutes', 60)
+        try:
+            expiration_minutes = int(request.data.get('expiration_minutes', 60))
+        except (TypeError, ValueError):
+            expiration_minutes = 0
+        if expiration_minutes < 1:
+            return Response({
+                'success': False,
+                'error': _('expiration_minutes must be a positive whole number of minutes'),
+                'message': _('Invalid expiration time')
+            }, status=status.HTTP_400_BAD_REQUEST)
         if expiration_minutes > 1440:  # Max 24 hours
             expiration_minutes = 1440
         
-        # Generate signed URL if using GCS
+        # Generate signed URL if using GCS (reused from cache while enough lifetime remains)
         download_url = exam.material.url  # Default public URL
         
         if gcs_manager.client and hasattr(exam.material, 'name'):
             blob_name = exam.material.name
-            signed_url = gcs_manager.generate_signed_url(blob_name, expiration_minutes)
+            signed_url, expires_at = gcs_manager.get_signed_url(
+                blob_name, expiration_minutes, file_name=exam.material_file_name
+            )
             if signed_url:
                 download_url = signed_url
+                remaining = expires_at - datetime.now(dt_timezone.utc)
+                expiration_minutes = int(remaining.total_seconds() // 60)
         
         return Response({
             'success': True,
             'data': {
                 'download_url': download_url,
                 'expires_in_minutes': expiration_minutes,
-                'file_name': exam.material.name.split('/')[-1] if exam.material.name else 'material'
+                'file_name': exam.material_file_name
             },
             'message': _('Download URL generated successfully')
         }, status=status.HTTP_200_OK)
@@ -281,42 +501,78 @@ def generate_material_download_url(request, exam_id):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET', 'HEAD'])
+@permission_classes([IsAuthenticated])
+def stream_exam_material(request, exam_id):
+    """Stream exam material with Range and ETag/Last-Modified support"""
+    exam = get_object_or_404(Exam, id=exam_id)
+    
+    if not exam.material:
+        return Response({
+            'success': False,
+            'error': _('No material file found'),
+            'message': _('This exam has no material file')
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    # Same rule as download URLs: exam creator or discussion room members
+    if request.user != exam.user and not exam.is_discussion_member(request.user):
+        return Response({
+            'success': False,
+            'error': _('You do not have permission to download this material'),
+            'message': _('Only exam creator and discussion room members can download materials')
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    return build_material_response(request, exam)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def list_user_materials(request):
-    """List all materials uploaded by the current user"""
+    """List materials uploaded by the current user, a cursor page at a time"""
     
     try:
-        user_exams = Exam.objects.filter(user=request.user, material__isnull=False)
+        user_exams = Exam.objects.filter(user=request.user, material__isnull=False).exclude(material='')
+        
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(user_exams, request)
+        
+        # Legacy rows without stored metadata: ask storage for the whole page at once
+        missing = [exam.material.name for exam in page if exam.material_size is None]
+        blob_info = gcs_manager.get_blobs_info(missing) if missing else {}
         
         materials = []
-        for exam in user_exams:
-            material_info = {
+        for exam in page:
+            info = blob_info.get(exam.material.name) or {}
+            uploaded_at = exam.material_uploaded_at or info.get('created')
+            materials.append({
                 'exam_id': exam.id,
                 'exam_title': exam.title,
-                'material_name': exam.material.name.split('/')[-1] if exam.material.name else 'Unknown',
+                'material_name': exam.material_file_name,
                 'material_url': exam.material.url,
-                'uploaded_at': exam.updated_at.isoformat() if exam.updated_at else None
-            }
-            
-            # Get file size if available
-            if gcs_manager.client and hasattr(exam.material, 'name'):
-                blob_info = gcs_manager.get_blob_info(exam.material.name)
-                if blob_info:
-                    material_info['size'] = blob_info.get('size')
-                    material_info['content_type'] = blob_info.get('content_type')
-            
-            materials.append(material_info)
+                'uploaded_at': uploaded_at.isoformat() if uploaded_at else None,
+                'size': exam.material_size if exam.material_size is not None else info.get('size'),
+                'content_type': exam.material_content_type or info.get('content_type'),
+                'checksum': exam.material_checksum or None,
+            })
+        
+        # Counted once, on the first page; later pages would repeat a COUNT(*) per request
+        total_count = None
+        if paginator.cursor_query_param not in request.query_params:
+            total_count = user_exams.count() if paginator.has_next else len(page)
         
         return Response({
             'success': True,
             'data': {
                 'materials': materials,
-                'total_count': len(materials)
+                'total_count': total_count,
+                'next': paginator.get_next_link(),
+                'previous': paginator.get_previous_link(),
             },
             'message': _('User materials retrieved successfully')
         }, status=status.HTTP_200_OK)
         
+    except NotFound:
+        raise
     except Exception as e:
         return Response({
             'success': False,
@@ -104,6 +104,7 @@ class Goal(models.Model):
             models.Index(fields=['status']),  # 状态索引
             models.Index(fields=['visibility']),  # 可见性索引
             models.Index(fields=['target_date']),  # 目标日期索引
+            models.Index(fields=['user', '-created_at', '-id'], name='goals_goal_user_created_idx'),  # 游标分页索引
         ]
     
     def __str__(self):
@@ -7,6 +7,7 @@ from django.shortcuts import get_object_or_404
 from django.db.models import Count
 from .models import Goal, AISuggestion, GoalCategory, GoalStatus
 from django.db import models
+from mysite.pagination import KeysetPaginationMixin
 
 
 # Import the new AI service
@@ -29,8 +30,8 @@ from .serializers import (
 )
 
 
-class GoalListCreateView(generics.ListCreateAPIView):
-    """目标列表和创建视图"""
+class GoalListCreateView(KeysetPaginationMixin, generics.ListCreateAPIView):
+    """目标列表和创建视图（?pagination=cursor 使用游标分页）"""
     
     permission_classes = [IsAuthenticated]
     serializer_class = GoalSerializer
@@ -0,0 +1,215 @@
+"""
+Keyset (cursor) pagination
+
+PageNumberPagination issues COUNT(*) and OFFSET, both of which get slower the
+deeper the page. KeysetPagination instead remembers the sort key of the last
+row and asks for rows strictly after it:
+
+    WHERE (created_at, id) < (:created_at, :id) ORDER BY created_at DESC, id DESC
+
+so every page costs one index range scan regardless of depth. The ordering is
+taken from the queryset (order_by() or Meta.ordering, including annotated
+ranking scores) and the primary key is appended as a tie-breaker.
+
+List views opt in per request with ?pagination=cursor (or by passing a
+?cursor= returned earlier) through KeysetPaginationMixin; requests without
+either keep the default page-number pagination.
+"""
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def encode_value(value):
+    """JSON-safe cursor value; datetimes keep full microsecond precision"""
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination on (ordering fields..., pk) without COUNT or OFFSET"""
+
+    page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE', 20)
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    mode_value = 'cursor'
+    invalid_cursor_message = _('Invalid cursor')
+
+    @classmethod
+    def is_requested(cls, request):
+        """Whether the client asked for cursor pagination"""
+        params = request.query_params
+        return params.get(cls.mode_query_param) == cls.mode_value or cls.cursor_query_param in params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+
+        cursor = self.decode_cursor(request)
+        self.reverse = bool(cursor and cursor.get('r'))
+        ordering = [self.flip(field) for field in self.ordering] if self.reverse else self.ordering
+
+        queryset = queryset.order_by(*ordering)
+        if cursor:
+            queryset = queryset.filter(self.after(ordering, cursor['p']))
+
+        rows = self.fetch(queryset, self.page_size + 1, view)
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        if self.reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        self.page = rows
+        return rows
+
+    def fetch(self, queryset, limit, view=None):
+        """Up to limit rows of the ordered, cursor-filtered queryset"""
+        return list(queryset[:limit])
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(size, self.max_page_size) if size > 0 else self.page_size
+
+    def get_ordering(self, queryset):
+        """Sort fields of the queryset with the primary key appended as a tie-breaker"""
+        query = queryset.query
+        if query.order_by:
+            ordering = list(query.order_by)
+        elif query.default_ordering:
+            ordering = list(queryset.model._meta.ordering)
+        else:
+            ordering = []
+
+        for field in ordering:
+            if not isinstance(field, str) or '__' in field or field.startswith('?'):
+                raise ImproperlyConfigured(
+                    f'KeysetPagination needs plain field or annotation names to order by, got {field!r}'
+                )
+
+        pk_names = {'pk', queryset.model._meta.pk.name}
+        if not any(field.lstrip('-') in pk_names for field in ordering):
+            last_descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append('-pk' if last_descending else 'pk')
+        return ordering
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def after(ordering, position):
+        """
+        Q for rows sorting strictly after `position`:
+        (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND c > z) ...
+        using < instead of > for descending fields
+        """
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def position(self, instance):
+        return [encode_value(getattr(instance, field.lstrip('-'))) for field in self.ordering]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(cursor, dict) or len(cursor.get('p') or []) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def encode_cursor(self, position, reverse):
+        payload = {'p': position}
+        if reverse:
+            payload['r'] = 1
+        encoded = urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode('ascii')
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.mode_query_param, self.mode_value)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # Paged backwards past the first row: restart from the top
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.position(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        """
+        Keep the {'success', 'data'} envelope; views that already wrapped
+        their payload get the links merged into it
+        """
+        links = {'next': self.get_next_link(), 'previous': self.get_previous_link()}
+        if isinstance(data, dict) and 'success' in data:
+            return Response({**data, **links})
+        return Response({'success': True, 'data': data, **links})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'success': {'type': 'boolean'},
+                'data': schema,
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+            },
+        }
+
+
+class KeysetPaginationMixin:
+    """
+    For generic list views: use KeysetPagination when the request opts in,
+    otherwise the view's regular pagination_class
+    """
+
+    keyset_pagination_class = KeysetPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.keyset_pagination_class.is_requested(self.request):
+                self._paginator = self.keyset_pagination_class()
+            elif self.pagination_class is None:
+                self._paginator = None
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
@@ -194,6 +194,12 @@ if config('REDIS_URL', default=''):
             }
         }
     }
+    # 讨论区实时事件通过Redis在多个worker之间扇出
+    DISCUSSION_EVENTS_BACKEND = config('DISCUSSION_EVENTS_BACKEND', default='redis')
+    DISCUSSION_EVENTS_REDIS_URL = config('REDIS_URL')
+    # 投票写缓冲（可选）：设置 DISCUSSION_VOTE_BUFFER=redis 后投票先写入Redis，再批量落库
+    DISCUSSION_VOTE_BUFFER = config('DISCUSSION_VOTE_BUFFER', default='')
+    DISCUSSION_VOTE_BUFFER_REDIS_URL = config('REDIS_URL')
 
 # 邮件配置
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
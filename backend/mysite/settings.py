@@ -42,6 +42,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # Full-text search / trigram lookups
     'rest_framework',
     'rest_framework.authtoken',
     'corsheaders',
@@ -232,6 +233,33 @@ CORS_EXPOSE_HEADERS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# nginx internal location aliasing MEDIA_ROOT (e.g. '/protected-media/'); when set,
+# local material streams are handed off with X-Accel-Redirect instead of read by Django
+MATERIAL_ACCEL_REDIRECT_PREFIX = os.environ.get('MATERIAL_ACCEL_REDIRECT_PREFIX', '')
+
+# Realtime discussion room events over WebSocket (discussions.events): 'memory' fans out
+# within one process only, 'redis' through Redis pub/sub across workers
+DISCUSSION_EVENTS_BACKEND = os.environ.get('DISCUSSION_EVENTS_BACKEND', 'memory')
+DISCUSSION_EVENTS_REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+# Events a connection may fall behind before it is closed, and the idle ping interval in seconds
+DISCUSSION_EVENTS_QUEUE_SIZE = int(os.environ.get('DISCUSSION_EVENTS_QUEUE_SIZE', '100'))
+DISCUSSION_EVENTS_HEARTBEAT = int(os.environ.get('DISCUSSION_EVENTS_HEARTBEAT', '30'))
+
+# Write-behind vote buffering (discussions.vote_buffer): '' writes every vote straight to the
+# database, 'memory' buffers within one process, 'redis' across workers
+DISCUSSION_VOTE_BUFFER = os.environ.get('DISCUSSION_VOTE_BUFFER', '')
+DISCUSSION_VOTE_BUFFER_REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+# Seconds between bulk writes of buffered votes
+DISCUSSION_VOTE_FLUSH_INTERVAL = float(os.environ.get('DISCUSSION_VOTE_FLUSH_INTERVAL', '0.3'))
+
+# Post attachments (discussions.attachments): threads per process writing files to storage,
+# and threads generating image thumbnails after commit
+DISCUSSION_ATTACHMENT_UPLOAD_WORKERS = int(os.environ.get('DISCUSSION_ATTACHMENT_UPLOAD_WORKERS', '4'))
+DISCUSSION_ATTACHMENT_THUMBNAIL_WORKERS = int(os.environ.get('DISCUSSION_ATTACHMENT_THUMBNAIL_WORKERS', '2'))
+
+# Seconds to cache the ids of each user's first cross-room feed page (discussions.feed); 0 disables
+DISCUSSION_FEED_CACHE_TIMEOUT = int(os.environ.get('DISCUSSION_FEED_CACHE_TIMEOUT', '0'))
+
 # Google Cloud Storage configuration
 USE_GCS = os.environ.get('USE_GCS', 'False').lower() == 'true'
 
@@ -244,6 +272,11 @@ if USE_GCS:
     # Only use GOOGLE_APPLICATION_CREDENTIALS if not on Google Cloud
     GS_CREDENTIALS = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
     
+    # GCS HTTP connection pool (per worker process) and API timeouts in seconds
+    GCS_HTTP_POOL_SIZE = int(os.environ.get('GCS_HTTP_POOL_SIZE', '10'))
+    GCS_CONNECT_TIMEOUT = float(os.environ.get('GCS_CONNECT_TIMEOUT', '5'))
+    GCS_READ_TIMEOUT = float(os.environ.get('GCS_READ_TIMEOUT', '60'))
+    
     # Use GCS for media files
     DEFAULT_FILE_STORAGE = 'mysite.storage_backends.GoogleCloudMediaFileStorage'
     
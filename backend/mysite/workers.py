@@ -0,0 +1,32 @@
+"""
+Gunicorn worker class for the WebSocket process (see production_deploy.sh)
+
+    gunicorn mysite.asgi:application --worker-class mysite.workers.UvicornWorker
+
+Only /ws/ is routed to this process. The API stays on the sync WSGI
+workers: under ASGI every sync DRF view would run on the single
+thread-sensitive sync_to_async thread of its worker, one request at a time.
+Since the API publishes room events from other processes, a worker refuses
+to boot unless DISCUSSION_EVENTS_BACKEND reaches across processes (redis).
+"""
+
+import os
+
+from uvicorn.workers import UvicornWorker as BaseUvicornWorker
+
+
+class UvicornWorker(BaseUvicornWorker):
+    # Room events are small JSON frames, while a per-message-deflate zlib context
+    # costs ~90 KiB per connection: without it an idle WebSocket takes ~30 KiB
+    CONFIG_KWARGS = {**BaseUvicornWorker.CONFIG_KWARGS, 'ws_per_message_deflate': False}
+
+    def init_process(self):
+        import django
+
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+        django.setup()
+        from discussions.events import check_cross_process_broker
+
+        # An ImproperlyConfigured here stops the worker from booting, and gunicorn with it
+        check_cross_process_broker()
+        super().init_process()
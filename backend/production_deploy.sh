@@ -16,6 +16,7 @@ NC='\033[0m'
 PROJECT_DIR="/home/siyuanlou/innergrow.ai/backend"
 VENV_DIR="$PROJECT_DIR/.venv"
 GUNICORN_PID="$PROJECT_DIR/gunicorn.pid"
+WEBSOCKET_PID="$PROJECT_DIR/websocket.pid"
 LOG_DIR="$PROJECT_DIR/logs"
 
 # 域名配置（可通过环境变量设置）
@@ -159,6 +160,61 @@ start_gunicorn() {
     fi
 }
 
+# 停止讨论区WebSocket进程
+stop_websocket() {
+    if [ -f "$WEBSOCKET_PID" ]; then
+        log_info "停止现有的WebSocket进程..."
+        PID=$(cat "$WEBSOCKET_PID")
+        if kill -0 $PID > /dev/null 2>&1; then
+            kill $PID
+            log_success "WebSocket进程已停止"
+        else
+            log_warning "PID文件存在但进程不存在，清理PID文件"
+        fi
+        rm -f "$WEBSOCKET_PID"
+    fi
+}
+
+# 启动讨论区WebSocket服务
+# API仍由上面的同步WSGI worker处理；这里只有一个独立的ASGI进程承载 /ws/ 长连接，
+# 反向代理需把 /ws/ 转发到 $WS_BIND_ADDRESS（带 Upgrade/Connection 头），其余请求仍转发到 $BIND_ADDRESS。
+# 每个空闲连接约占 40KB 内存，单个 uvicorn worker 可承载数千连接，一般无需增加 WS_WORKERS。
+start_websocket() {
+    log_info "启动讨论区WebSocket服务..."
+    
+    export DJANGO_SETTINGS_MODULE="mysite.production_settings"
+    
+    WS_WORKERS=${WS_WORKERS:-1}
+    WS_BIND_ADDRESS=${WS_BIND_ADDRESS:-"127.0.0.1:8001"}
+    
+    # API进程发布的事件只能经Redis到达独立的WebSocket进程；'memory' 后端下客户端永远收不到事件
+    if ! python -c "import django; django.setup(); from discussions.events import check_cross_process_broker; check_cross_process_broker()"; then
+        log_error "讨论区实时事件需要Redis：请设置 REDIS_URL（且 DISCUSSION_EVENTS_BACKEND 为 redis），WebSocket服务未启动"
+        return 1
+    fi
+    
+    gunicorn mysite.asgi:application \
+        --worker-class mysite.workers.UvicornWorker \
+        --bind "$WS_BIND_ADDRESS" \
+        --workers $WS_WORKERS \
+        --pid "$WEBSOCKET_PID" \
+        --access-logfile "$LOG_DIR/websocket_access.log" \
+        --error-logfile "$LOG_DIR/websocket_error.log" \
+        --log-level info \
+        --daemon
+    
+    sleep 2
+    
+    if [ -f "$WEBSOCKET_PID" ] && kill -0 $(cat "$WEBSOCKET_PID") > /dev/null 2>&1; then
+        log_success "WebSocket服务启动成功"
+        log_info "PID: $(cat $WEBSOCKET_PID)"
+        log_info "监听地址: $WS_BIND_ADDRESS"
+    else
+        log_error "WebSocket服务启动失败"
+        exit 1
+    fi
+}
+
 # 检查服务状态
 check_status() {
     if [ -f "$GUNICORN_PID" ] && kill -0 $(cat "$GUNICORN_PID") > /dev/null 2>&1; then
@@ -177,14 +233,22 @@ check_status() {
     else
         log_warning "服务未运行"
     fi
+    
+    if [ -f "$WEBSOCKET_PID" ] && kill -0 $(cat "$WEBSOCKET_PID") > /dev/null 2>&1; then
+        log_success "WebSocket服务正在运行 (PID: $(cat $WEBSOCKET_PID))"
+    else
+        log_warning "WebSocket服务未运行"
+    fi
 }
 
 # 重启服务
 restart_service() {
     log_info "重启Gunicorn服务..."
     stop_gunicorn
+    stop_websocket
     sleep 2
     start_gunicorn
+    start_websocket
 }
 
 # 查看日志
@@ -260,15 +324,19 @@ main() {
             run_migrations
             collect_static
             stop_gunicorn
+            stop_websocket
             start_gunicorn
+            start_websocket
             check_status
             ;;
         "start")
             start_gunicorn
+            start_websocket
             check_status
             ;;
         "stop")
             stop_gunicorn
+            stop_websocket
             ;;
         "restart")
             restart_service